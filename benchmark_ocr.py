@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for OCR performance options.
+Run this script to compare per-page latency of engine configurations.
+
+Usage:
+    python benchmark_ocr.py {dedup,onnx-parity,orientation,preprocessing,rec-batching} [--images DIR] [--repeat N]
+"""
+
+import argparse
+import difflib
+import io
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import django
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Add the project directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Setup Django
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "img_medreport_scanner.settings")
+django.setup()
+
+from ocr.utils import log_memory_usage
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+
+
+def create_test_image(width=2000, height=1500):
+    """Create a test image with text-like patterns for benchmarking"""
+    img_array = np.ones((height, width, 3), dtype=np.uint8) * 255
+
+    for i in range(0, height, 100):
+        for j in range(0, width, 200):
+            img_array[i : i + 20, j : j + 150] = 0  # Black rectangles
+
+    return Image.fromarray(img_array)
+
+
+def load_images(images_dir=None):
+    """Load benchmark images from a directory, or fall back to a synthetic page"""
+    if not images_dir:
+        return [("synthetic", create_test_image())]
+
+    images = []
+    for path in sorted(Path(images_dir).iterdir()):
+        if path.suffix.lower() in IMAGE_EXTENSIONS:
+            with Image.open(path) as img:
+                img.load()
+                images.append((path.name, img.copy()))
+    return images
+
+
+def time_per_page(fn, images, repeat):
+    """Run fn over every image `repeat` times and return mean seconds per page"""
+    fn(images[0][1])  # Warm-up run, excluded from timing
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, img in images:
+            fn(img)
+    return (time.perf_counter() - start) / (repeat * len(images))
+
+
+def bench_orientation(images, repeat):
+    """Compare per-line angle classification with the page-level orientation pre-pass"""
+    from ocr.engines.paddle_ocr_engine import PaddleOCREngine
+
+    # Rotated variants exercise the pre-pass the way sideways fax pages do
+    rotated = []
+    for name, img in images:
+        rotated.append((name, img))
+        rotated.append((f"{name}@90", img.transpose(Image.Transpose.ROTATE_90)))
+        rotated.append((f"{name}@180", img.transpose(Image.Transpose.ROTATE_180)))
+
+    results = {}
+    for method in ("off", "projection", "osd"):
+        engine = PaddleOCREngine(page_orientation=method)
+        engine.initialize()
+        if not engine.is_ready()[0]:
+            print(f"{method}: engine not ready ({engine.is_ready()[1]})")
+            continue
+        try:
+            results[method] = time_per_page(engine.extract_text, rotated, repeat)
+        except Exception as e:
+            print(f"{method}: error {e}")
+            continue
+        log_memory_usage(f"After orientation={method}")
+
+    baseline = results.get("off")
+    for method, seconds in results.items():
+        saved = f", saved {baseline - seconds:+.3f}s" if baseline else ""
+        print(f"orientation={method:<10} {seconds:.3f}s/page{saved}")
+
+
+PREPROCESSING_VARIANTS = [
+    [],
+    ["grayscale"],
+    ["grayscale", "deskew"],
+    ["grayscale", "deskew", "denoise", "binarize"],
+]
+
+
+def bench_preprocessing(images, repeat):
+    """Compare preprocessing step sets: buffer size, peak memory, latency and confidence"""
+    from ocr.engines.factory import OCREngineFactory
+    from ocr.preprocessing import PreprocessingPipeline
+
+    # Skewed variants exercise deskewing the way crooked fax scans do
+    skewed = []
+    for name, img in images:
+        skewed.append((name, img))
+        skewed.append((f"{name}@2deg", img.rotate(2, fillcolor="white", expand=True)))
+
+    for engine_name in ("Tesseract", "PaddleOCR", "PaddleTable"):
+        engine = OCREngineFactory.get_engine(engine_name)
+        if not engine.is_ready()[0]:
+            print(f"{engine_name}: engine not ready ({engine.is_ready()[1]})")
+            continue
+
+        original = engine.preprocessing
+        print(f"--- {engine_name} ---")
+        for steps in PREPROCESSING_VARIANTS:
+            engine.preprocessing = PreprocessingPipeline(
+                steps, output_channels=original.output_channels
+            )
+            label = "+".join(steps) or "rgb"
+
+            # Preprocessing alone: latency, output buffer and peak allocation
+            tracemalloc.start()
+            preprocess_seconds = time_per_page(engine.preprocess_image, skewed, repeat)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            buffer_bytes = engine.preprocess_image(skewed[0][1]).nbytes
+
+            # End to end: latency and confidence
+            confidences = []
+
+            def run(img):
+                _, conf, _ = engine.extract_text(img)
+                if conf is not None:
+                    confidences.append(conf)
+
+            total_seconds = time_per_page(run, skewed, 1)
+            mean_conf = sum(confidences) / len(confidences) if confidences else None
+            conf_text = f"{mean_conf:.3f}" if mean_conf is not None else "n/a"
+
+            print(
+                f"{label:<32} preprocess {preprocess_seconds * 1000:7.1f} ms "
+                f"buffer {buffer_bytes / 1024 / 1024:6.2f} MB "
+                f"peak {peak / 1024 / 1024:6.2f} MB "
+                f"total {total_seconds:.3f}s/page conf {conf_text}"
+            )
+        engine.preprocessing = original
+        log_memory_usage(f"After {engine_name} preprocessing benchmark")
+
+
+# Minimum difflib ratio between PaddleOCR and PaddleONNX text for a page to pass
+ONNX_PARITY_MIN_SIMILARITY = 0.98
+
+
+def bench_onnx_parity(images, repeat):
+    """Compare PaddleONNX with PaddleOCR: text similarity, confidence and latency.
+
+    Exits non-zero when any page's text similarity falls below
+    ONNX_PARITY_MIN_SIMILARITY, so it can gate a model export.
+    """
+    from ocr.engines.paddle_ocr_engine import PaddleOCREngine
+    from ocr.engines.paddle_onnx_engine import PaddleONNXEngine
+
+    engines = {"PaddleOCR": PaddleOCREngine(), "PaddleONNX": PaddleONNXEngine()}
+    for name, engine in engines.items():
+        engine.initialize()
+        if not engine.is_ready()[0]:
+            print(f"{name}: engine not ready ({engine.is_ready()[1]})")
+            sys.exit(1)
+
+    failures = 0
+    totals = {name: 0.0 for name in engines}
+    for image_name, img in images:
+        outputs = {}
+        for name, engine in engines.items():
+            seconds = time_per_page(engine.extract_text, [(image_name, img)], repeat)
+            totals[name] += seconds
+            text, conf, _ = engine.extract_text(img)
+            outputs[name] = (text, conf, seconds)
+
+        (paddle_text, paddle_conf, paddle_s), (onnx_text, onnx_conf, onnx_s) = (
+            outputs["PaddleOCR"],
+            outputs["PaddleONNX"],
+        )
+        similarity = difflib.SequenceMatcher(None, paddle_text, onnx_text).ratio()
+        conf_delta = (
+            f"{onnx_conf - paddle_conf:+.3f}"
+            if paddle_conf is not None and onnx_conf is not None
+            else "n/a"
+        )
+        passed = similarity >= ONNX_PARITY_MIN_SIMILARITY
+        failures += not passed
+        print(
+            f"{image_name:<32} similarity {similarity:.3f} conf {conf_delta} "
+            f"paddle {paddle_s:.3f}s onnx {onnx_s:.3f}s "
+            f"{'ok' if passed else 'MISMATCH'}"
+        )
+        if not passed:
+            print(f"  paddle: {paddle_text!r}\n  onnx:   {onnx_text!r}")
+
+    speedup = totals["PaddleOCR"] / totals["PaddleONNX"] if totals["PaddleONNX"] else 0
+    print(
+        f"mean latency paddle {totals['PaddleOCR'] / len(images):.3f}s "
+        f"onnx {totals['PaddleONNX'] / len(images):.3f}s ({speedup:.2f}x)"
+    )
+    log_memory_usage("After ONNX parity benchmark")
+    if failures:
+        print(
+            f"{failures} of {len(images)} pages below similarity {ONNX_PARITY_MIN_SIMILARITY}"
+        )
+        sys.exit(1)
+
+
+LAB_ROWS = [
+    ("Glucose, fasting", "95", "mg/dL", "70-99"),
+    ("Hemoglobin A1c", "5.4", "%", "4.0-5.6"),
+    ("Sodium", "139", "mmol/L", "135-145"),
+    ("Potassium", "4.1", "mmol/L", "3.5-5.1"),
+    ("Blood Urea Nitrogen", "14", "mg/dL", "7-20"),
+    ("Creatinine", "0.92", "mg/dL", "0.6-1.3"),
+    ("Alanine Aminotransferase (ALT)", "23", "U/L", "7-56"),
+    ("Cholesterol, total", "212", "mg/dL", "<200"),
+    ("HDL", "48", "mg/dL", ">40"),
+    ("Thyroid Stimulating Hormone", "2.31", "uIU/mL", "0.45-4.5"),
+]
+
+
+def create_lab_sheet(rows=48, width=1700, height=2400):
+    """Dense lab sheet: a long header and many short and long table cells"""
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=26)
+    draw.text(
+        (60, 40),
+        "Comprehensive Metabolic Panel - collected 2024-03-02 08:14 - reported 2024-03-02 13:40",
+        fill="black",
+        font=font,
+    )
+    for i in range(rows):
+        name, value, unit, reference = LAB_ROWS[i % len(LAB_ROWS)]
+        y = 120 + i * 46
+        draw.text((60, y), name, fill="black", font=font)
+        draw.text((760, y), value, fill="black", font=font)
+        draw.text((960, y), unit, fill="black", font=font)
+        draw.text((1220, y), reference, fill="black", font=font)
+    return img
+
+
+def bench_rec_batching(images, repeat):
+    """Line recognition throughput and padding with and without width bucketing"""
+    from ocr.languages import engine_language_code, get_default_language
+    from ocr.text_lines import line_aspect_ratios, padding_fraction
+
+    def create_onnx():
+        from ocr.engines.paddle_onnx_engine import PaddleONNXEngine
+
+        return PaddleONNXEngine()
+
+    def create_batched():
+        from ocr.engines.paddle_batched_ocr_engine import PaddleBatchedOCREngine
+
+        rec_model = engine_language_code("PaddleBatched", get_default_language())
+        return PaddleBatchedOCREngine(rec_model)
+
+    if images[0][0] == "synthetic":
+        images = [("lab-sheet", create_lab_sheet())]
+
+    for engine_name, create in (
+        ("PaddleONNX", create_onnx),
+        ("PaddleBatched", create_batched),
+    ):
+        try:
+            engine = create()
+        except ImportError as e:
+            print(f"{engine_name}: not installed ({e})")
+            continue
+        engine.initialize()
+        if not engine.is_ready()[0]:
+            print(f"{engine_name}: engine not ready ({engine.is_ready()[1]})")
+            continue
+
+        # Detection runs once; only recognition is timed
+        pages = []
+        for _, img in images:
+            img_np = np.ascontiguousarray(engine.preprocess_image(img))
+            pages.append((img_np, engine._detect(img_np)))
+        lines = sum(len(boxes) for _, boxes in pages)
+        ratios = np.concatenate(
+            [line_aspect_ratios(np.asarray(boxes)) for _, boxes in pages if boxes]
+        )
+        print(f"--- {engine_name}: {lines} lines on {len(pages)} pages ---")
+
+        baseline = None
+        for batch_size in (1, 6, 16, 32):
+            for bucketed in (False, True):
+                if batch_size == 1 and bucketed:
+                    continue
+                engine.rec_batch_size = batch_size
+                engine.bucket_by_width = bucketed
+                engine._recognize(*pages[0])  # Warm-up run, excluded from timing
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    results = [
+                        engine._recognize(img_np, boxes) for img_np, boxes in pages
+                    ]
+                seconds = (time.perf_counter() - start) / repeat
+
+                texts = [text for page in results for text, _ in page]
+                if baseline is None:
+                    baseline = texts
+                changed = sum(a != b for a, b in zip(texts, baseline))
+                padding = padding_fraction(ratios, 48, 320, batch_size, sort=bucketed)
+                label = (
+                    f"batch {batch_size:>2} {'bucketed' if bucketed else 'in order'}"
+                )
+                print(
+                    f"{label:<20} {lines / seconds:8.1f} lines/s "
+                    f"padding {padding:6.1%} lines changed vs batch 1: {changed}"
+                )
+        log_memory_usage(f"After {engine_name} recognition batching benchmark")
+
+
+def _rescan(img, dx=0, dy=0, angle=0.0, noise=6.0, jpeg_quality=None, seed=0):
+    """Simulate a re-scan or re-fax: shift, rotation, sensor noise, re-encoding"""
+    img = img.convert("L")
+    if dx or dy:
+        img = img.transform(
+            img.size, Image.AFFINE, (1, 0, -dx, 0, 1, -dy), fillcolor=255
+        )
+    if angle:
+        img = img.rotate(angle, resample=Image.BICUBIC, fillcolor=255)
+    pixels = np.asarray(img, dtype=np.float32)
+    pixels = pixels + np.random.default_rng(seed).normal(0, noise, pixels.shape)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    if jpeg_quality:
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=jpeg_quality)
+        buffer.seek(0)
+        img = Image.open(buffer).convert("L")
+    return img
+
+
+def _edit_value(img, row, value):
+    """Overwrite the value column of one row of a lab sheet"""
+    img = img.copy()
+    draw = ImageDraw.Draw(img)
+    y = 120 + row * 46
+    draw.rectangle((760, y, 940, y + 32), fill="white")
+    draw.text((760, y), value, fill="black", font=ImageFont.load_default(size=26))
+    return img
+
+
+def bench_dedup(images, repeat):
+    """Near-duplicate verification: re-scans must be reused, edited pages must not"""
+    from ocr.dedup import NearDuplicateIndex, PageHash, max_block_difference
+
+    if images[0][0] == "synthetic":
+        images = [("lab-sheet", create_lab_sheet())]
+    index = NearDuplicateIndex()
+
+    failures = 0
+    for name, img in images:
+        print(f"--- {name} ---")
+        stored = PageHash.from_image(img)
+        index.add(stored, name)
+        cases = [
+            ("noise", _rescan(img), True),
+            ("jpeg 60", _rescan(img, jpeg_quality=60), True),
+            ("shift 1px", _rescan(img, dx=1), True),
+            ("shift 2px", _rescan(img, dx=2, dy=1), True),
+            ("shift 8px", _rescan(img, dx=8, dy=5), True),
+            ("rotate 0.3", _rescan(img, angle=0.3), True),
+            ("rotate 1.0", _rescan(img, angle=1.0), True),
+            (
+                "rescale +1px",
+                _rescan(img.resize((img.width + 1, img.height + 1))),
+                True,
+            ),
+            ("re-fax", _rescan(img, dx=3, dy=2, angle=0.5, jpeg_quality=60), True),
+        ]
+        if name == "lab-sheet":
+            cases += [
+                ("edited value", _rescan(_edit_value(img, 11, "213")), False),
+                (
+                    "edited + rotate",
+                    _rescan(_edit_value(img, 5, "19"), angle=0.3),
+                    False,
+                ),
+            ]
+
+        for label, copy, expect_reuse in cases:
+            page_hash = PageHash.from_image(copy)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                difference = max_block_difference(page_hash.thumbnail, stored.thumbnail)
+            seconds = (time.perf_counter() - start) / repeat
+            reused = index.find(page_hash) is not None
+            ok = reused == expect_reuse
+            failures += not ok
+            print(
+                f"{label:<16} hash distance {page_hash.distance(stored):>2} "
+                f"block difference {difference:6.1f} "
+                f"{'reused' if reused else 'OCRed ':<7} {seconds * 1000:6.1f} ms"
+                f"{'' if ok else '  UNEXPECTED'}"
+            )
+    if failures:
+        sys.exit(f"{failures} near-duplicate cases were decided wrongly")
+
+
+BENCHMARKS = {
+    "dedup": bench_dedup,
+    "onnx-parity": bench_onnx_parity,
+    "orientation": bench_orientation,
+    "preprocessing": bench_preprocessing,
+    "rec-batching": bench_rec_batching,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--images", help="Directory of sample report images")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    print(f"=== Benchmark: {args.benchmark} ({len(images)} images) ===")
+    BENCHMARKS[args.benchmark](images, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Gunicorn configuration for the OCR service.
+
+Workers are recycled by the RSS watchdog (ocr.memory_watchdog) instead of a
+fixed --max-requests, so a worker keeps its loaded OCR engines for as long
+as its memory stays healthy.
+
+With OCR_ZYGOTE=True the master preloads the app and its fork-safe engines,
+and workers are forked from it (ocr.zygote): they share those pages, and a
+replaced worker only loads the engines that cannot be forked.
+"""
+
+import gc
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+# Threaded workers let concurrent requests share micro-batched Paddle
+# predictions (OCR_BATCHING_ENABLED); one thread keeps plain sync workers
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "300"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "60"))
+preload_app = os.environ.get("OCR_ZYGOTE", "False").lower() == "true"
+
+if preload_app:
+    # Collections while the engines load would leave freed holes in pages
+    # the workers share; the loaded objects are frozen before forking and
+    # the collector is enabled again (ocr.zygote.prepare_fork)
+    gc.disable()
+
+
+def when_ready(server):
+    """Prepare the preloaded master for forking, before the first worker starts"""
+    if preload_app:
+        from ocr.zygote import prepare_fork
+
+        prepare_fork()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from ocr.zygote import after_fork
+
+        after_fork()
+
+
+def post_request(worker, req, environ, resp):
+    """Check worker RSS after every request and recycle when needed"""
+    from ocr.memory_watchdog import check_worker_memory
+
+    check_worker_memory(worker)
@@ -2,7 +2,12 @@
 import os
 import logging
 
-if os.environ.get("DJANGO_SETTINGS_MODULE"):
+# OCR_EAGER_ENGINE_INIT=False leaves engines to load lazily on first use
+# (e.g. bulk OCR workers that only need one engine)
+if (
+    os.environ.get("DJANGO_SETTINGS_MODULE")
+    and os.environ.get("OCR_EAGER_ENGINE_INIT", "True").lower() == "true"
+):
     try:
         from ocr.engines.factory import OCREngineFactory
 
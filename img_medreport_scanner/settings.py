@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 from urllib.parse import urlparse
 
@@ -55,6 +56,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "ocr.middleware.ServerTimingMiddleware",
 ]
 
 ROOT_URLCONF = "img_medreport_scanner.urls"
@@ -175,13 +177,212 @@ REQUEST_TIMEOUT = 300  # 5 minutes
 DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
 
+# Zygote mode (see gunicorn.conf.py and ocr/zygote.py): the gunicorn master
+# loads the app and fork-safe engines once and forks workers that share them
+OCR_ZYGOTE = os.environ.get("OCR_ZYGOTE", "False").lower() == "true"
+
 # OCR Configuration
 OCR_CONFIG = {
-    "PADDLEOCR_MAX_IMAGE_SIZE": 1024,  # Maximum dimension for PaddleOCR preprocessing
-    "PADDLEOCR_TIMEOUT": 300,  # Timeout in seconds for PaddleOCR processing
-    "TESSERACT_TIMEOUT": 60,  # Timeout in seconds for Tesseract processing
+    # Initialize all engines at startup; when False they load on first use
+    "EAGER_ENGINE_INIT": os.environ.get("OCR_EAGER_ENGINE_INIT", "True").lower()
+    == "true",
+    "ZYGOTE": OCR_ZYGOTE,
+    # Longest page side after preprocessing. PaddleONNX and PaddleBatched use
+    # the PaddleOCR size; PaddleCombined uses the PaddleTable size.
+    "PADDLEOCR_MAX_IMAGE_SIZE": 1024,
+    "PADDLE_TABLE_MAX_IMAGE_SIZE": 2048,
+    "TESSERACT_MAX_IMAGE_SIZE": 2048,
+    # Page-level orientation pre-pass: "off", "projection" or "osd". When enabled,
+    # PaddleOCR's per-line angle classifier is disabled.
+    "PADDLEOCR_PAGE_ORIENTATION": os.environ.get("PADDLEOCR_PAGE_ORIENTATION", "off"),
+    # Serve PaddleOCR text requests from the table pipeline's OCR pass so the
+    # det/rec weights are loaded once per process instead of twice
+    "PADDLEOCR_SHARE_TABLE_PIPELINE": os.environ.get(
+        "PADDLEOCR_SHARE_TABLE_PIPELINE", "False"
+    ).lower()
+    == "true",
+    # Per-call engine timeouts in seconds, kept below the gunicorn worker
+    # timeout. A timed-out call returns 504.
+    "PADDLEOCR_TIMEOUT": int(os.environ.get("PADDLEOCR_TIMEOUT", "120")),
+    "TESSERACT_TIMEOUT": int(os.environ.get("TESSERACT_TIMEOUT", "60")),
+    # PaddleONNX engine: PaddleOCR models exported to ONNX (see README),
+    # run on ONNX Runtime. 0 threads uses one per physical core; graph
+    # optimization is one of "disable", "basic", "extended", "all".
+    "PADDLE_ONNX_MODEL_DIR": os.environ.get(
+        "PADDLE_ONNX_MODEL_DIR", os.path.expanduser("~/.paddlex/onnx")
+    ),
+    "PADDLE_ONNX_INTRA_OP_THREADS": int(
+        os.environ.get("PADDLE_ONNX_INTRA_OP_THREADS", "0")
+    ),
+    "PADDLE_ONNX_GRAPH_OPTIMIZATION": os.environ.get(
+        "PADDLE_ONNX_GRAPH_OPTIMIZATION", "all"
+    ),
+    # Text lines per recognition batch (PaddleONNX, PaddleBatched). Lines
+    # are grouped by width, so larger batches add little padding.
+    "REC_BATCH_SIZE": int(os.environ.get("OCR_REC_BATCH_SIZE", "6")),
+    "PADDLE_DET_MODEL": "PP-OCRv5_server_det",  # PaddleBatched detection model
+    # Run Paddle engines in child processes that are killed and reloaded on
+    # timeout, so the web worker and its other engines survive. Off by
+    # default in zygote mode, where a killed worker is re-forked at once.
+    "PADDLEOCR_ISOLATED_EXECUTION": os.environ.get(
+        "PADDLEOCR_ISOLATED_EXECUTION", "False" if OCR_ZYGOTE else "True"
+    ).lower()
+    == "true",
+    # Cross-request micro-batching for PaddleOCR/PaddleTable/PaddleCombined:
+    # concurrent pages wait up to BATCH_MAX_WAIT_MS for a batch of up to
+    # BATCH_MAX_SIZE, which runs as one predict call. Requests only overlap
+    # with GUNICORN_THREADS > 1 (or several pages in flight per process).
+    "BATCHING_ENABLED": os.environ.get("OCR_BATCHING_ENABLED", "False").lower()
+    == "true",
+    "BATCH_MAX_SIZE": int(os.environ.get("OCR_BATCH_MAX_SIZE", "8")),
+    "BATCH_MAX_WAIT_MS": float(os.environ.get("OCR_BATCH_MAX_WAIT_MS", "10")),
+    # Request languages (the "lang" field) and each engine's code for them;
+    # PaddleBatched takes the recognition model name. Table models are
+    # English-only. Tesseract needs the matching tesseract-ocr-<code> package.
+    "OCR_LANGUAGES": {
+        "en": {
+            "Tesseract": "eng",
+            "PaddleOCR": "en",
+            "PaddleTable": "en",
+            "PaddleCombined": "en",
+            "PaddleONNX": "en",
+            "PaddleBatched": "en_PP-OCRv5_mobile_rec",
+        },
+        "es": {
+            "Tesseract": "spa",
+            "PaddleOCR": "es",
+            "PaddleONNX": "es",
+            "PaddleBatched": "latin_PP-OCRv5_mobile_rec",
+        },
+        "fr": {
+            "Tesseract": "fra",
+            "PaddleOCR": "fr",
+            "PaddleONNX": "fr",
+            "PaddleBatched": "latin_PP-OCRv5_mobile_rec",
+        },
+        "de": {
+            "Tesseract": "deu",
+            "PaddleOCR": "de",
+            "PaddleONNX": "de",
+            "PaddleBatched": "latin_PP-OCRv5_mobile_rec",
+        },
+    },
+    "DEFAULT_LANGUAGE": os.environ.get("OCR_DEFAULT_LANGUAGE", "en"),
+    # Engines are loaded per (engine, language) on first use; past this
+    # estimated total (including execution slot processes) the least recently
+    # used ones are unloaded. 0 disables eviction.
+    "ENGINE_MEMORY_BUDGET_MB": int(
+        os.environ.get("OCR_ENGINE_MEMORY_BUDGET_MB", "6000")
+    ),
+    # OpenCV preprocessing steps per engine, applied in order after resizing:
+    # "grayscale", "deskew", "denoise", "binarize"
+    "PREPROCESSING": {
+        "Tesseract": ["grayscale"],
+        "PaddleOCR": [],
+        "PaddleTable": [],
+    },
+    # Filter used when downsizing pages to the max size, per preprocessing
+    # configuration: "lanczos", "bicubic", "bilinear", "hamming", "box" or
+    # "nearest"
+    "RESAMPLE_FILTERS": {
+        "Tesseract": "lanczos",
+        "PaddleOCR": "lanczos",
+        "PaddleTable": "lanczos",
+    },
+    # CPU inference threads per engine instance (Paddle predictors, the
+    # tesseract subprocesses via their OMP_THREAD_LIMIT); 0 keeps the library
+    # default. PaddleONNX uses PADDLE_ONNX_INTRA_OP_THREADS.
+    "CPU_THREADS": {
+        "Tesseract": 0,
+        "PaddleOCR": 0,
+        "PaddleTable": 0,
+        "PaddleBatched": 0,
+    },
+    # Reuse the stored result for near-duplicate pages (re-scans, re-faxes).
+    # The hash distance only selects candidates (a re-scan rotated by 1 degree
+    # is ~8 bits away); the thumbnail comparison below decides.
+    "DEDUP_ENABLED": os.environ.get("OCR_DEDUP_ENABLED", "False").lower() == "true",
+    "DEDUP_MAX_DISTANCE": int(
+        os.environ.get("OCR_DEDUP_MAX_DISTANCE", "8")
+    ),  # Max differing bits of the 64-bit pHash and dHash
+    "DEDUP_MAX_ENTRIES": 2000,  # Per-process LRU capacity (~100 KB each)
+    # Max mean gray-level difference of any 8x8 block of the registered
+    # verification thumbnails; noise and re-scans stay below it (up to ~18),
+    # a changed digit above (from ~50)
+    "DEDUP_MAX_BLOCK_DIFFERENCE": 30.0,
+    # Tile-level incremental OCR (the per-request "incremental" flag defaults
+    # to INCREMENTAL_OCR_ENABLED): only tiles of the preprocessed page that
+    # changed since a cached page are read again
+    "INCREMENTAL_OCR_ENABLED": os.environ.get(
+        "OCR_INCREMENTAL_ENABLED", "False"
+    ).lower()
+    == "true",
+    "INCREMENTAL_TILE_ROWS": int(os.environ.get("OCR_INCREMENTAL_TILE_ROWS", "16")),
+    "INCREMENTAL_TILE_COLS": int(os.environ.get("OCR_INCREMENTAL_TILE_COLS", "4")),
+    "INCREMENTAL_TILE_MARGIN": 32,  # Context in px around each re-read tile group
+    # Above this share of changed tiles the page is read in one full pass
+    "INCREMENTAL_MAX_CHANGED_FRACTION": 0.5,
+    "INCREMENTAL_MAX_TILES": 50000,  # Per-process LRU capacity (tiles, ~64 per page)
+    # Engines this node serves, e.g. "PaddleOCR,PaddleTable" behind the router
+    # (ocr/routing.py): only these are loaded at startup and accepted in
+    # requests. Empty serves every engine.
+    "NODE_ENGINES": [
+        name.strip()
+        for name in os.environ.get("OCR_NODE_ENGINES", "").split(",")
+        if name.strip()
+    ],
+    # Save successful OCR results for full-text search (/ocr/results/). Off
+    # by default: stored results are patient report text
+    "RESULT_STORE_ENABLED": os.environ.get("OCR_RESULT_STORE_ENABLED", "False").lower()
+    == "true",
+    # Stored results older than this are purged; 0 keeps them indefinitely
+    "RESULT_RETENTION_DAYS": int(os.environ.get("OCR_RESULT_RETENTION_DAYS", "30")),
+    # Chunked uploads (/ocr/uploads/) are spooled to disk here; the directory
+    # must be shared by all workers
+    "UPLOAD_DIR": os.environ.get("OCR_UPLOAD_DIR", os.path.join(BASE_DIR, "uploads")),
+    "UPLOAD_MAX_SIZE": int(
+        os.environ.get("OCR_UPLOAD_MAX_SIZE", str(1024 * 1024 * 1024))
+    ),  # 1GB
+    "UPLOAD_MAX_CHUNK_SIZE": 16 * 1024 * 1024,  # 16MB
+    "UPLOAD_EXPIRY_SECONDS": 24 * 3600,  # Idle uploads are removed after a day
+    # Structured lab value extraction (analyte/value/unit/reference range)
+    "LAB_EXTRACTION_ENABLED": os.environ.get("LAB_EXTRACTION_ENABLED", "False").lower()
+    == "true",  # Default for the per-request extract_fields flag
+    "LAB_DICTIONARY_PATH": os.environ.get(
+        "LAB_DICTIONARY_PATH",
+        os.path.join(BASE_DIR, "ocr", "data", "lab_dictionary.json"),
+    ),  # Recompiled automatically when the file changes
+    # Opt-in per-request profiling: requests with an X-OCR-Profile header equal
+    # to this token are profiled. Profiling is disabled when unset.
+    "PROFILING_TOKEN": os.environ.get("OCR_PROFILING_TOKEN"),
+    "PROFILING_DIR": os.environ.get(
+        "OCR_PROFILING_DIR", os.path.join(BASE_DIR, "profiles")
+    ),  # Where profiles, tracemalloc top allocations and leak reports are saved
+    # Worker recycling (see gunicorn.conf.py): recycle when RSS exceeds the
+    # threshold, or when it grows steadily over the request window
+    "WORKER_MAX_RSS_MB": int(os.environ.get("WORKER_MAX_RSS_MB", "4500")),
+    "WORKER_MAX_RSS_GROWTH_MB_PER_REQUEST": float(
+        os.environ.get("WORKER_MAX_RSS_GROWTH_MB_PER_REQUEST", "2.0")
+    ),
+    "WORKER_MIN_RSS_GROWTH_MB": 512,  # Growth needed before the slope counts
+    "WORKER_RSS_WINDOW": 50,  # Requests used to estimate the growth slope
+    "WORKER_LEAK_SNAPSHOT_FRACTION": 0.8,  # Start tracemalloc at this share of max
+    # Execution slot processes (PADDLEOCR_ISOLATED_EXECUTION) are restarted
+    # when their RSS exceeds this; worker RSS does not include them
+    "SLOT_MAX_RSS_MB": int(os.environ.get("SLOT_MAX_RSS_MB", "3000")),
 }
 
+# Tuned settings written by `manage.py ocr_autotune`. The profile's values
+# replace the ones above; per-engine tables are merged key by key.
+OCR_CONFIG_PROFILE = os.environ.get("OCR_CONFIG_PROFILE")
+if OCR_CONFIG_PROFILE:
+    with open(OCR_CONFIG_PROFILE) as profile_file:
+        for key, value in json.load(profile_file)["OCR_CONFIG"].items():
+            if isinstance(value, dict) and isinstance(OCR_CONFIG.get(key), dict):
+                OCR_CONFIG[key] = {**OCR_CONFIG[key], **value}
+            else:
+                OCR_CONFIG[key] = value
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -1,3 +1,20 @@
 from django.contrib import admin
 
-# Register your models here.
+from ocr.models import OCRResult
+
+
+@admin.register(OCRResult)
+class OCRResultAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "created_at",
+        "engine",
+        "lang",
+        "patient_id",
+        "document",
+        "page",
+    )
+    list_filter = ("engine", "lang")
+    # Exact match uses the (patient_id, created_at) index
+    search_fields = ("=patient_id",)
+    date_hierarchy = "created_at"
@@ -1,4 +1,8 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+from ocr.lab_extraction import get_lab_dictionary
 from ocr.engines.ocr_engines import initialize_all_engines
 
 
@@ -8,4 +12,11 @@ class OcrConfig(AppConfig):
 
     def ready(self):
         """Initialize all OCR engines during Django startup"""
-        initialize_all_engines()
+        if getattr(settings, "OCR_CONFIG", {}).get("EAGER_ENGINE_INIT", True):
+            initialize_all_engines()
+
+        # Compile the lab dictionary up front so the first request doesn't pay for it
+        try:
+            get_lab_dictionary()
+        except (OSError, ValueError) as e:
+            logging.warning("Failed to compile lab dictionary: %s", str(e))
@@ -0,0 +1,267 @@
+"""
+Dynamic Micro-Batching
+
+Paddle pipelines predict a list of images in one call, sharing the model
+invocations between them. A MicroBatcher sits in front of an engine's
+predict: concurrent callers submit single images, a worker thread collects
+them for up to max_wait_ms or max_batch_size images, runs one batched
+predict and hands each caller its own result.
+
+Callers may carry a deadline (see deadline_scope). A batch is closed early
+when waiting longer would miss the earliest deadline in it, and requests
+that can no longer finish in time are failed without running them.
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Any, Callable, List, Optional
+
+from django.conf import settings
+
+from .profiling import record_stage
+
+# Weight of the latest batch in the predict duration estimate
+DURATION_SMOOTHING = 0.2
+
+# An idle worker thread exits after this many seconds, so the batcher does
+# not keep an evicted engine alive
+IDLE_EXIT_SECONDS = 60
+
+# Absolute time.monotonic() by which the current call must finish, or None
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "ocr_call_deadline", default=None
+)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """Give batched predicts in this block a deadline seconds from now"""
+    token = _deadline.set(
+        None if seconds is None else time.monotonic() + max(0.0, seconds)
+    )
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class BatchDeadlineExceeded(RuntimeError):
+    """A request's deadline passed while it waited for a batch"""
+
+
+class _Request:
+    __slots__ = ("item", "deadline", "submitted", "started", "done", "result", "error")
+
+    def __init__(self, item: Any, deadline: Optional[float]):
+        self.item = item
+        self.deadline = deadline
+        self.submitted = time.monotonic()
+        self.started = None
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Live batchers, reset in forked children
+_batchers: "weakref.WeakSet[MicroBatcher]" = weakref.WeakSet()
+
+
+class MicroBatcher:
+    """Collects concurrent single-item calls into batched predict calls.
+
+    predict_batch receives a list of items and must return one result per
+    item, in order. If it raises, every request in the batch gets the error.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        predict_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.name = name
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: List[_Request] = []
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        # Smoothed duration of one batched predict, used to close a batch
+        # early enough for its earliest deadline
+        self._predict_seconds = 0.0
+        self._batches = 0
+        self._requests = 0
+        self._expired = 0
+        self._queue_delay_total = 0.0
+        self._queue_delay_max = 0.0
+        _batchers.add(self)
+
+    def _reset_after_fork(self) -> None:
+        """Drop the parent's worker thread, queue and lock state"""
+        self._queue = []
+        self._cond = threading.Condition()
+        self._worker = None
+
+    def submit(self, item: Any) -> Any:
+        """Run item in the next batch and return its result"""
+        request = _Request(item, _deadline.get())
+        with self._cond:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name=f"ocr-batcher-{self.name}", daemon=True
+                )
+                self._worker.start()
+            self._queue.append(request)
+            self._cond.notify()
+        request.done.wait()
+        if request.started is not None:
+            # Added queueing delay shows up in the request's Server-Timing
+            record_stage("batch-wait", (request.started - request.submitted) * 1000)
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _close_time(self) -> float:
+        """When the batch being collected must start, given its deadlines"""
+        close = self._queue[0].submitted + self.max_wait
+        deadlines = [r.deadline for r in self._queue if r.deadline is not None]
+        if deadlines:
+            close = min(close, min(deadlines) - self._predict_seconds)
+        return close
+
+    def _collect(self) -> Optional[List[_Request]]:
+        """Wait for a full batch or the close time, then take it off the queue.
+
+        Returns None when no request arrived for IDLE_EXIT_SECONDS.
+        """
+        with self._cond:
+            while not self._queue:
+                if not self._cond.wait(IDLE_EXIT_SECONDS) and not self._queue:
+                    self._worker = None
+                    return None
+            while len(self._queue) < self.max_batch_size:
+                remaining = self._close_time() - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[: self.max_batch_size]
+            del self._queue[: self.max_batch_size]
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            start = time.monotonic()
+            live = []
+            for request in batch:
+                if (
+                    request.deadline is not None
+                    and request.deadline < start + self._predict_seconds
+                ):
+                    request.error = BatchDeadlineExceeded(
+                        f"{self.name} request would miss its deadline after "
+                        f"waiting {(start - request.submitted) * 1000:.0f} ms for a batch"
+                    )
+                    request.done.set()
+                else:
+                    live.append(request)
+            self._record(batch, live, start)
+            if not live:
+                continue
+
+            try:
+                results = self.predict_batch([request.item for request in live])
+                if len(results) != len(live):
+                    raise RuntimeError(
+                        f"{self.name} batch returned {len(results)} results "
+                        f"for {len(live)} images"
+                    )
+                for request, result in zip(live, results):
+                    request.result = result
+            except Exception as e:
+                logging.error("%s batch of %d failed: %s", self.name, len(live), e)
+                for request in live:
+                    request.error = e
+            finally:
+                duration = time.monotonic() - start
+                self._predict_seconds = (
+                    duration
+                    if self._batches == 1
+                    else (1 - DURATION_SMOOTHING) * self._predict_seconds
+                    + DURATION_SMOOTHING * duration
+                )
+                for request in live:
+                    request.done.set()
+
+    def _record(self, batch: List[_Request], live: List[_Request], start: float):
+        with self._cond:
+            self._expired += len(batch) - len(live)
+            if live:
+                self._batches += 1
+                self._requests += len(live)
+            for request in live:
+                request.started = start
+                delay = start - request.submitted
+                self._queue_delay_total += delay
+                self._queue_delay_max = max(self._queue_delay_max, delay)
+
+    def get_metrics(self) -> dict:
+        """Batch fill rate and the queueing delay batching added"""
+        with self._cond:
+            batches, requests = self._batches, self._requests
+            return {
+                "batcher": self.name,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": batches,
+                "requests": requests,
+                "expired": self._expired,
+                "queued": len(self._queue),
+                "mean_batch_size": round(requests / batches, 2) if batches else None,
+                "fill_rate": (
+                    round(requests / (batches * self.max_batch_size), 3)
+                    if batches
+                    else None
+                ),
+                "mean_queue_delay_ms": (
+                    round(self._queue_delay_total / requests * 1000, 1)
+                    if requests
+                    else None
+                ),
+                "max_queue_delay_ms": round(self._queue_delay_max * 1000, 1),
+                "predict_ms": round(self._predict_seconds * 1000, 1),
+            }
+
+
+def _reset_batchers_after_fork() -> None:
+    for batcher in list(_batchers):
+        batcher._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_batchers_after_fork)
+
+
+def create_batcher(
+    name: str, predict_batch: Callable[[List[Any]], List[Any]]
+) -> Optional[MicroBatcher]:
+    """A MicroBatcher configured from OCR_CONFIG, or None when batching is off"""
+    config = getattr(settings, "OCR_CONFIG", {})
+    if not config.get("BATCHING_ENABLED", False):
+        return None
+    return MicroBatcher(
+        name,
+        predict_batch,
+        max_batch_size=config.get("BATCH_MAX_SIZE", 8),
+        max_wait_ms=config.get("BATCH_MAX_WAIT_MS", 10),
+    )
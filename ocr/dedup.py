@@ -0,0 +1,309 @@
+"""
+Near-Duplicate Page Index
+
+Re-scanned or re-faxed copies of a report differ by a few pixels of noise,
+so exact byte hashes miss them. Pages are fingerprinted with a perceptual
+hash (pHash, verified with dHash) computed on a small grayscale thumbnail,
+and stored OCR results are found by Hamming distance with multi-index
+hashing: the 64-bit hash is split into max_distance + 1 chunks, and any
+hash within max_distance bits must match at least one chunk exactly.
+
+Thumbnail hashes cannot see a changed digit, and reports printed on the
+same template hash almost identically. A hash match is therefore only
+reused after comparing larger grayscale thumbnails block by block. The new
+thumbnail is first registered onto the stored one (ECC, affine), so the
+shift, skew and scale of a re-scan are undone, and the comparison then
+tolerates the remaining sub-pixel error: noise and re-scans pass, while a
+changed value is a miss (see `benchmark_ocr.py dedup`).
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+HASH_BITS = 64
+PHASH_SIZE = 32  # DCT input size; the low 8x8 frequencies form the hash
+DHASH_SIZE = 8
+
+# Verification thumbnail: longest side, and the block size whose mean
+# absolute difference is compared
+VERIFY_SIZE = 1536
+VERIFY_BLOCK = 8
+
+# Registration runs on copies downscaled to this longest side; thumbnails
+# whose sides differ by more than MAX_SIZE_CHANGE are different pages
+REGISTER_SIZE = 512
+MAX_SIZE_CHANGE = 0.02
+
+# Hash matches verified per lookup, closest first; pages on one template
+# can all be within the hash distance
+MAX_VERIFIED_CANDIDATES = 3
+
+
+def _gray_thumbnail(img: Image.Image, size: Tuple[int, int]) -> np.ndarray:
+    """Downscale first and convert after, so large pages are never copied at full size"""
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("L")
+    thumb = img.resize(size, Image.Resampling.BOX, reducing_gap=2.0)
+    if thumb.mode != "L":
+        thumb = thumb.convert("L")
+    return np.asarray(thumb, dtype=np.float32)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def phash(img: Image.Image) -> int:
+    """64-bit DCT perceptual hash"""
+    dct = cv2.dct(_gray_thumbnail(img, (PHASH_SIZE, PHASH_SIZE)))
+    low = dct[:8, :8].ravel()
+    # The DC term only carries overall brightness
+    return _bits_to_int(low > np.median(low[1:]))
+
+
+def dhash(img: Image.Image) -> int:
+    """64-bit difference hash of horizontal gradients"""
+    gray = _gray_thumbnail(img, (DHASH_SIZE + 1, DHASH_SIZE))
+    return _bits_to_int(gray[:, 1:] > gray[:, :-1])
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def verification_thumbnail(img: Image.Image) -> np.ndarray:
+    """Grayscale thumbnail large enough to show single digits"""
+    width, height = img.size
+    scale = min(1.0, VERIFY_SIZE / max(width, height))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return _gray_thumbnail(img, size).astype(np.uint8)
+
+
+def register(moving: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """Warp `moving` onto `reference`, undoing the shift, rotation and scale of a re-scan"""
+    height, width = reference.shape
+    if moving.shape != reference.shape:
+        moving = cv2.resize(moving, (width, height), interpolation=cv2.INTER_AREA)
+    scale = min(1.0, REGISTER_SIZE / max(height, width))
+
+    def small(img):
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(img.astype(np.float32), (5, 5), 0)
+
+    small_reference, small_moving = small(reference), small(moving)
+    # Phase correlation finds the shift, from which ECC converges on sparse pages
+    (dx, dy), _ = cv2.phaseCorrelate(small_reference, small_moving)
+    warp = np.array([[1, 0, dx], [0, 1, dy]], dtype=np.float32)
+    try:
+        _, warp = cv2.findTransformECC(
+            small_reference,
+            small_moving,
+            warp,
+            cv2.MOTION_AFFINE,
+            (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 50, 1e-5),
+            None,
+            1,
+        )
+    except cv2.error:
+        # No convergence: unrelated pages, compared as they are
+        return moving
+    warp[:, 2] /= scale
+    return cv2.warpAffine(
+        moving,
+        warp,
+        (width, height),
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def max_block_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """Largest mean absolute difference over VERIFY_BLOCK-sized blocks, after
+    registering `a` onto `b`.
+
+    Both thumbnails are lightly blurred and centred on their median
+    (background) level, and a pixel only differs by how far it lies outside
+    the range of the other thumbnail's 3x3 neighbourhood. Noise, exposure
+    and the sub-pixel error left by registration count little, while a
+    changed character shows up as one strongly differing block.
+    """
+    if any(abs(x - y) > MAX_SIZE_CHANGE * max(x, y) for x, y in zip(a.shape, b.shape)):
+        return float("inf")
+    a = cv2.GaussianBlur(register(a, b).astype(np.float32), (3, 3), 0)
+    b = cv2.GaussianBlur(b.astype(np.float32), (3, 3), 0)
+    a -= np.median(a)
+    b -= np.median(b)
+    kernel = np.ones((3, 3), dtype=np.uint8)
+
+    def outside(x, y):
+        return np.maximum(
+            np.maximum(x - cv2.dilate(y, kernel), cv2.erode(y, kernel) - x), 0
+        )
+
+    diff = np.maximum(outside(a, b), outside(b, a))
+    height = diff.shape[0] - diff.shape[0] % VERIFY_BLOCK
+    width = diff.shape[1] - diff.shape[1] % VERIFY_BLOCK
+    if not height or not width:
+        return float(diff.max()) if diff.size else 0.0
+    blocks = diff[:height, :width].reshape(
+        height // VERIFY_BLOCK, VERIFY_BLOCK, width // VERIFY_BLOCK, VERIFY_BLOCK
+    )
+    return float(blocks.mean(axis=(1, 3)).max())
+
+
+class PageHash:
+    """pHash for lookup, dHash to confirm candidates, and a verification thumbnail"""
+
+    __slots__ = ("phash", "dhash", "thumbnail")
+
+    def __init__(
+        self, phash_value: int, dhash_value: int, thumbnail: Optional[np.ndarray]
+    ):
+        self.phash = phash_value
+        self.dhash = dhash_value
+        self.thumbnail = thumbnail
+
+    @classmethod
+    def from_image(cls, img: Image.Image) -> "PageHash":
+        # The full page is downscaled once; the hashes come from the thumbnail
+        thumbnail = verification_thumbnail(img)
+        small = Image.fromarray(thumbnail)
+        return cls(phash(small), dhash(small), thumbnail)
+
+    def distance(self, other: "PageHash") -> int:
+        """Worst of the two Hamming distances"""
+        return max(hamming(self.phash, other.phash), hamming(self.dhash, other.dhash))
+
+
+class NearDuplicateIndex:
+    """Bounded LRU index of OCR results searchable by perceptual-hash distance.
+
+    Results are namespaced (by model and request options) so a page is only
+    reused for requests that would have produced the same output.
+    """
+
+    def __init__(
+        self,
+        max_distance: int = 8,
+        max_entries: int = 2000,
+        max_block_difference: float = 30.0,
+    ):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError(f"max_distance must be between 0 and {HASH_BITS - 1}")
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.max_block_difference = max_block_difference
+
+        # Chunk boundaries for multi-index hashing
+        chunks = max_distance + 1
+        edges = np.linspace(0, HASH_BITS, chunks + 1).astype(int)
+        self._chunks = [
+            (int(start), (1 << int(end - start)) - 1)
+            for start, end in zip(edges[:-1], edges[1:])
+        ]
+        self._tables: List[Dict[Tuple[Hashable, int], Set[int]]] = [
+            {} for _ in self._chunks
+        ]
+        # Entry id -> (namespace, hashes, PNG-encoded thumbnail, result)
+        self._entries: "OrderedDict[int, Tuple[Hashable, PageHash, bytes, Any]]" = (
+            OrderedDict()
+        )
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _chunk_keys(self, namespace: Hashable, page_hash: PageHash):
+        for start, mask in self._chunks:
+            yield namespace, (page_hash.phash >> start) & mask
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def find(
+        self, page_hash: PageHash, namespace: Hashable = None
+    ) -> Optional[Tuple[Any, int]]:
+        """Return (stored result, distance) for the closest page within max_distance"""
+        with self._lock:
+            candidates = set()
+            for table, key in zip(self._tables, self._chunk_keys(namespace, page_hash)):
+                candidates.update(table.get(key, ()))
+
+            matches = []
+            for entry_id in candidates:
+                _, stored_hash, thumbnail, result = self._entries[entry_id]
+                distance = page_hash.distance(stored_hash)
+                if distance <= self.max_distance:
+                    matches.append((distance, entry_id, thumbnail, result))
+
+            # Closest hashes first; only a verified match is reused
+            matches = sorted(matches, key=lambda match: match[0])
+            matches = matches[:MAX_VERIFIED_CANDIDATES]
+
+        # Registration is slow, so verification runs outside the lock
+        for distance, entry_id, thumbnail, result in matches:
+            stored = cv2.imdecode(
+                np.frombuffer(thumbnail, dtype=np.uint8), cv2.IMREAD_GRAYSCALE
+            )
+            if (
+                max_block_difference(page_hash.thumbnail, stored)
+                <= self.max_block_difference
+            ):
+                with self._lock:
+                    if entry_id in self._entries:
+                        self._entries.move_to_end(entry_id)
+                return result, distance
+        return None
+
+    def add(self, page_hash: PageHash, result: Any, namespace: Hashable = None) -> None:
+        """Store a result, evicting the least recently used entry when full"""
+        # Thumbnails are kept PNG-compressed (about 100 KB for a text page)
+        _, thumbnail = cv2.imencode(".png", page_hash.thumbnail)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (
+                namespace,
+                PageHash(page_hash.phash, page_hash.dhash, None),
+                thumbnail.tobytes(),
+                result,
+            )
+            for table, key in zip(self._tables, self._chunk_keys(namespace, page_hash)):
+                table.setdefault(key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int) -> None:
+        namespace, page_hash, _, _ = self._entries.pop(entry_id)
+        for table, key in zip(self._tables, self._chunk_keys(namespace, page_hash)):
+            ids = table.get(key)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del table[key]
+
+
+_index: Optional[NearDuplicateIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_duplicate_index() -> Optional[NearDuplicateIndex]:
+    """The process-wide near-duplicate index, or None when disabled"""
+    global _index
+    config = getattr(settings, "OCR_CONFIG", {})
+    if not config.get("DEDUP_ENABLED", False):
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NearDuplicateIndex(
+                    max_distance=config.get("DEDUP_MAX_DISTANCE", 8),
+                    max_entries=config.get("DEDUP_MAX_ENTRIES", 2000),
+                    max_block_difference=config.get("DEDUP_MAX_BLOCK_DIFFERENCE", 30.0),
+                )
+    return _index
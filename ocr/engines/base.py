@@ -5,13 +5,25 @@ This module defines the abstract base class for OCR engines.
 """
 
 from abc import ABC, abstractmethod
-from typing import Tuple, Any
+from typing import Tuple, Any, Optional, Union
+import numpy as np
+from django.conf import settings
 from PIL import Image
 
 
+def configured_cpu_threads(engine_name: str) -> int:
+    """CPU inference threads configured for an engine, 0 for the library default"""
+    configured = getattr(settings, "OCR_CONFIG", {}).get("CPU_THREADS", {})
+    return configured.get(engine_name, 0)
+
+
 class BaseOCREngine(ABC):
     """Base class for OCR engines"""
 
+    # Whether concurrent calls are safe; execution slots serialize calls to
+    # engines that are not
+    thread_safe = False
+
     @abstractmethod
     def initialize(self) -> None:
         """Initialize the OCR engine"""
@@ -27,7 +39,19 @@ class BaseOCREngine(ABC):
         """Extract text from image and return (text, confidence, tables) if available. For table engines, text is the full OCR text, and tables is a list of HTML tables if present."""
         pass
 
+    def extract_text_with_words(self, img: Any):
+        """Extract text like extract_text, additionally returning the recognized words as a list of {'text', 'conf', 'box'} dicts (box is (x0, y0, x1, y1) in preprocessed image coordinates, or None). Returns (text, confidence, tables, words)."""
+        text, average_conf, tables = self.extract_text(img)
+        words = [{"text": word, "conf": None, "box": None} for word in text.split()]
+        return text, average_conf, tables, words
+
     @abstractmethod
-    def preprocess_image(self, img: Image.Image, max_size: int = -1) -> Image.Image:
-        """Preprocess image for optimal OCR performance"""
+    def preprocess_image(
+        self, img: Image.Image, max_size: int = -1
+    ) -> Union[np.ndarray, Image.Image]:
+        """Preprocess image for optimal OCR performance, returning a uint8 array (or a 1-bit image for engines that read bilevel input)"""
         pass
+
+    def batching_metrics(self) -> Optional[dict]:
+        """Micro-batching fill rate and queueing delay, or None if calls are not batched"""
+        return None
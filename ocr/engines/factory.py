@@ -1,32 +1,224 @@
-from typing import Dict, Type
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
 from .base import BaseOCREngine
 from .tesseract_engine import TesseractEngine
-from .paddle_ocr_engine import PaddleOCREngine
-from .paddle_table_ocr_engine import PaddleTableOCREngine
+from .isolated_engine import IsolatedOCREngine
+from ..execution import ExecutionSlot, in_execution_slot
+from ..languages import (
+    engine_language_code,
+    get_available_languages,
+    get_default_language,
+)
+from .. import zygote
+from ..utils import force_garbage_collection, get_rss_mb
+
+# Error prefixes of each Paddle engine's "not ready" message
+PADDLE_ENGINE_LABELS = {
+    "paddleocr": "PaddleOCR",
+    "paddletable": "PaddleTableOCREngine",
+    "paddlecombined": "PaddleCombinedOCREngine",
+    "paddleonnx": "PaddleONNX",
+    "paddlebatched": "PaddleBatched",
+}
+
+# Engines that start native thread pools when they load (ONNX Runtime's
+# intra-op pool, Paddle's MKL-DNN/OpenMP pools); these do not survive fork,
+# so zygote workers load their own
+FORK_UNSAFE_ENGINES = {
+    "paddleocr",
+    "paddletable",
+    "paddlecombined",
+    "paddleonnx",
+    "paddlebatched",
+}
+
+EngineKey = Tuple[str, str]
 
 
 class OCREngineFactory:
-    """Factory for creating and managing OCR engines"""
+    """Factory for creating and managing OCR engines.
+
+    Engines are keyed by (engine, language) and loaded on demand. When the
+    estimated memory of the resident engines exceeds ENGINE_MEMORY_BUDGET_MB,
+    the least recently used ones are evicted. An engine loads outside the
+    factory lock, so requests for resident engines never wait on it;
+    concurrent requests for the same engine wait for the one load.
+    """
 
-    _engines: Dict[str, BaseOCREngine] = {}
+    _engines: "OrderedDict[EngineKey, BaseOCREngine]" = OrderedDict()
+    _engine_memory_mb: Dict[EngineKey, float] = {}
+    _slots: Dict[EngineKey, ExecutionSlot] = {}
+    _loads: Dict[EngineKey, int] = {}
+    _evictions: Dict[EngineKey, int] = {}
+    # Set when the load of a key finishes, whether it succeeded or not
+    _loading: Dict[EngineKey, threading.Event] = {}
+    _lock = threading.RLock()
 
     @classmethod
-    def get_engine(cls, engine_name: str) -> BaseOCREngine:
-        """Get or create an OCR engine by name"""
-        if engine_name not in cls._engines:
-            cls._engines[engine_name] = cls._create_engine(engine_name)
+    def _canonical_name(cls, engine_name: str) -> str:
+        for name in cls.get_available_engines():
+            if name.lower() == engine_name.lower():
+                return name
+        raise ValueError(f"Unknown OCR engine: {engine_name}")
 
-        return cls._engines[engine_name]
+    @classmethod
+    def get_engine(cls, engine_name: str, lang: Optional[str] = None) -> BaseOCREngine:
+        """Get or create an OCR engine by name and language"""
+        key = (cls._canonical_name(engine_name), lang or get_default_language())
+        while True:
+            with cls._lock:
+                engine = cls._engines.get(key)
+                if engine is not None:
+                    cls._engines.move_to_end(key)
+                    return engine
+                loading = cls._loading.get(key)
+                if loading is None:
+                    loading = cls._loading[key] = threading.Event()
+                    break
+            # Another request is loading this engine; look again once it is done
+            loading.wait()
+
+        try:
+            rss_before = get_rss_mb()
+            with cls._lock:
+                known_before = sum(cls._engine_memory_mb.values())
+            engine = cls._create_engine(*key)
+            with cls._lock:
+                # Engines loaded meanwhile (e.g. PaddleTable for
+                # PaddleCombined) account for their own memory
+                nested = sum(cls._engine_memory_mb.values()) - known_before
+                if isinstance(engine, IsolatedOCREngine):
+                    memory_mb = (
+                        0.0 if cls._slot_in_use(engine.slot) else engine.slot.rss_mb()
+                    )
+                else:
+                    memory_mb = max(0.0, get_rss_mb() - rss_before - nested)
+
+                cls._engines[key] = engine
+                cls._engine_memory_mb[key] = memory_mb
+                cls._loads[key] = cls._loads.get(key, 0) + 1
+                logging.info(
+                    "Loaded OCR engine %s (%s), ~%.0f MB", key[0], key[1], memory_mb
+                )
+                cls._enforce_memory_budget(key)
+        finally:
+            with cls._lock:
+                cls._loading.pop(key, None)
+            loading.set()
+        return engine
 
     @classmethod
-    def _create_engine(cls, engine_name: str) -> BaseOCREngine:
+    def _language_code(cls, engine_name: str, lang: str) -> str:
+        code = engine_language_code(engine_name, lang)
+        if code is None:
+            raise ValueError(f"{engine_name} does not support language '{lang}'")
+        return code
+
+    @classmethod
+    def _share_table_pipeline(cls) -> bool:
+        """Whether PaddleOCR text requests reuse the table pipeline's det/rec weights"""
+        return getattr(settings, "OCR_CONFIG", {}).get(
+            "PADDLEOCR_SHARE_TABLE_PIPELINE", False
+        )
+
+    @classmethod
+    def _shares_table_pipeline(cls, engine_name: str, lang: str) -> bool:
+        """PaddleOCR borrows the table pipeline only for languages it supports"""
+        return (
+            engine_name == "PaddleOCR"
+            and cls._share_table_pipeline()
+            and engine_language_code("PaddleTable", lang) is not None
+        )
+
+    @classmethod
+    def _isolated_execution(cls) -> bool:
+        """Whether Paddle engines run in killable execution slot processes"""
+        if in_execution_slot():
+            return False
+        return getattr(settings, "OCR_CONFIG", {}).get(
+            "PADDLEOCR_ISOLATED_EXECUTION", False
+        )
+
+    @classmethod
+    def get_slots(cls) -> List[ExecutionSlot]:
+        """Running execution slots"""
+        with cls._lock:
+            return list(cls._slots.values())
+
+    @classmethod
+    def _slot_in_use(cls, slot: ExecutionSlot) -> bool:
+        return any(
+            getattr(engine, "slot", None) is slot for engine in cls._engines.values()
+        )
+
+    @classmethod
+    def _create_isolated_engine(cls, engine_name: str, lang: str) -> BaseOCREngine:
+        """Create a proxy running a Paddle engine in its group's execution slot"""
+        # Engines sharing the table pipeline share one slot process
+        if engine_name == "PaddleOCR" and not cls._shares_table_pipeline(
+            engine_name, lang
+        ):
+            group = ("PaddleOCR", lang)
+        elif engine_name in ("PaddleONNX", "PaddleBatched"):
+            group = (engine_name, lang)
+        else:
+            group = ("PaddleTable", lang)
+        with cls._lock:
+            if group not in cls._slots:
+                cls._slots[group] = ExecutionSlot(*group)
+            slot = cls._slots[group]
+
+        engine = IsolatedOCREngine(
+            engine_name,
+            slot,
+            timeout=getattr(settings, "OCR_CONFIG", {}).get("PADDLEOCR_TIMEOUT", 120),
+            error_label=PADDLE_ENGINE_LABELS[engine_name.lower()],
+        )
+        engine.initialize()
+        return engine
+
+    @classmethod
+    def _create_engine(cls, engine_name: str, lang: str) -> BaseOCREngine:
         """Create a new OCR engine instance"""
+        code = cls._language_code(engine_name, lang)
+        if engine_name.lower() in PADDLE_ENGINE_LABELS and cls._isolated_execution():
+            return cls._create_isolated_engine(engine_name, lang)
+
+        # Paddle engines are imported on first use, so processes serving only
+        # Tesseract or PaddleONNX never import PaddlePaddle
         if engine_name.lower() == "tesseract":
-            engine = TesseractEngine()
+            engine = TesseractEngine(lang=code)
+        elif engine_name.lower() == "paddleonnx":
+            from .paddle_onnx_engine import PaddleONNXEngine
+
+            engine = PaddleONNXEngine(lang=code)
+        elif engine_name.lower() == "paddlebatched":
+            from .paddle_batched_ocr_engine import PaddleBatchedOCREngine
+
+            engine = PaddleBatchedOCREngine(rec_model=code)
         elif engine_name.lower() == "paddleocr":
-            engine = PaddleOCREngine()
+            from .paddle_combined_ocr_engine import PaddleCombinedOCREngine
+            from .paddle_ocr_engine import PaddleOCREngine
+
+            if cls._shares_table_pipeline(engine_name, lang):
+                engine = PaddleCombinedOCREngine(
+                    cls.get_engine("PaddleTable", lang), include_tables=False
+                )
+            else:
+                engine = PaddleOCREngine(lang=code)
         elif engine_name.lower() == "paddletable":
+            from .paddle_table_ocr_engine import PaddleTableOCREngine
+
             engine = PaddleTableOCREngine()
+        elif engine_name.lower() == "paddlecombined":
+            from .paddle_combined_ocr_engine import PaddleCombinedOCREngine
+
+            # Borrow the table engine's pipeline so weights load only once
+            engine = PaddleCombinedOCREngine(cls.get_engine("PaddleTable", lang))
         else:
             raise ValueError(f"Unknown OCR engine: {engine_name}")
 
@@ -34,14 +226,168 @@ class OCREngineFactory:
         engine.initialize()
         return engine
 
+    @classmethod
+    def _depends_on(cls, engine: BaseOCREngine, other: BaseOCREngine) -> bool:
+        """Whether engine uses other's model (borrowed pipeline or shared slot)"""
+        if getattr(engine, "table_engine", None) is other:
+            return True
+        slot = getattr(engine, "slot", None)
+        return slot is not None and slot is getattr(other, "slot", None)
+
+    @classmethod
+    def _enforce_memory_budget(cls, protected: EngineKey) -> None:
+        """Evict least recently used engines until the resident set fits the budget"""
+        budget = getattr(settings, "OCR_CONFIG", {}).get("ENGINE_MEMORY_BUDGET_MB")
+        if not budget:
+            return
+
+        protected_engine = cls._engines[protected]
+        while sum(cls._engine_memory_mb.values()) > budget:
+            victim = next(
+                (
+                    key
+                    for key, engine in cls._engines.items()
+                    if key != protected
+                    and not cls._depends_on(protected_engine, engine)
+                ),
+                None,
+            )
+            if victim is None:
+                logging.warning(
+                    "OCR engines use ~%.0f MB, over the %s MB budget, "
+                    "but nothing else can be evicted",
+                    sum(cls._engine_memory_mb.values()),
+                    budget,
+                )
+                return
+            cls.evict_engine(*victim)
+
+    @classmethod
+    def evict_engine(cls, engine_name: str, lang: str) -> None:
+        """Unload an engine and any engine borrowing its model"""
+        with cls._lock:
+            engine = cls._engines.pop((engine_name, lang), None)
+            if engine is None:
+                return
+            memory_mb = cls._engine_memory_mb.pop((engine_name, lang), 0.0)
+            key = (engine_name, lang)
+            cls._evictions[key] = cls._evictions.get(key, 0) + 1
+            logging.info(
+                "Evicted OCR engine %s (%s), ~%.0f MB", engine_name, lang, memory_mb
+            )
+
+            for other_key, other in list(cls._engines.items()):
+                if cls._depends_on(other, engine):
+                    cls.evict_engine(*other_key)
+
+            slot = getattr(engine, "slot", None)
+            if slot is not None and not cls._slot_in_use(slot):
+                threading.Thread(
+                    target=slot.stop, name=f"ocr-slot-stop-{slot.primary_engine}"
+                ).start()
+                cls._slots = {k: s for k, s in cls._slots.items() if s is not slot}
+
+        # In-process models are freed once in-flight calls drop their references
+        force_garbage_collection()
+
+    @classmethod
+    def get_metrics(cls) -> dict:
+        """Resident engines, memory estimates, load/eviction counts and batching"""
+        with cls._lock:
+            keys = sorted(set(cls._loads) | set(cls._evictions))
+            resident = dict(cls._engines)
+            metrics = {
+                "memory_budget_mb": getattr(settings, "OCR_CONFIG", {}).get(
+                    "ENGINE_MEMORY_BUDGET_MB"
+                ),
+                "resident_memory_mb": round(sum(cls._engine_memory_mb.values()), 1),
+                "loads": sum(cls._loads.values()),
+                "evictions": sum(cls._evictions.values()),
+                "engines": [
+                    {
+                        "engine": name,
+                        "lang": lang,
+                        "resident": (name, lang) in cls._engines,
+                        "memory_mb": round(
+                            cls._engine_memory_mb.get((name, lang), 0.0), 1
+                        ),
+                        "loads": cls._loads.get((name, lang), 0),
+                        "evictions": cls._evictions.get((name, lang), 0),
+                    }
+                    for name, lang in keys
+                ],
+            }
+
+        if zygote.is_enabled():
+            metrics["worker_memory"] = zygote.shared_memory_mb()
+
+        # Batchers live in the engines (or their execution slots), queried
+        # outside the lock
+        if getattr(settings, "OCR_CONFIG", {}).get("BATCHING_ENABLED", False):
+            for entry in metrics["engines"]:
+                engine = resident.get((entry["engine"], entry["lang"]))
+                if engine is None:
+                    continue
+                try:
+                    entry["batching"] = engine.batching_metrics()
+                except Exception as e:
+                    logging.warning(
+                        "Batching metrics unavailable for %s: %s", entry["engine"], e
+                    )
+        return metrics
+
     @classmethod
     def initialize_all_engines(cls) -> None:
-        """Initialize all supported engines"""
-        cls.get_engine("Tesseract")
-        cls.get_engine("PaddleOCR")
-        cls.get_engine("PaddleTable")
+        """Initialize the engines this node serves for the default language"""
+        if getattr(settings, "OCR_CONFIG", {}).get("NODE_ENGINES"):
+            engines = cls.get_served_engines()
+        else:
+            engines = ["Tesseract", "PaddleOCR", "PaddleTable", "PaddleCombined"]
+        for engine_name in engines:
+            if zygote.is_enabled() and not cls._fork_safe(engine_name):
+                logging.info("%s loads in each zygote worker", engine_name)
+                continue
+            cls.get_engine(engine_name)
+
+    @classmethod
+    def _fork_safe(cls, engine_name: str) -> bool:
+        """Whether a loaded engine keeps working in a forked worker"""
+        # In-process Paddle engines start native thread pools; in execution
+        # slots, the slot processes and their pipes cannot be shared
+        return cls._canonical_name(engine_name).lower() not in FORK_UNSAFE_ENGINES
+
+    @classmethod
+    def _reset_after_fork(cls) -> None:
+        """A forked child starts with the lock free, whatever thread held it"""
+        cls._lock = threading.RLock()
+        # Loads running in other threads of the parent never finish here
+        cls._loading = {}
+
+    @classmethod
+    def get_served_engines(cls) -> list:
+        """Engines this node accepts requests for (OCR_NODE_ENGINES, default all)"""
+        configured = getattr(settings, "OCR_CONFIG", {}).get("NODE_ENGINES")
+        if not configured:
+            return cls.get_available_engines()
+        return [cls._canonical_name(name) for name in configured]
 
     @classmethod
     def get_available_engines(cls) -> list:
         """Get list of available engine names"""
-        return ["Tesseract", "PaddleOCR", "PaddleTable"]
+        return [
+            "Tesseract",
+            "PaddleOCR",
+            "PaddleTable",
+            "PaddleCombined",
+            "PaddleONNX",
+            "PaddleBatched",
+        ]
+
+    @classmethod
+    def get_available_languages(cls) -> List[str]:
+        """Get list of configured request languages"""
+        return get_available_languages()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=OCREngineFactory._reset_after_fork)
@@ -0,0 +1,57 @@
+import logging
+from typing import Tuple, Any, Optional, Union
+import numpy as np
+from PIL import Image
+from .base import BaseOCREngine
+from ..execution import ExecutionSlot
+
+
+class IsolatedOCREngine(BaseOCREngine):
+    """Proxy running an engine inside an ExecutionSlot child process.
+
+    Calls that exceed the timeout raise EngineTimeout; the slot is then
+    killed and reloaded in the background while this process keeps serving.
+    """
+
+    def __init__(
+        self, engine_name: str, slot: ExecutionSlot, timeout: float, error_label: str
+    ):
+        self.engine_name = engine_name
+        self.slot = slot
+        self.timeout = timeout
+        # Prefix of the "<label> not ready" error the view maps to a 503
+        self.error_label = error_label
+
+    def initialize(self) -> None:
+        """Start the execution slot (shared with other engines in its group)"""
+        try:
+            self.slot.start()
+        except Exception as e:
+            logging.error(
+                "Failed to start execution slot for %s: %s", self.engine_name, str(e)
+            )
+
+    def is_ready(self) -> Tuple[bool, str]:
+        return self.slot.is_ready()
+
+    def _call(self, method: str, *args):
+        if not self.is_ready()[0]:
+            raise RuntimeError(f"{self.error_label} not ready: {self.is_ready()[1]}")
+        return self.slot.call(self.engine_name, method, args, self.timeout)
+
+    def preprocess_image(
+        self, img: Image.Image, max_size: int = -1
+    ) -> Union[np.ndarray, Image.Image]:
+        return self._call("preprocess_image", img, max_size)
+
+    def extract_text(self, img: Any):
+        """Extract text in the execution slot. Returns (text, average_conf, tables)."""
+        return self._call("extract_text", img)
+
+    def extract_text_with_words(self, img: Any):
+        """Extract text and word boxes in the execution slot. Returns (text, average_conf, tables, words)."""
+        return self._call("extract_text_with_words", img)
+
+    def batching_metrics(self) -> Optional[dict]:
+        """Batching metrics of the engine in the execution slot"""
+        return self._call("batching_metrics")
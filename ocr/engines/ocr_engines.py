@@ -4,9 +4,25 @@ OCR Engines Module
 This module provides a clean interface for OCR operations using different engines.
 """
 
+import contextvars
 import logging
-from typing import Tuple, Any
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
 from .factory import OCREngineFactory
+from ..incremental import extract_text_incremental, supports_incremental
+from ..preprocessing import shared_preprocessing
+from ..profiling import run_with_stage_prefix
+
+# Engines run concurrently for multi-model requests; Paddle inference and the
+# Tesseract subprocess release the GIL while they work
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# Engines reporting confidence in 0-100; the others report 0-1
+PERCENT_CONFIDENCE_ENGINES = ("Tesseract",)
 
 
 def initialize_paddle_ocr():
@@ -29,13 +45,14 @@ def is_paddle_ocr_ready():
     return engine.is_ready()
 
 
-def perform_ocr(img: Any, model_name: str):
+def perform_ocr(img: Any, model_name: str, lang: Optional[str] = None):
     """
     Perform OCR on an image using the specified engine.
 
     Args:
         img: Image to process (PIL Image or numpy array)
-        model_name: Name of the OCR engine ('Tesseract', 'PaddleOCR', or 'PaddleTable')
+        model_name: Name of the OCR engine ('Tesseract', 'PaddleOCR', 'PaddleTable' or 'PaddleCombined')
+        lang: Request language code (default: DEFAULT_LANGUAGE)
 
     Returns:
         Tuple of (extracted_text, average_confidence, tables)
@@ -46,13 +63,177 @@ def perform_ocr(img: Any, model_name: str):
         RuntimeError: If engine is not ready
     """
     try:
-        engine = OCREngineFactory.get_engine(model_name)
+        engine = OCREngineFactory.get_engine(model_name, lang)
         return engine.extract_text(img)
     except Exception as e:
         logging.error("OCR processing failed: %s", str(e))
         raise
 
 
+def perform_ocr_with_words(img: Any, model_name: str, lang: Optional[str] = None):
+    """
+    Perform OCR and also return recognized words with their boxes.
+
+    Returns:
+        Tuple of (extracted_text, average_confidence, tables, words)
+        - words: list of {'text', 'conf', 'box'} dicts
+    """
+    try:
+        engine = OCREngineFactory.get_engine(model_name, lang)
+        return engine.extract_text_with_words(img)
+    except Exception as e:
+        logging.error("OCR processing failed: %s", str(e))
+        raise
+
+
+def perform_ocr_incremental(img: Any, model_name: str, lang: Optional[str] = None):
+    """
+    Perform OCR reading only the page tiles that changed since a cached page
+    (see ocr/incremental.py). Falls back to a full-page pass for engines
+    whose word boxes do not line up with the tiles.
+
+    Returns:
+        Tuple of (extracted_text, average_confidence, tables, words, tiles)
+        - tiles: {'tiles_total', 'tiles_reused'}
+    """
+    try:
+        engine = OCREngineFactory.get_engine(model_name, lang)
+        if not supports_incremental(model_name):
+            tiles = {"tiles_total": 0, "tiles_reused": 0}
+            return (*engine.extract_text_with_words(img), tiles)
+        return extract_text_incremental(engine, img, (model_name, lang))
+    except Exception as e:
+        logging.error("OCR processing failed: %s", str(e))
+        raise
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    # Concurrent requests (gthread workers) must not each create a pool
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=len(OCREngineFactory.get_available_engines()),
+                thread_name_prefix="ocr-engine",
+            )
+        return _executor
+
+
+def _reset_executor() -> None:
+    """A forked child has none of the pool's threads; it starts its own"""
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+def _run_engine_group(
+    img: Any, model_names: List[str], with_words: bool, lang: Optional[str]
+):
+    """Run engines sharing one model pipeline one after another"""
+    results = {}
+    for model_name in model_names:
+        try:
+            if with_words:
+                results[model_name] = run_with_stage_prefix(
+                    model_name.lower(), perform_ocr_with_words, img, model_name, lang
+                )
+            else:
+                results[model_name] = run_with_stage_prefix(
+                    model_name.lower(), perform_ocr, img, model_name, lang
+                )
+        except Exception as e:
+            results[model_name] = e
+    return results
+
+
+def perform_ocr_multi(
+    img: Any,
+    model_names: List[str],
+    with_words: bool = False,
+    lang: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Run several OCR engines concurrently on the same decoded image.
+
+    Engines with matching preprocessing configuration share one preprocessed
+    page. Engines that share a Paddle pipeline (PaddleCombined borrows
+    PaddleTable's) run sequentially, since a predictor must not be used from
+    two threads at once.
+
+    Returns:
+        Dict mapping each model name to its result tuple (as returned by
+        perform_ocr, or perform_ocr_with_words when with_words is set), or to
+        the exception it raised
+    """
+    groups: Dict[int, List[str]] = {}
+    for model_name in model_names:
+        engine = OCREngineFactory.get_engine(model_name, lang)
+        owner = getattr(engine, "table_engine", engine)
+        groups.setdefault(id(owner), []).append(model_name)
+
+    results: Dict[str, Any] = {}
+    with shared_preprocessing():
+        executor = _get_executor()
+        # Each task gets a copy of the request context for shared
+        # preprocessing and stage timings
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run,
+                _run_engine_group,
+                img,
+                group,
+                with_words,
+                lang,
+            )
+            for group in groups.values()
+        ]
+        for future in futures:
+            results.update(future.result())
+    return {model_name: results[model_name] for model_name in model_names}
+
+
+def _normalized_confidence(model_name: str, average_conf: Optional[float]) -> float:
+    """Confidence on a 0-1 scale; Tesseract reports 0-100, Paddle engines 0-1"""
+    if average_conf is None:
+        return -1.0
+    if model_name in PERCENT_CONFIDENCE_ENGINES:
+        return average_conf / 100
+    return average_conf
+
+
+def merge_best_confidence(results: Dict[str, Tuple]) -> Optional[Dict[str, Any]]:
+    """
+    Pick the text of the engine with the highest average confidence.
+
+    Args:
+        results: Successful results from perform_ocr_multi, model name to
+            (text, average_confidence, tables, ...) tuple
+
+    Returns:
+        Dict with 'model', 'text' and 'average_confidence' (normalized to
+        0-1), or None when no engine produced text
+    """
+    best, best_conf = None, None
+    for model_name, result in results.items():
+        text, average_conf = result[0], result[1]
+        if not text:
+            continue
+        conf = _normalized_confidence(model_name, average_conf)
+        if best is None or conf > best_conf:
+            best, best_conf = {
+                "model": model_name,
+                "text": text,
+                "average_confidence": (
+                    round(conf, 3) if average_conf is not None else None
+                ),
+            }, conf
+    return best
+
+
 def get_available_engines():
     """Get list of available OCR engines"""
     return OCREngineFactory.get_available_engines()
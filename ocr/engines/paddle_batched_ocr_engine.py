@@ -0,0 +1,173 @@
+import logging
+import numpy as np
+from typing import Tuple, Any, Optional
+from PIL import Image
+from django.conf import settings
+from paddleocr import TextDetection, TextLineOrientationClassification, TextRecognition
+from .base import BaseOCREngine, configured_cpu_threads
+from ..preprocessing import (
+    get_preprocessing_pipeline,
+    get_resample_filter,
+    is_blank_page,
+)
+from ..profiling import stage_timer
+from ..orientation import ORIENTATION_METHODS, correct_page_orientation
+from ..text_lines import crop_lines, lines_to_words, sort_reading_order
+from ..utils import force_garbage_collection
+
+# Recognition input height and minimum (padded) width
+REC_IMAGE_HEIGHT = 48
+REC_IMAGE_WIDTH = 320
+
+
+class PaddleBatchedOCREngine(BaseOCREngine):
+    """PaddleOCR models run as separate stages: detection once per page, then
+    recognition of all text lines in width-bucketed batches.
+
+    The PaddleOCR pipeline batches lines in detection order, so one long line
+    pads every short line in its batch to its width.
+    """
+
+    def __init__(
+        self,
+        rec_model: str,
+        det_model: Optional[str] = None,
+        page_orientation: Optional[str] = None,
+    ):
+        config = getattr(settings, "OCR_CONFIG", {})
+        # Recognition model per language, e.g. "en_PP-OCRv5_mobile_rec"
+        self.rec_model = rec_model
+        self.det_model = det_model or config.get(
+            "PADDLE_DET_MODEL", "PP-OCRv5_server_det"
+        )
+        self.det = None
+        self.cls = None
+        self.rec = None
+        self.initialized = False
+        self.init_error = None
+        # Text lines per recognition batch, bucketed by width unless disabled
+        self.rec_batch_size = config.get("REC_BATCH_SIZE", 6)
+        self.bucket_by_width = True
+        self.preprocessing = get_preprocessing_pipeline("PaddleOCR", output_channels=3)
+        if page_orientation is None:
+            page_orientation = config.get("PADDLEOCR_PAGE_ORIENTATION", "off")
+        if page_orientation not in ORIENTATION_METHODS:
+            raise ValueError(f"Unknown page orientation method: {page_orientation}")
+        self.page_orientation = page_orientation
+
+    def initialize(self) -> None:
+        """Load the detection, line orientation and recognition models"""
+        if self.initialized:
+            return
+
+        try:
+            threads = configured_cpu_threads("PaddleBatched")
+            predictor_options = {"cpu_threads": threads} if threads else {}
+            # Same detection resizing as the PaddleOCR pipeline
+            self.det = TextDetection(
+                model_name=self.det_model,
+                limit_side_len=64,
+                limit_type="min",
+                **predictor_options,
+            )
+            # Per-line orientation is only needed when pages are not rotated
+            # upright beforehand
+            if self.page_orientation == "off":
+                self.cls = TextLineOrientationClassification(**predictor_options)
+            self.rec = TextRecognition(model_name=self.rec_model, **predictor_options)
+            self.initialized = True
+            logging.info(
+                "PaddleBatched initialized (%s, %s)", self.det_model, self.rec_model
+            )
+        except Exception as e:
+            logging.error("PaddleBatched initialization failed: %s", str(e))
+            self.init_error = str(e)
+            self.initialized = False
+
+    def is_ready(self) -> Tuple[bool, str]:
+        """Check if the models are loaded"""
+        if self.init_error:
+            return False, f"Initialization failed: {self.init_error}"
+        if not self.initialized:
+            return False, "Not initialized"
+        return True, "Ready"
+
+    def preprocess_image(self, img: Image.Image, max_size: int = -1) -> np.ndarray:
+        """Preprocess image like PaddleOCREngine"""
+        if max_size == -1:
+            max_size = getattr(settings, "OCR_CONFIG", {}).get(
+                "PADDLEOCR_MAX_IMAGE_SIZE", 1024
+            )
+        return self.preprocessing.run(img, max_size, get_resample_filter("PaddleOCR"))
+
+    def _detect(self, img: np.ndarray) -> list:
+        """Text line boxes (4x2 corner arrays) in reading order"""
+        polys = self.det.predict(img)[0]["dt_polys"]
+        return sort_reading_order(
+            [np.asarray(poly, dtype=np.float32) for poly in polys]
+        )
+
+    def _recognize(self, img: np.ndarray, boxes: list) -> list:
+        """Recognize every line in width-bucketed batches, in reading order"""
+        results = [("", 0.0)] * len(boxes)
+        for indices, crops, _ in crop_lines(
+            img,
+            np.asarray(boxes),
+            REC_IMAGE_HEIGHT,
+            REC_IMAGE_WIDTH,
+            self.rec_batch_size,
+            sort=self.bucket_by_width,
+        ):
+            if self.cls is not None:
+                orientations = self.cls.predict(crops, batch_size=len(crops))
+                crops = [
+                    (
+                        np.ascontiguousarray(np.rot90(crop, 2))
+                        if res["label_names"][0] == "180_degree"
+                        else crop
+                    )
+                    for crop, res in zip(crops, orientations)
+                ]
+            # The recognizer pads a batch to its widest line
+            for i, res in zip(indices, self.rec.predict(crops, batch_size=len(crops))):
+                results[i] = (res["rec_text"], float(res["rec_score"]))
+        return results
+
+    def extract_text(self, img: Any):
+        """Extract text with batched recognition. Returns (text, average_conf, tables=None)."""
+        text, average_conf, tables, _ = self.extract_text_with_words(img)
+        return text, average_conf, tables
+
+    def extract_text_with_words(self, img: Any):
+        """Extract text and word boxes with batched recognition. Returns (text, average_conf, None, words)."""
+        if not self.is_ready()[0]:
+            raise RuntimeError(f"PaddleBatched not ready: {self.is_ready()[1]}")
+
+        # Blank fax pages are detected on the packed bitplane and skipped
+        if is_blank_page(img):
+            return "", None, None, []
+
+        try:
+            with stage_timer("preprocess"):
+                processed_img = self.preprocess_image(img)
+                processed_img = correct_page_orientation(
+                    processed_img, self.page_orientation
+                )
+                img_np = np.ascontiguousarray(np.asarray(processed_img))
+
+            with stage_timer("detect"):
+                boxes = self._detect(img_np)
+
+            with stage_timer("recognize"):
+                lines = self._recognize(img_np, boxes) if boxes else []
+
+            with stage_timer("postprocess"):
+                text, average_conf, words = lines_to_words(boxes, lines)
+
+            force_garbage_collection()
+            return text, average_conf, None, words
+        except Exception as e:
+            logging.error(
+                "Error in PaddleBatched processing: %s", str(e), exc_info=True
+            )
+            raise RuntimeError(f"PaddleBatched processing failed: {str(e)}")
@@ -0,0 +1,130 @@
+import logging
+from typing import Tuple, Any, Optional
+from PIL import Image
+import numpy as np
+from .base import BaseOCREngine
+from .paddle_table_ocr_engine import PaddleTableOCREngine
+from ..batching import BatchDeadlineExceeded
+from ..preprocessing import is_blank_page
+from ..profiling import stage_timer
+from ..utils import (
+    log_memory_usage,
+    check_memory_available,
+    force_garbage_collection,
+    split_line_into_words,
+)
+
+
+class PaddleCombinedOCREngine(BaseOCREngine):
+    """Combined full-page text and table engine.
+
+    Runs TableRecognitionPipelineV2 once and reads both the full-page text
+    (from the pipeline's overall OCR pass) and the table HTML from the same
+    result. The pipeline is borrowed from a PaddleTableOCREngine so the
+    detection and recognition weights are loaded only once per process.
+    """
+
+    def __init__(self, table_engine: PaddleTableOCREngine, include_tables: bool = True):
+        self.table_engine = table_engine
+        self.include_tables = include_tables
+        self.initialized = False
+
+    def initialize(self) -> None:
+        # The shared pipeline is owned and initialized by the table engine
+        self.table_engine.initialize()
+        self.initialized = self.table_engine.is_ready()[0]
+
+    def is_ready(self) -> Tuple[bool, str]:
+        return self.table_engine.is_ready()
+
+    @property
+    def thread_safe(self) -> bool:
+        return self.table_engine.thread_safe
+
+    def batching_metrics(self) -> Optional[dict]:
+        return self.table_engine.batching_metrics()
+
+    def preprocess_image(self, img: Image.Image, max_size: int = -1) -> np.ndarray:
+        return self.table_engine.preprocess_image(img, max_size)
+
+    def extract_text(self, img: Any):
+        """Extract full-page text and tables in one pipeline pass. Returns (text, average_conf, tables)."""
+        text, average_conf, tables, _ = self.extract_text_with_words(img)
+        return text, average_conf, tables
+
+    def extract_text_with_words(self, img: Any):
+        """Extract full-page text, tables and word boxes in one pipeline pass. Returns (text, average_conf, tables, words)."""
+        if not self.is_ready()[0]:
+            raise RuntimeError(
+                f"PaddleCombinedOCREngine not ready: {self.is_ready()[1]}"
+            )
+
+        # Blank fax pages are detected on the packed bitplane and skipped
+        if is_blank_page(img):
+            return "", None, None, []
+
+        try:
+            log_memory_usage("Before PaddleCombined preprocessing")
+
+            if not check_memory_available(min_mb=2000):
+                logging.warning("Low memory detected, forcing garbage collection")
+                force_garbage_collection()
+
+            with stage_timer("preprocess"):
+                processed_img = self.preprocess_image(img)
+                img_np = np.asarray(processed_img)
+
+            log_memory_usage("Before PaddleCombined prediction")
+
+            with stage_timer("predict"):
+                output = self.table_engine.predict(img_np)
+
+            log_memory_usage("After PaddleCombined prediction")
+
+            with stage_timer("postprocess"):
+                tables = []
+                words = []
+
+                for res in output:
+                    res_obj = getattr(res, "res", res)
+                    # Full-page text comes from the overall OCR pass that also
+                    # feeds table cell filling, so detection runs only once
+                    overall_ocr = res_obj.get("overall_ocr_res", {}) or {}
+                    rec_texts = overall_ocr.get("rec_texts", [])
+                    rec_boxes = overall_ocr.get("rec_boxes")
+                    if rec_boxes is None or len(rec_boxes) != len(rec_texts):
+                        rec_boxes = [None] * len(rec_texts)
+                    for text_segment, score, box in zip(
+                        rec_texts, overall_ocr.get("rec_scores", []), rec_boxes
+                    ):
+                        words.extend(split_line_into_words(text_segment, score, box))
+
+                    if self.include_tables:
+                        for table in res_obj.get("table_res_list", []):
+                            html = table.get("pred_html")
+                            if html:
+                                tables.append(html)
+
+                text = " ".join(word["text"] for word in words)
+                confidences = [word["conf"] for word in words]
+                average_conf = (
+                    round(sum(confidences) / len(confidences), 3)
+                    if confidences
+                    else None
+                )
+                if not tables:
+                    tables = None
+
+            force_garbage_collection()
+            log_memory_usage("After PaddleCombined garbage collection")
+
+            return text, average_conf, tables, words
+
+        except BatchDeadlineExceeded:
+            raise
+        except Exception as e:
+            logging.error(
+                "Error in PaddleCombinedOCREngine processing: %s", str(e), exc_info=True
+            )
+            force_garbage_collection()
+            raise RuntimeError(f"PaddleCombinedOCREngine processing failed: {str(e)}")
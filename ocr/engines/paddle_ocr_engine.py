@@ -1,21 +1,46 @@
 import logging
 import os
 import numpy as np
-from typing import Tuple, Any
+from typing import Tuple, Any, Optional
 from PIL import Image
 from django.conf import settings
 from paddleocr import PaddleOCR
-from .base import BaseOCREngine
-from ..utils import log_memory_usage, check_memory_available, force_garbage_collection
+from .base import BaseOCREngine, configured_cpu_threads
+from ..batching import BatchDeadlineExceeded, create_batcher
+from ..preprocessing import (
+    get_preprocessing_pipeline,
+    get_resample_filter,
+    is_blank_page,
+)
+from ..profiling import stage_timer
+from ..orientation import ORIENTATION_METHODS, correct_page_orientation
+from ..utils import (
+    log_memory_usage,
+    check_memory_available,
+    force_garbage_collection,
+    split_line_into_words,
+)
 
 
 class PaddleOCREngine(BaseOCREngine):
     """PaddleOCR engine implementation"""
 
-    def __init__(self):
+    def __init__(self, page_orientation: Optional[str] = None, lang: str = "en"):
         self.ocr = None
+        self.batcher = None
+        # PaddleOCR language code; each language loads its own recognition model
+        self.lang = lang
         self.initialized = False
         self.init_error = None
+        self.preprocessing = get_preprocessing_pipeline("PaddleOCR", output_channels=3)
+        # Page orientation method; read from settings if not provided
+        if page_orientation is None:
+            page_orientation = getattr(settings, "OCR_CONFIG", {}).get(
+                "PADDLEOCR_PAGE_ORIENTATION", "off"
+            )
+        if page_orientation not in ORIENTATION_METHODS:
+            raise ValueError(f"Unknown page orientation method: {page_orientation}")
+        self.page_orientation = page_orientation
 
     def initialize(self) -> None:
         """Initialize PaddleOCR engine"""
@@ -25,8 +50,19 @@ class PaddleOCREngine(BaseOCREngine):
 
         try:
             logging.info("Initializing PaddleOCR during service startup...")
-            # Initialize PaddleOCR - it will use models from shared volume if they exist
-            self.ocr = PaddleOCR(use_angle_cls=True, lang="en")
+            # Initialize PaddleOCR - it will use models from shared volume if they exist.
+            # Per-line angle classification is only needed when the page itself
+            # is not rotated upright beforehand.
+            threads = configured_cpu_threads("PaddleOCR")
+            self.ocr = PaddleOCR(
+                use_angle_cls=self.page_orientation == "off",
+                lang=self.lang,
+                **({"cpu_threads": threads} if threads else {}),
+            )
+            # Concurrent requests share batched predict calls when enabled;
+            # only the batcher's thread then touches the pipeline
+            self.batcher = create_batcher(f"PaddleOCR-{self.lang}", self._predict_batch)
+            self.thread_safe = self.batcher is not None
 
             self.initialized = True
             logging.info("PaddleOCR initialization completed successfully")
@@ -45,7 +81,7 @@ class PaddleOCREngine(BaseOCREngine):
 
         return True, "Ready"
 
-    def preprocess_image(self, img: Image.Image, max_size: int = -1) -> Image.Image:
+    def preprocess_image(self, img: Image.Image, max_size: int = -1) -> np.ndarray:
         """Preprocess image for PaddleOCR"""
         # Get max_size from settings if not provided
         if max_size == -1:
@@ -53,33 +89,19 @@ class PaddleOCREngine(BaseOCREngine):
                 "PADDLEOCR_MAX_IMAGE_SIZE", 1024
             )
 
-        # Convert to RGB if needed
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-
-        # Get original dimensions
-        width, height = img.size
-        logging.info("Original image size: %dx%d", width, height)
-
-        # Calculate new dimensions while maintaining aspect ratio
-        if width > height:
-            if width > max_size:
-                new_width = max_size
-                new_height = int(height * (max_size / width))
-            else:
-                return img
-        else:
-            if height > max_size:
-                new_height = max_size
-                new_width = int(width * (max_size / height))
-            else:
-                return img
-
-        # Resize image
-        resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        logging.info("Resized image to: %dx%d", new_width, new_height)
-
-        return resized_img
+        return self.preprocessing.run(img, max_size, get_resample_filter("PaddleOCR"))
+
+    def _predict_batch(self, images: list) -> list:
+        """One pipeline call for several pages, returning each page's result list"""
+        return [[result] for result in self.ocr.predict(images)]
+
+    def _predict(self, img_np: np.ndarray):
+        if self.batcher is None:
+            return self.ocr.predict(img_np)
+        return self.batcher.submit(img_np)
+
+    def batching_metrics(self) -> Optional[dict]:
+        return self.batcher.get_metrics() if self.batcher else None
 
     def _extract_text_with_rec_scores(self, result_obj):
         """Extract text and confidence scores from result object with rec_scores"""
@@ -151,6 +173,22 @@ class PaddleOCREngine(BaseOCREngine):
 
         return extracted_words, extracted_confs
 
+    def _extract_word_boxes(self, result):
+        """Collect words with boxes estimated from each text line's rec_boxes"""
+        words = []
+        for res in result if isinstance(result, list) else [result]:
+            res_obj = getattr(res, "res", res)
+            if not isinstance(res_obj, dict):
+                continue
+            rec_texts = res_obj.get("rec_texts", [])
+            rec_scores = res_obj.get("rec_scores", [])
+            rec_boxes = res_obj.get("rec_boxes")
+            if rec_boxes is None or len(rec_boxes) != len(rec_texts):
+                rec_boxes = [None] * len(rec_texts)
+            for text_segment, score, box in zip(rec_texts, rec_scores, rec_boxes):
+                words.extend(split_line_into_words(text_segment, score, box))
+        return words
+
     def _log_extraction_results(self, words, confidences):
         """Log the extracted words and confidence scores"""
         logging.info(
@@ -161,9 +199,18 @@ class PaddleOCREngine(BaseOCREngine):
 
     def extract_text(self, img: Any):
         """Extract text using PaddleOCR. Returns (text, average_conf, tables) where tables is a list of HTML strings or None."""
+        text, average_conf, tables, _ = self.extract_text_with_words(img)
+        return text, average_conf, tables
+
+    def extract_text_with_words(self, img: Any):
+        """Extract text and word boxes using PaddleOCR. Returns (text, average_conf, tables, words)."""
         if not self.is_ready()[0]:
             raise RuntimeError(f"PaddleOCR not ready: {self.is_ready()[1]}")
 
+        # Blank fax pages are detected on the packed bitplane and skipped
+        if is_blank_page(img):
+            return "", None, None, []
+
         try:
             # Log memory usage before processing
             log_memory_usage("Before PaddleOCR preprocessing")
@@ -173,65 +220,83 @@ class PaddleOCREngine(BaseOCREngine):
                 logging.warning("Low memory detected, forcing garbage collection")
                 force_garbage_collection()
 
-            logging.info("Preprocessing image for PaddleOCR...")
-            processed_img = self.preprocess_image(img)
+            with stage_timer("preprocess"):
+                logging.info("Preprocessing image for PaddleOCR...")
+                processed_img = self.preprocess_image(img)
+                processed_img = correct_page_orientation(
+                    processed_img, self.page_orientation
+                )
 
-            # Convert to numpy array
-            img_np = np.array(processed_img)
-            logging.info(
-                "Image converted to numpy array, shape: %s, dtype: %s",
-                img_np.shape,
-                img_np.dtype,
-            )
+                # Convert to numpy array
+                img_np = np.asarray(processed_img)
+                logging.info(
+                    "Image converted to numpy array, shape: %s, dtype: %s",
+                    img_np.shape,
+                    img_np.dtype,
+                )
 
             # Log memory usage before prediction
             log_memory_usage("Before PaddleOCR prediction")
 
-            # Run prediction
-            logging.info("Running PaddleOCR prediction...")
-            try:
-                result = self.ocr.predict(img_np)
-                logging.info("PaddleOCR predict() completed successfully")
-            except Exception as predict_error:
-                logging.error(
-                    "PaddleOCR predict() failed: %s", str(predict_error), exc_info=True
-                )
-                raise RuntimeError(f"PaddleOCR prediction failed: {str(predict_error)}")
+            with stage_timer("predict"):
+                # Run prediction
+                logging.info("Running PaddleOCR prediction...")
+                try:
+                    result = self._predict(img_np)
+                    logging.info("PaddleOCR predict() completed successfully")
+                except BatchDeadlineExceeded:
+                    raise
+                except Exception as predict_error:
+                    logging.error(
+                        "PaddleOCR predict() failed: %s",
+                        str(predict_error),
+                        exc_info=True,
+                    )
+                    raise RuntimeError(
+                        f"PaddleOCR prediction failed: {str(predict_error)}"
+                    )
 
             # Log memory usage after prediction
             log_memory_usage("After PaddleOCR prediction")
 
-            logging.info("PaddleOCR result structure: %s", str(result))
+            with stage_timer("postprocess"):
+                logging.info("PaddleOCR result structure: %s", str(result))
 
-            # Extract text using the recursive function
-            words, confidences = self._extract_text_from_result(result)
+                # Extract text using the recursive function
+                words, confidences = self._extract_text_from_result(result)
 
-            text = " ".join(words)
-            average_conf = (
-                round(sum(confidences) / len(confidences), 3) if confidences else None
-            )
-            logging.info("Final extracted text: '%s'", text)
-            logging.info("Average confidence: %s", str(average_conf))
-
-            # Extract table HTML if present
-            tables = []
-            # result is usually a list of dicts, each with 'table_res_list' if tables detected
-            if isinstance(result, list):
-                for res in result:
-                    res_obj = getattr(res, "res", res)
-                    table_res_list = res_obj.get("table_res_list", [])
-                    for table in table_res_list:
-                        html = table.get("pred_html")
-                        if html:
-                            tables.append(html)
-            if not tables:
-                tables = None
+                text = " ".join(words)
+                average_conf = (
+                    round(sum(confidences) / len(confidences), 3)
+                    if confidences
+                    else None
+                )
+                logging.info("Final extracted text: '%s'", text)
+                logging.info("Average confidence: %s", str(average_conf))
+
+                # Extract table HTML if present
+                tables = []
+                # result is usually a list of dicts, each with 'table_res_list' if tables detected
+                if isinstance(result, list):
+                    for res in result:
+                        res_obj = getattr(res, "res", res)
+                        table_res_list = res_obj.get("table_res_list", [])
+                        for table in table_res_list:
+                            html = table.get("pred_html")
+                            if html:
+                                tables.append(html)
+                if not tables:
+                    tables = None
+
+                word_boxes = self._extract_word_boxes(result)
 
             # Force garbage collection after processing
             force_garbage_collection()
             log_memory_usage("After garbage collection")
 
-            return text, average_conf, tables
+            return text, average_conf, tables, word_boxes
+        except BatchDeadlineExceeded:
+            raise
         except Exception as e:
             logging.error("Error in PaddleOCR processing: %s", str(e), exc_info=True)
             raise RuntimeError(f"PaddleOCR processing failed: {str(e)}")
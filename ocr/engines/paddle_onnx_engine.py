@@ -0,0 +1,338 @@
+"""
+PaddleOCR models on ONNX Runtime
+
+Runs the PP-OCR text detection (DB), text line orientation and recognition
+(CTC) models exported to ONNX, without importing PaddlePaddle. Pre- and
+post-processing follow the PaddleOCR pipeline defaults, so results match
+PaddleOCREngine on the same models.
+
+Models are read from PADDLE_ONNX_MODEL_DIR:
+    det.onnx            text detection
+    cls.onnx            text line orientation (optional)
+    rec_<lang>.onnx     text recognition for each PaddleOCR language code
+    rec_<lang>.txt      recognition character dictionary, one per line; only
+                        needed when the model does not embed it (paddle2onnx
+                        stores it in the "character" metadata entry)
+"""
+
+import logging
+import os
+from typing import Any, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .base import BaseOCREngine
+from ..orientation import ORIENTATION_METHODS, correct_page_orientation
+from ..preprocessing import (
+    get_preprocessing_pipeline,
+    get_resample_filter,
+    is_blank_page,
+)
+from ..profiling import stage_timer
+from ..text_lines import crop_lines, lines_to_words, sort_reading_order
+from ..utils import force_garbage_collection
+
+# Detection: resize so the short side is at least DET_LIMIT_SIDE_LEN and the
+# long side at most DET_MAX_SIDE_LIMIT, in multiples of 32
+DET_LIMIT_SIDE_LEN = 64
+DET_MAX_SIDE_LIMIT = 4000
+DET_THRESH = 0.3
+DET_BOX_THRESH = 0.6
+DET_UNCLIP_RATIO = 1.5
+DET_MAX_CANDIDATES = 1000
+DET_MIN_SIZE = 3
+
+# Recognition input height and minimum (padded) width
+REC_IMAGE_HEIGHT = 48
+REC_IMAGE_WIDTH = 320
+
+# Text line orientation input (height, width) when the model is dynamic
+CLS_IMAGE_SHAPE = (80, 160)
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+GRAPH_OPTIMIZATION_LEVELS = ("disable", "basic", "extended", "all")
+
+
+def _order_points(points: np.ndarray) -> np.ndarray:
+    """Order the corners of a rectangle as top-left, top-right, bottom-right, bottom-left"""
+    points = sorted(points.tolist(), key=lambda p: p[0])
+    left = sorted(points[:2], key=lambda p: p[1])
+    right = sorted(points[2:], key=lambda p: p[1])
+    return np.array([left[0], right[0], right[1], left[1]], dtype=np.float32)
+
+
+def _box_score(pred: np.ndarray, box: np.ndarray) -> float:
+    """Mean probability inside the box"""
+    height, width = pred.shape
+    xmin = int(np.clip(np.floor(box[:, 0].min()), 0, width - 1))
+    xmax = int(np.clip(np.ceil(box[:, 0].max()), 0, width - 1))
+    ymin = int(np.clip(np.floor(box[:, 1].min()), 0, height - 1))
+    ymax = int(np.clip(np.ceil(box[:, 1].max()), 0, height - 1))
+    mask = np.zeros((ymax - ymin + 1, xmax - xmin + 1), dtype=np.uint8)
+    shifted = box.copy()
+    shifted[:, 0] -= xmin
+    shifted[:, 1] -= ymin
+    cv2.fillPoly(mask, shifted.reshape(1, -1, 2).astype(np.int32), 1)
+    return cv2.mean(pred[ymin : ymax + 1, xmin : xmax + 1], mask)[0]
+
+
+class PaddleONNXEngine(BaseOCREngine):
+    """PaddleOCR detection/recognition models run on ONNX Runtime (CPU)"""
+
+    # ONNX Runtime sessions can be run from several threads at once
+    thread_safe = True
+
+    def __init__(self, page_orientation: Optional[str] = None, lang: str = "en"):
+        self.lang = lang
+        self.det = None
+        self.cls = None
+        self.rec = None
+        self.characters = None
+        self.initialized = False
+        self.init_error = None
+        # Text lines per recognition batch, bucketed by width unless disabled
+        self.rec_batch_size = getattr(settings, "OCR_CONFIG", {}).get(
+            "REC_BATCH_SIZE", 6
+        )
+        self.bucket_by_width = True
+        # Same preprocessing as PaddleOCREngine, so both see identical input
+        self.preprocessing = get_preprocessing_pipeline("PaddleOCR", output_channels=3)
+        if page_orientation is None:
+            page_orientation = getattr(settings, "OCR_CONFIG", {}).get(
+                "PADDLEOCR_PAGE_ORIENTATION", "off"
+            )
+        if page_orientation not in ORIENTATION_METHODS:
+            raise ValueError(f"Unknown page orientation method: {page_orientation}")
+        self.page_orientation = page_orientation
+
+    def _session_options(self):
+        import onnxruntime as ort
+
+        config = getattr(settings, "OCR_CONFIG", {})
+        level = config.get("PADDLE_ONNX_GRAPH_OPTIMIZATION", "all")
+        if level not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Unknown graph optimization level: {level}")
+
+        options = ort.SessionOptions()
+        # 0 lets ONNX Runtime use one thread per physical core
+        options.intra_op_num_threads = config.get("PADDLE_ONNX_INTRA_OP_THREADS", 0)
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = {
+            "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }[level]
+        return options
+
+    def initialize(self) -> None:
+        """Load the ONNX models into CPU inference sessions"""
+        if self.initialized:
+            return
+
+        try:
+            import onnxruntime as ort
+
+            model_dir = getattr(settings, "OCR_CONFIG", {}).get(
+                "PADDLE_ONNX_MODEL_DIR",
+                os.path.expanduser("~/.paddlex/onnx"),
+            )
+            options = self._session_options()
+
+            def load(name):
+                return ort.InferenceSession(
+                    os.path.join(model_dir, name),
+                    sess_options=options,
+                    providers=["CPUExecutionProvider"],
+                )
+
+            self.det = load("det.onnx")
+            # Per-line orientation is only needed when pages are not rotated
+            # upright beforehand
+            if self.page_orientation == "off" and os.path.exists(
+                os.path.join(model_dir, "cls.onnx")
+            ):
+                self.cls = load("cls.onnx")
+            self.rec = load(f"rec_{self.lang}.onnx")
+
+            dict_path = os.path.join(model_dir, f"rec_{self.lang}.txt")
+            if os.path.exists(dict_path):
+                with open(dict_path, "r", encoding="utf-8") as f:
+                    characters = [line.rstrip("\r\n") for line in f]
+            else:
+                metadata = self.rec.get_modelmeta().custom_metadata_map
+                if "character" not in metadata:
+                    raise FileNotFoundError(f"No character dictionary: {dict_path}")
+                characters = metadata["character"].splitlines()
+            # CTC blank first; PaddleOCR dictionaries omit the space character
+            self.characters = ["blank"] + characters + [" "]
+
+            self.initialized = True
+            logging.info("PaddleONNX (%s) initialized from %s", self.lang, model_dir)
+        except Exception as e:
+            logging.error("PaddleONNX initialization failed: %s", str(e))
+            self.init_error = str(e)
+            self.initialized = False
+
+    def is_ready(self) -> Tuple[bool, str]:
+        """Check if the ONNX sessions are loaded"""
+        if self.init_error:
+            return False, f"Initialization failed: {self.init_error}"
+        if not self.initialized:
+            return False, "Not initialized"
+        return True, "Ready"
+
+    def preprocess_image(self, img: Image.Image, max_size: int = -1) -> np.ndarray:
+        """Preprocess image like PaddleOCREngine"""
+        if max_size == -1:
+            max_size = getattr(settings, "OCR_CONFIG", {}).get(
+                "PADDLEOCR_MAX_IMAGE_SIZE", 1024
+            )
+        return self.preprocessing.run(img, max_size, get_resample_filter("PaddleOCR"))
+
+    def _detect(self, img: np.ndarray) -> List[np.ndarray]:
+        """DB text detection, returning boxes as 4x2 corner arrays in image coordinates"""
+        height, width = img.shape[:2]
+        ratio = 1.0
+        if min(height, width) < DET_LIMIT_SIDE_LEN:
+            ratio = DET_LIMIT_SIDE_LEN / min(height, width)
+        if max(height, width) * ratio > DET_MAX_SIDE_LIMIT:
+            ratio = DET_MAX_SIDE_LIMIT / max(height, width)
+        resize_h = max(int(round(height * ratio / 32) * 32), 32)
+        resize_w = max(int(round(width * ratio / 32) * 32), 32)
+
+        resized = cv2.resize(img, (resize_w, resize_h))
+        blob = (resized.astype(np.float32) / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
+        blob = blob.transpose(2, 0, 1)[np.newaxis]
+        pred = self.det.run(None, {self.det.get_inputs()[0].name: blob})[0][0, 0]
+
+        bitmap = (pred > DET_THRESH).astype(np.uint8)
+        contours, _ = cv2.findContours(bitmap, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        for contour in contours[:DET_MAX_CANDIDATES]:
+            (cx, cy), (w, h), angle = cv2.minAreaRect(contour)
+            if min(w, h) < DET_MIN_SIZE:
+                continue
+            box = _order_points(cv2.boxPoints(((cx, cy), (w, h), angle)))
+            if _box_score(pred, box) < DET_BOX_THRESH:
+                continue
+
+            # Unclipping a rectangle by area * ratio / perimeter grows each
+            # side by twice that distance
+            distance = w * h * DET_UNCLIP_RATIO / (2 * (w + h))
+            w, h = w + 2 * distance, h + 2 * distance
+            if min(w, h) < DET_MIN_SIZE + 2:
+                continue
+            box = _order_points(cv2.boxPoints(((cx, cy), (w, h), angle)))
+            box[:, 0] = np.clip(np.round(box[:, 0] / resize_w * width), 0, width - 1)
+            box[:, 1] = np.clip(np.round(box[:, 1] / resize_h * height), 0, height - 1)
+            if (
+                np.linalg.norm(box[0] - box[1]) <= 3
+                or np.linalg.norm(box[0] - box[3]) <= 3
+            ):
+                continue
+            boxes.append(box)
+        return sort_reading_order(boxes)
+
+    def _classify_orientation(self, crops: List[np.ndarray]) -> List[np.ndarray]:
+        """Rotate upside-down text lines by 180 degrees"""
+        shape = self.cls.get_inputs()[0].shape
+        height, width = (
+            shape[2:] if all(isinstance(d, int) for d in shape[2:]) else CLS_IMAGE_SHAPE
+        )
+        blobs = []
+        for crop in crops:
+            resized = cv2.resize(crop, (width, height))
+            blob = (resized.astype(np.float32) / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
+            blobs.append(blob.transpose(2, 0, 1))
+        probs = self.cls.run(None, {self.cls.get_inputs()[0].name: np.stack(blobs)})[0]
+        return [
+            np.ascontiguousarray(np.rot90(crop, 2)) if label == 1 else crop
+            for crop, label in zip(crops, probs.argmax(axis=1))
+        ]
+
+    def _decode(self, probs: np.ndarray) -> List[Tuple[str, float]]:
+        """Greedy CTC decoding: collapse repeats, then drop blanks"""
+        indices = probs.argmax(axis=2)
+        scores = probs.max(axis=2)
+        lines = []
+        for row in range(len(indices)):
+            keep = np.ones(len(indices[row]), dtype=bool)
+            keep[1:] = indices[row][1:] != indices[row][:-1]
+            keep &= indices[row] != 0
+            text = "".join(
+                self.characters[idx]
+                for idx in indices[row][keep]
+                if idx < len(self.characters)
+            )
+            lines.append((text, float(scores[row][keep].mean()) if keep.any() else 0.0))
+        return lines
+
+    def _recognize(
+        self, img: np.ndarray, boxes: List[np.ndarray]
+    ) -> List[Tuple[str, float]]:
+        """Recognize every detected line in width-bucketed, padded batches"""
+        results: List[Tuple[str, float]] = [("", 0.0)] * len(boxes)
+        for indices, crops, widths in crop_lines(
+            img,
+            np.asarray(boxes),
+            REC_IMAGE_HEIGHT,
+            REC_IMAGE_WIDTH,
+            self.rec_batch_size,
+            sort=self.bucket_by_width,
+        ):
+            if self.cls is not None:
+                crops = self._classify_orientation(crops)
+            batch = np.zeros(
+                (len(crops), REC_IMAGE_HEIGHT, max(REC_IMAGE_WIDTH, *widths), 3),
+                dtype=np.float32,
+            )
+            for row, (crop, width) in enumerate(zip(crops, widths)):
+                # Normalized to [-1, 1]; padding stays 0
+                batch[row, :, :width] = crop / 127.5 - 1.0
+            probs = self.rec.run(
+                None, {self.rec.get_inputs()[0].name: batch.transpose(0, 3, 1, 2)}
+            )[0]
+            for i, line in zip(indices, self._decode(probs)):
+                results[i] = line
+        return results
+
+    def extract_text(self, img: Any):
+        """Extract text with the ONNX models. Returns (text, average_conf, tables=None)."""
+        text, average_conf, tables, _ = self.extract_text_with_words(img)
+        return text, average_conf, tables
+
+    def extract_text_with_words(self, img: Any):
+        """Extract text and word boxes with the ONNX models. Returns (text, average_conf, None, words)."""
+        if not self.is_ready()[0]:
+            raise RuntimeError(f"PaddleONNX not ready: {self.is_ready()[1]}")
+
+        # Blank fax pages are detected on the packed bitplane and skipped
+        if is_blank_page(img):
+            return "", None, None, []
+
+        try:
+            with stage_timer("preprocess"):
+                processed_img = self.preprocess_image(img)
+                processed_img = correct_page_orientation(
+                    processed_img, self.page_orientation
+                )
+                img_np = np.ascontiguousarray(np.asarray(processed_img))
+
+            with stage_timer("predict"):
+                boxes = self._detect(img_np)
+                lines = self._recognize(img_np, boxes) if boxes else []
+
+            with stage_timer("postprocess"):
+                text, average_conf, words = lines_to_words(boxes, lines)
+
+            force_garbage_collection()
+            return text, average_conf, None, words
+        except Exception as e:
+            logging.error("Error in PaddleONNX processing: %s", str(e), exc_info=True)
+            raise RuntimeError(f"PaddleONNX processing failed: {str(e)}")
@@ -1,9 +1,17 @@
 import logging
-from typing import Tuple, Any
+from typing import Tuple, Any, Optional
 from PIL import Image
+from django.conf import settings
 import numpy as np
 from paddleocr import TableRecognitionPipelineV2
-from .base import BaseOCREngine
+from .base import BaseOCREngine, configured_cpu_threads
+from ..batching import BatchDeadlineExceeded, create_batcher
+from ..preprocessing import (
+    get_preprocessing_pipeline,
+    get_resample_filter,
+    is_blank_page,
+)
+from ..profiling import stage_timer
 from ..utils import log_memory_usage, check_memory_available, force_garbage_collection
 
 
@@ -12,8 +20,12 @@ class PaddleTableOCREngine(BaseOCREngine):
 
     def __init__(self):
         self.pipeline = None
+        self.batcher = None
         self.initialized = False
         self.init_error = None
+        self.preprocessing = get_preprocessing_pipeline(
+            "PaddleTable", output_channels=3
+        )
 
     def initialize(self) -> None:
         if self.initialized:
@@ -24,7 +36,13 @@ class PaddleTableOCREngine(BaseOCREngine):
                 "Initializing TableRecognitionPipelineV2 for table extraction..."
             )
             # Initialize with shared models - it will use models from shared volume if they exist
-            self.pipeline = TableRecognitionPipelineV2()
+            threads = configured_cpu_threads("PaddleTable")
+            self.pipeline = TableRecognitionPipelineV2(
+                **({"cpu_threads": threads} if threads else {})
+            )
+            # Batches are shared with PaddleCombined, which borrows this pipeline
+            self.batcher = create_batcher("PaddleTable", self._predict_batch)
+            self.thread_safe = self.batcher is not None
             self.initialized = True
             logging.info("PaddleTableOCREngine initialization completed successfully")
         except Exception as e:
@@ -39,44 +57,38 @@ class PaddleTableOCREngine(BaseOCREngine):
             return False, "Not initialized"
         return True, "Ready"
 
-    def preprocess_image(self, img: Image.Image, max_size: int = -1) -> Image.Image:
+    def preprocess_image(self, img: Image.Image, max_size: int = -1) -> np.ndarray:
+        """Preprocess image for PaddleTable"""
         # Get max_size from settings if not provided
         if max_size == -1:
-            max_size = 2048  # Limit table images to 2048px max dimension
-
-        # Convert to RGB if needed
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-
-        # Get original dimensions
-        width, height = img.size
-        logging.info("Original image size: %dx%d", width, height)
-
-        # Calculate new dimensions while maintaining aspect ratio
-        if width > height:
-            if width > max_size:
-                new_width = max_size
-                new_height = int(height * (max_size / width))
-            else:
-                return img
-        else:
-            if height > max_size:
-                new_height = max_size
-                new_width = int(width * (max_size / height))
-            else:
-                return img
-
-        # Resize image
-        resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        logging.info("Resized image to: %dx%d", new_width, new_height)
-
-        return resized_img
+            max_size = getattr(settings, "OCR_CONFIG", {}).get(
+                "PADDLE_TABLE_MAX_IMAGE_SIZE", 2048
+            )
+
+        return self.preprocessing.run(img, max_size, get_resample_filter("PaddleTable"))
+
+    def _predict_batch(self, images: list) -> list:
+        """One pipeline call for several pages, returning each page's output"""
+        return [[result] for result in self.pipeline.predict(images)]
+
+    def predict(self, img_np: np.ndarray):
+        """Run the pipeline on one page, batched with concurrent requests when enabled"""
+        if self.batcher is None:
+            return self.pipeline.predict(img_np)
+        return self.batcher.submit(img_np)
+
+    def batching_metrics(self) -> Optional[dict]:
+        return self.batcher.get_metrics() if self.batcher else None
 
     def extract_text(self, img: Any):
         """Extract text and tables using TableRecognitionPipelineV2. Returns (text, average_conf, tables)."""
         if not self.is_ready()[0]:
             raise RuntimeError(f"PaddleTableOCREngine not ready: {self.is_ready()[1]}")
 
+        # Blank fax pages are detected on the packed bitplane and skipped
+        if is_blank_page(img):
+            return "", None, None
+
         try:
             # Log memory usage before processing
             log_memory_usage("Before PaddleTable preprocessing")
@@ -86,49 +98,56 @@ class PaddleTableOCREngine(BaseOCREngine):
                 logging.warning("Low memory detected, forcing garbage collection")
                 force_garbage_collection()
 
-            processed_img = self.preprocess_image(img)
+            with stage_timer("preprocess"):
+                processed_img = self.preprocess_image(img)
 
-            # Convert to numpy array
-            if isinstance(processed_img, Image.Image):
-                img_np = np.array(processed_img)
-            else:
-                img_np = processed_img
+                # Convert to numpy array
+                if isinstance(processed_img, Image.Image):
+                    img_np = np.array(processed_img)
+                else:
+                    img_np = processed_img
 
             # Log memory usage before prediction
             log_memory_usage("Before PaddleTable prediction")
 
-            output = self.pipeline.predict(img_np)
+            with stage_timer("predict"):
+                output = self.predict(img_np)
 
             # Log memory usage after prediction
             log_memory_usage("After PaddleTable prediction")
 
-            tables = []
-            all_texts = []
-            all_scores = []
-
-            for res in output:
-                res_obj = getattr(res, "res", res)
-                # Extract tables
-                table_res_list = res_obj.get("table_res_list", [])
-                for table in table_res_list:
-                    html = table.get("pred_html")
-                    if html:
-                        tables.append(html)
-                    # Extract cell texts for full text
-                    ocr_pred = table.get("table_ocr_pred", {})
-                    rec_texts = ocr_pred.get("rec_texts", [])
-                    rec_scores = ocr_pred.get("rec_scores", [])
-                    all_texts.extend([t for t in rec_texts if t])
-                    all_scores.extend(
-                        [float(s) for s in rec_scores if isinstance(s, (int, float))]
-                    )
-
-            text = " ".join(all_texts)
-            average_conf = (
-                round(sum(all_scores) / len(all_scores), 3) if all_scores else None
-            )
-            if not tables:
-                tables = None
+            with stage_timer("postprocess"):
+                tables = []
+                all_texts = []
+                all_scores = []
+
+                for res in output:
+                    res_obj = getattr(res, "res", res)
+                    # Extract tables
+                    table_res_list = res_obj.get("table_res_list", [])
+                    for table in table_res_list:
+                        html = table.get("pred_html")
+                        if html:
+                            tables.append(html)
+                        # Extract cell texts for full text
+                        ocr_pred = table.get("table_ocr_pred", {})
+                        rec_texts = ocr_pred.get("rec_texts", [])
+                        rec_scores = ocr_pred.get("rec_scores", [])
+                        all_texts.extend([t for t in rec_texts if t])
+                        all_scores.extend(
+                            [
+                                float(s)
+                                for s in rec_scores
+                                if isinstance(s, (int, float))
+                            ]
+                        )
+
+                text = " ".join(all_texts)
+                average_conf = (
+                    round(sum(all_scores) / len(all_scores), 3) if all_scores else None
+                )
+                if not tables:
+                    tables = None
 
             # Force garbage collection after processing
             force_garbage_collection()
@@ -136,6 +155,8 @@ class PaddleTableOCREngine(BaseOCREngine):
 
             return text, average_conf, tables
 
+        except BatchDeadlineExceeded:
+            raise
         except Exception as e:
             logging.error(
                 "Error in PaddleTableOCREngine processing: %s", str(e), exc_info=True
@@ -1,97 +1,147 @@
 import pytesseract
 import logging
-from typing import Tuple, Any
+import os
+import numpy as np
+from typing import Tuple, Any, Union
 from PIL import Image
 from django.conf import settings
-from .base import BaseOCREngine
+from .base import BaseOCREngine, configured_cpu_threads
+from ..preprocessing import (
+    get_preprocessing_pipeline,
+    get_resample_filter,
+    is_blank_page,
+)
+from ..execution import EngineTimeout
+from ..profiling import stage_timer
+
+
+def set_tesseract_thread_limit(threads: int) -> None:
+    """Cap the OpenMP threads of tesseract subprocesses (0: library default).
+
+    The limit goes only into the environment pytesseract starts tesseract
+    with; the process environment, inherited by execution slots spawned
+    later, is left alone.
+    """
+    if threads:
+        environment = {**os.environ, "OMP_THREAD_LIMIT": str(threads)}
+    else:
+        environment = os.environ
+    pytesseract.pytesseract.environ = environment
 
 
 class TesseractEngine(BaseOCREngine):
     """Tesseract OCR engine implementation"""
 
-    def __init__(self):
+    def __init__(self, lang: str = "eng"):
         self.initialized = False
+        self.init_error = None
+        # Tesseract language code (traineddata name), e.g. "eng" or "spa"
+        self.lang = lang
+        # Tesseract reads 1-bit input, so fax pages can stay bilevel
+        self.preprocessing = get_preprocessing_pipeline(
+            "Tesseract", output_channels=1, accepts_bilevel=True
+        )
+        # pytesseract kills the tesseract subprocess when this runs out
+        self.timeout = getattr(settings, "OCR_CONFIG", {}).get("TESSERACT_TIMEOUT", 60)
 
     def initialize(self) -> None:
         """Initialize Tesseract engine"""
         try:
             # Tesseract is typically pre-installed, just verify it's available
             pytesseract.get_tesseract_version()
+            set_tesseract_thread_limit(configured_cpu_threads("Tesseract"))
+            if self.lang not in pytesseract.get_languages():
+                raise RuntimeError(f"Language data '{self.lang}' is not installed")
             self.initialized = True
-            logging.info("Tesseract engine initialized successfully")
+            logging.info("Tesseract engine (%s) initialized successfully", self.lang)
         except Exception as e:
             logging.error("Tesseract initialization failed: %s", str(e))
+            self.init_error = str(e)
             self.initialized = False
 
     def is_ready(self) -> Tuple[bool, str]:
         """Check if Tesseract is ready to use"""
         if not self.initialized:
-            return False, "Not initialized"
+            return False, self.init_error or "Not initialized"
         return True, "Ready"
 
-    def preprocess_image(self, img: Image.Image, max_size: int = -1) -> Image.Image:
-        """Preprocess image for Tesseract OCR"""
+    def preprocess_image(
+        self, img: Image.Image, max_size: int = -1
+    ) -> Union[np.ndarray, Image.Image]:
+        """Preprocess image for Tesseract"""
         # Get max_size from settings if not provided
         if max_size == -1:
             max_size = getattr(settings, "OCR_CONFIG", {}).get(
                 "TESSERACT_MAX_IMAGE_SIZE", 2048
             )
 
-        # Convert to RGB if needed
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-
-        # Get original dimensions
-        width, height = img.size
-        logging.info("Original image size: %dx%d", width, height)
-
-        # Calculate new dimensions while maintaining aspect ratio
-        if width > height:
-            if width > max_size:
-                new_width = max_size
-                new_height = int(height * (max_size / width))
-            else:
-                return img
-        else:
-            if height > max_size:
-                new_height = max_size
-                new_width = int(width * (max_size / height))
-            else:
-                return img
-
-        # Resize image
-        resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        logging.info("Resized image to: %dx%d", new_width, new_height)
-
-        return resized_img
+        return self.preprocessing.run(img, max_size, get_resample_filter("Tesseract"))
 
     def extract_text(self, img: Any):
         """Extract text using Tesseract OCR. Returns (text, average_conf, tables=None) for interface compatibility."""
+        text, average_conf, tables, _ = self.extract_text_with_words(img)
+        return text, average_conf, tables
+
+    def extract_text_with_words(self, img: Any):
+        """Extract text and word boxes using Tesseract OCR. Returns (text, average_conf, None, words)."""
         if not self.is_ready()[0]:
             raise RuntimeError("Tesseract not ready")
 
-        # Preprocess image
-        processed_img = self.preprocess_image(img)
-
-        # Extract text and confidence data
-        ocr_data = pytesseract.image_to_data(
-            processed_img, output_type=pytesseract.Output.DICT
-        )
-
-        # Extract text
-        text = " ".join([word for word in ocr_data["text"] if word.strip()])
-
-        # Calculate average confidence
-        confidences = [
-            float(conf)
-            for conf, word in zip(ocr_data["conf"], ocr_data["text"])
-            if word.strip() and float(conf) != -1
-        ]
-        average_conf = (
-            round(sum(confidences) / len(confidences), 3) if confidences else None
-        )
-
-        logging.info("Tesseract extracted text: '%s'", text)
-        logging.info("Tesseract average confidence: %s", str(average_conf))
+        # Blank fax pages are detected on the packed bitplane and skipped
+        if is_blank_page(img):
+            return "", None, None, []
+
+        with stage_timer("preprocess"):
+            # Preprocess image
+            processed_img = self.preprocess_image(img)
+
+        with stage_timer("predict"):
+            # Extract text and confidence data
+            try:
+                ocr_data = pytesseract.image_to_data(
+                    processed_img,
+                    lang=self.lang,
+                    output_type=pytesseract.Output.DICT,
+                    timeout=self.timeout,
+                )
+            except RuntimeError as e:
+                if "timeout" not in str(e).lower():
+                    raise
+                raise EngineTimeout("Tesseract", self.timeout, stage="predict") from e
+
+        with stage_timer("postprocess"):
+            # Extract text
+            text = " ".join([word for word in ocr_data["text"] if word.strip()])
+
+            # Calculate average confidence
+            confidences = [
+                float(conf)
+                for conf, word in zip(ocr_data["conf"], ocr_data["text"])
+                if word.strip() and float(conf) != -1
+            ]
+            average_conf = (
+                round(sum(confidences) / len(confidences), 3) if confidences else None
+            )
 
-        return text, average_conf, None
+            # Word boxes for downstream extraction
+            words = [
+                {
+                    "text": word.strip(),
+                    "conf": float(conf) if float(conf) != -1 else None,
+                    "box": (left, top, left + width, top + height),
+                }
+                for word, conf, left, top, width, height in zip(
+                    ocr_data["text"],
+                    ocr_data["conf"],
+                    ocr_data["left"],
+                    ocr_data["top"],
+                    ocr_data["width"],
+                    ocr_data["height"],
+                )
+                if word.strip()
+            ]
+
+            logging.info("Tesseract extracted text: '%s'", text)
+            logging.info("Tesseract average confidence: %s", str(average_conf))
+
+        return text, average_conf, None, words
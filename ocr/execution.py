@@ -0,0 +1,419 @@
+"""
+Engine Execution Slots
+
+Paddle inference cannot be interrupted from another thread, so a
+pathological image could otherwise hold the web worker until gunicorn kills
+it together with all of its loaded models. Engines wrapped in an
+ExecutionSlot run in a dedicated child process instead: when a call exceeds
+its timeout the child is killed and restarted in the background, and the web
+worker keeps serving.
+
+Calls are multiplexed over the slot's pipe by call id. With micro-batching
+enabled the child serves several calls at once, so concurrent requests
+reach the engine's batcher together; otherwise calls run one at a time.
+"""
+
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Dict, Optional, Tuple
+
+import psutil
+
+from .batching import deadline_scope
+from .profiling import get_active_profile_id, get_request_timings, record_stage
+
+# Exception types re-raised as-is when an engine fails inside a slot
+_FORWARDED_ERRORS = {
+    error.__name__: error
+    for error in (RuntimeError, ValueError, OSError, ImportError, MemoryError)
+}
+
+
+class EngineTimeout(RuntimeError):
+    """An engine call exceeded its configured timeout"""
+
+    def __init__(
+        self,
+        engine_name: str,
+        timeout: float,
+        stage: Optional[str] = None,
+        stages: Optional[Dict[str, float]] = None,
+    ):
+        super().__init__(f"{engine_name} timed out after {timeout:g}s")
+        self.engine_name = engine_name
+        self.timeout = timeout
+        # Stage that was running when the timeout hit, and those that finished
+        self.stage = stage
+        self.stages = stages if stages is not None else get_request_timings()
+
+    def partial_result(self) -> Dict[str, Any]:
+        """Timeout details for the API response"""
+        return {
+            "timeout": self.timeout,
+            "stage": self.stage,
+            "completed_stages": {
+                name: round(duration, 1) for name, duration in self.stages.items()
+            },
+        }
+
+
+# Seconds of a call's timeout kept back from the child's batching deadline,
+# so the reply for a request that expired while queued for a batch reaches
+# the parent before it gives up and kills the slot
+DEADLINE_MARGIN = 0.25
+
+# Cheap engine methods answered from the child's receive loop, so they never
+# queue behind OCR calls
+_INLINE_METHODS = {"batching_metrics"}
+
+# Set in execution slot children, which run their engines inline
+_in_execution_slot = False
+
+
+def in_execution_slot() -> bool:
+    """Whether this process is an execution slot child"""
+    return _in_execution_slot
+
+
+def _slot_main(conn, primary_engine: str, lang: str) -> None:
+    """Child process: load the engine, then serve calls until the pipe closes"""
+    global _in_execution_slot
+    _in_execution_slot = True
+    # Load only what this slot serves
+    os.environ["OCR_EAGER_ENGINE_INIT"] = "False"
+    import django
+
+    django.setup()
+    from django.conf import settings
+
+    from .engines.factory import OCREngineFactory
+    from .profiling import (
+        RequestProfiler,
+        finish_request_timings,
+        set_stage_listener,
+        start_request_timings,
+    )
+
+    ready, message = OCREngineFactory.get_engine(primary_engine, lang).is_ready()
+    conn.send(("ready", ready, message))
+
+    config = getattr(settings, "OCR_CONFIG", {})
+    # With batching, twice the batch size is served at once so the next batch
+    # fills while one is running
+    concurrency = (
+        2 * config.get("BATCH_MAX_SIZE", 8)
+        if config.get("BATCHING_ENABLED", False)
+        else 1
+    )
+    send_lock = threading.Lock()
+    # Engines that are not thread-safe still serve one call at a time
+    engine_locks: Dict[str, threading.Lock] = {}
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def serve(call_id, engine_name, method, args, deadline, profile_id):
+        set_stage_listener(
+            lambda name, duration_ms: send(("stage", call_id, name, duration_ms))
+        )
+        token = start_request_timings()
+        try:
+            engine = OCREngineFactory.get_engine(engine_name, lang)
+            if engine.thread_safe or method in _INLINE_METHODS:
+                lock = nullcontext()
+            else:
+                lock = engine_locks.setdefault(engine_name, threading.Lock())
+            with lock:
+                # Queued past its deadline: the parent has given up on it, so
+                # running it would only delay the calls behind it
+                if time.monotonic() >= deadline:
+                    send(("error", call_id, "CallExpired", "Expired while queued"))
+                    return
+                # A profiled request's engine work happens here, not in the
+                # parent, so the slot saves its own profile under the same id
+                profiler = None
+                if profile_id is not None:
+                    profiler = RequestProfiler(
+                        f"{engine_name}.{method} in execution slot",
+                        profile_id=f"{profile_id}-{engine_name}-{call_id}",
+                    )
+                    profiler.start()
+                try:
+                    with deadline_scope(deadline - time.monotonic()):
+                        send(("started", call_id))
+                        result = getattr(engine, method)(*args)
+                finally:
+                    if profiler is not None:
+                        profiler.stop()
+            send(("result", call_id, result))
+        except Exception as e:
+            send(("error", call_id, type(e).__name__, str(e)))
+        finally:
+            finish_request_timings(token)
+
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="ocr-slot") as executor:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                break
+            if request is None:
+                break
+            # The deadline runs from receipt, including time queued here
+            call_id, engine_name, method, args, timeout, profile_id = request
+            call = (
+                call_id,
+                engine_name,
+                method,
+                args,
+                time.monotonic() + timeout,
+                profile_id,
+            )
+            if method in _INLINE_METHODS:
+                serve(*call)
+            else:
+                executor.submit(serve, *call)
+
+
+class ExecutionSlot:
+    """A child process running one engine group, killed and restarted on timeout"""
+
+    def __init__(self, primary_engine: str, lang: str = "en"):
+        self.primary_engine = primary_engine
+        self.lang = lang
+        self._process = None
+        self._conn = None
+        self._status = (False, "Not initialized")
+        self._state_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        # Calls in flight: call id -> (pipe it was sent on, reply queue)
+        self._pending: Dict[int, Tuple[Any, queue.Queue]] = {}
+        self._call_ids = itertools.count()
+        self._idle = threading.Condition(self._state_lock)
+        self._recycling = False
+
+    def start(self) -> None:
+        """Spawn the child and wait until its engine has loaded"""
+        with self._state_lock:
+            if self._process is not None and self._process.is_alive():
+                return
+            self._status = (False, "Starting execution slot")
+            context = multiprocessing.get_context("spawn")
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_slot_main,
+                args=(child_conn, self.primary_engine, self.lang),
+                name=f"ocr-slot-{self.primary_engine}-{self.lang}",
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+
+        try:
+            _, ready, message = parent_conn.recv()
+        except EOFError:
+            ready, message = False, "Execution slot exited during initialization"
+        with self._state_lock:
+            self._process, self._conn = process, parent_conn
+            self._status = (ready, message)
+        threading.Thread(
+            target=self._read_replies,
+            args=(parent_conn,),
+            name=f"ocr-slot-reader-{self.primary_engine}",
+            daemon=True,
+        ).start()
+        logging.info(
+            "Execution slot %s (pid %s): %s",
+            self.primary_engine,
+            process.pid,
+            message,
+        )
+
+    def is_ready(self):
+        return self._status
+
+    def rss_mb(self) -> float:
+        """Resident memory of the child process in MB"""
+        with self._state_lock:
+            process = self._process
+        if process is None or not process.is_alive():
+            return 0.0
+        try:
+            return psutil.Process(process.pid).memory_info().rss / 1024 / 1024
+        except psutil.Error:
+            return 0.0
+
+    def _read_replies(self, conn) -> None:
+        """Route the child's messages to the calls waiting for them"""
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._state_lock:
+                pending = self._pending.get(message[1])
+            if pending is not None:
+                pending[1].put(message)
+
+        with self._state_lock:
+            crashed = self._conn is conn
+            orphaned = [
+                replies
+                for sent_on, replies in self._pending.values()
+                if sent_on is conn
+            ]
+        reason = "exited unexpectedly" if crashed else "was restarted"
+        for replies in orphaned:
+            replies.put(("closed", None, reason))
+        if crashed:
+            self.restart("unexpected exit", conn)
+
+    def _kill(self, conn=None) -> bool:
+        """Kill the child, unless conn is given and it was already replaced"""
+        with self._state_lock:
+            if conn is not None and conn is not self._conn:
+                return False
+            process, conn = self._process, self._conn
+            self._process, self._conn = None, None
+        if process is not None:
+            process.kill()
+            process.join(timeout=5)
+        if conn is not None:
+            conn.close()
+        return True
+
+    def restart(self, reason: str, conn=None) -> None:
+        """Kill the child and load a fresh one in the background.
+
+        With conn, only restart if that pipe's child is still the current
+        one, so concurrent timeouts restart the slot once.
+        """
+        if not self._kill(conn):
+            return
+        logging.warning("Restarting execution slot %s: %s", self.primary_engine, reason)
+        self._status = (False, f"Restarting after {reason}")
+        threading.Thread(
+            target=self.start, name=f"ocr-slot-restart-{self.primary_engine}"
+        ).start()
+
+    def recycle(self, reason: str) -> None:
+        """Restart the child once its in-flight calls have finished.
+
+        Calls made meanwhile wait until the fresh child has loaded, so the
+        drain is bounded by the calls already in flight.
+        """
+        with self._state_lock:
+            if self._recycling:
+                return
+            self._recycling = True
+        try:
+            with self._state_lock:
+                while self._pending:
+                    self._idle.wait()
+                conn = self._conn
+            if conn is not None and self._kill(conn):
+                logging.warning(
+                    "Restarting execution slot %s: %s", self.primary_engine, reason
+                )
+                self._status = (False, f"Restarting after {reason}")
+                self.start()
+        finally:
+            with self._state_lock:
+                self._recycling = False
+                self._idle.notify_all()
+
+    def stop(self) -> None:
+        # Let in-flight calls finish (each is bounded by its own timeout)
+        with self._state_lock:
+            while self._pending:
+                self._idle.wait()
+            conn = self._conn
+        if conn is not None:
+            try:
+                with self._send_lock:
+                    conn.send(None)
+            except OSError:
+                pass
+        self._kill()
+        self._status = (False, "Stopped")
+
+    def call(self, engine_name: str, method: str, args: tuple, timeout: float):
+        """Run engine.method(*args) in the child, raising EngineTimeout after timeout seconds"""
+        deadline = time.monotonic() + timeout
+        replies: queue.Queue = queue.Queue()
+        with self._state_lock:
+            while self._recycling:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise EngineTimeout(engine_name, timeout, stage="queued")
+                self._idle.wait(remaining)
+            conn = self._conn
+            if conn is None:
+                raise RuntimeError(f"Execution slot not running: {self._status[1]}")
+            call_id = next(self._call_ids)
+            self._pending[call_id] = (conn, replies)
+        try:
+            with self._send_lock:
+                conn.send(
+                    (
+                        call_id,
+                        engine_name,
+                        method,
+                        args,
+                        timeout - DEADLINE_MARGIN,
+                        get_active_profile_id(),
+                    )
+                )
+            started = False
+            current_stage = None
+            completed = get_request_timings()
+            while True:
+                try:
+                    message = replies.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    if not started:
+                        # Still queued behind other calls: the slot is healthy
+                        raise EngineTimeout(engine_name, timeout, stage="queued")
+                    self.restart("timeout", conn)
+                    raise EngineTimeout(
+                        engine_name, timeout, stage=current_stage, stages=completed
+                    )
+
+                if message[0] == "started":
+                    started = True
+                elif message[0] == "closed":
+                    raise RuntimeError(f"{engine_name} execution slot {message[2]}")
+                elif message[0] == "stage":
+                    _, _, name, duration_ms = message
+                    if duration_ms is None:
+                        current_stage = name
+                    else:
+                        # Child stages show up in this request's Server-Timing
+                        record_stage(name, duration_ms)
+                        completed[name] = completed.get(name, 0.0) + duration_ms
+                        current_stage = None
+                elif message[0] == "result":
+                    return message[2]
+                else:
+                    _, _, error_type, error_message = message
+                    if error_type == "CallExpired":
+                        raise EngineTimeout(engine_name, timeout, stage="queued")
+                    if error_type == "BatchDeadlineExceeded":
+                        # Expired while queued for a batch: the slot is
+                        # healthy and keeps running
+                        raise EngineTimeout(
+                            engine_name, timeout, stage="batch-wait", stages=completed
+                        )
+                    raise _FORWARDED_ERRORS.get(error_type, RuntimeError)(error_message)
+        finally:
+            with self._state_lock:
+                del self._pending[call_id]
+                self._idle.notify_all()
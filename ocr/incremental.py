@@ -0,0 +1,291 @@
+"""
+Tile-Level Incremental OCR
+
+Labs often re-issue a report with a single line amended. In incremental
+mode the preprocessed page is split into a fixed grid of tiles and every
+tile is hashed. The words read from a page are cached per tile (the tile
+holding the word's centre), together with the hashes of all tiles the word's
+box overlaps. On a later page of the same size, a cached word is reused
+while all of those tiles are unchanged. The remaining tiles are read again,
+one crop per group of adjacent changed tiles, widened by a context margin so
+that words cut by a tile edge are read whole. Reused and fresh words are
+then stitched into lines in reading order.
+
+Tiles are hashed exactly, so this suits re-issued digital reports. Re-scans
+differ everywhere and are matched by the near-duplicate index (dedup.py).
+Crops go through the engine's preprocessing steps a second time; resizing
+is a no-op at that point and the default steps leave a processed page as is.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .preprocessing import shared_preprocessing
+from .profiling import stage_timer
+
+# Engines that return word boxes in preprocessed page coordinates
+INCREMENTAL_ENGINES = ("Tesseract", "PaddleOCR", "PaddleONNX", "PaddleBatched")
+
+# (word, ((tile index, tile hash), ...) of every tile the word overlaps)
+CachedWord = Tuple[dict, Tuple[Tuple[int, bytes], ...]]
+
+
+class TileGrid:
+    """Fixed grid over a preprocessed page, with a hash per tile (row-major)"""
+
+    def __init__(self, pixels: np.ndarray, rows: int, cols: int):
+        height, width = pixels.shape[:2]
+        self.rows = min(rows, height)
+        self.cols = min(cols, width)
+        self.ys = np.linspace(0, height, self.rows + 1).round().astype(int)
+        self.xs = np.linspace(0, width, self.cols + 1).round().astype(int)
+        self.hashes = []
+        for row in range(self.rows):
+            for col in range(self.cols):
+                tile = pixels[
+                    self.ys[row] : self.ys[row + 1], self.xs[col] : self.xs[col + 1]
+                ]
+                self.hashes.append(
+                    hashlib.blake2b(
+                        np.ascontiguousarray(tile).tobytes(), digest_size=16
+                    ).digest()
+                )
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def _row(self, y: float) -> int:
+        return int(
+            np.clip(np.searchsorted(self.ys, y, side="right") - 1, 0, self.rows - 1)
+        )
+
+    def _col(self, x: float) -> int:
+        return int(
+            np.clip(np.searchsorted(self.xs, x, side="right") - 1, 0, self.cols - 1)
+        )
+
+    def tile_at(self, x: float, y: float) -> int:
+        return self._row(y) * self.cols + self._col(x)
+
+    def tiles_overlapping(self, box) -> List[int]:
+        x0, y0, x1, y1 = box
+        # Boxes end on their last pixel's far edge, which belongs to no tile
+        rows = range(self._row(y0), self._row(max(y0, y1 - 1)) + 1)
+        cols = range(self._col(x0), self._col(max(x0, x1 - 1)) + 1)
+        return [row * self.cols + col for row in rows for col in cols]
+
+    def bounds(self, tiles: Set[int]) -> Tuple[int, int, int, int]:
+        """Pixel rectangle (x0, y0, x1, y1) covering the given tiles"""
+        rows = [tile // self.cols for tile in tiles]
+        cols = [tile % self.cols for tile in tiles]
+        return (
+            int(self.xs[min(cols)]),
+            int(self.ys[min(rows)]),
+            int(self.xs[max(cols) + 1]),
+            int(self.ys[max(rows) + 1]),
+        )
+
+
+def _box_centre(box) -> Tuple[float, float]:
+    x0, y0, x1, y1 = box
+    return (x0 + x1) / 2, (y0 + y1) / 2
+
+
+class TileCache:
+    """Bounded LRU of the words read in each tile, keyed by page layout and tile hash"""
+
+    def __init__(self, max_entries: int = 50000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, List[CachedWord]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[List[CachedWord]]:
+        with self._lock:
+            words = self._entries.get(key)
+            if words is not None:
+                self._entries.move_to_end(key)
+            return words
+
+    def put(self, key: Hashable, words: List[CachedWord]) -> None:
+        with self._lock:
+            self._entries[key] = words
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_cache: Optional[TileCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_tile_cache() -> TileCache:
+    """The process-wide tile cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TileCache(
+                    getattr(settings, "OCR_CONFIG", {}).get(
+                        "INCREMENTAL_MAX_TILES", 50000
+                    )
+                )
+    return _cache
+
+
+def supports_incremental(model_name: str) -> bool:
+    """Whether word boxes of this engine line up with its preprocessed page.
+
+    The page orientation pre-pass rotates Paddle pages after preprocessing,
+    so their boxes are then in another frame than the tiles.
+    """
+    if model_name not in INCREMENTAL_ENGINES:
+        return False
+    if model_name == "Tesseract":
+        return True
+    orientation = getattr(settings, "OCR_CONFIG", {}).get(
+        "PADDLEOCR_PAGE_ORIENTATION", "off"
+    )
+    return orientation == "off"
+
+
+def stitch_words(words: List[dict]) -> List[dict]:
+    """Words in reading order: grouped into lines by vertical centre, then left to right"""
+    lines: List[Tuple[float, float, List[dict]]] = []
+    for word in sorted(words, key=lambda word: _box_centre(word["box"])[1]):
+        _, centre_y = _box_centre(word["box"])
+        if lines and lines[-1][0] <= centre_y <= lines[-1][1]:
+            lines[-1][2].append(word)
+        else:
+            lines.append((word["box"][1], word["box"][3], [word]))
+    return [
+        word
+        for _, _, line in lines
+        for word in sorted(line, key=lambda word: word["box"][0])
+    ]
+
+
+def _reusable_words(
+    grid: TileGrid, cache: TileCache, layout: Hashable
+) -> Tuple[List[dict], Set[int]]:
+    """Cached words still valid on this page, and the tiles to read again"""
+    reused, changed = [], set()
+    for tile, tile_hash in enumerate(grid.hashes):
+        cached = cache.get((layout, tile, tile_hash))
+        if cached is None or any(
+            grid.hashes[other] != other_hash
+            for _, overlapped in cached
+            for other, other_hash in overlapped
+        ):
+            changed.add(tile)
+            continue
+        reused.extend(word for word, _ in cached)
+    return reused, changed
+
+
+def _read_changed_tiles(
+    engine,
+    page: Any,
+    pixels: np.ndarray,
+    grid: TileGrid,
+    changed: Set[int],
+    margin: int,
+) -> List[dict]:
+    """OCR one crop per group of adjacent changed tiles, keeping the words centred in the group"""
+    mask = np.zeros((grid.rows, grid.cols), dtype=np.uint8)
+    for tile in changed:
+        mask[tile // grid.cols, tile % grid.cols] = 1
+    count, labels = cv2.connectedComponents(mask, connectivity=8)
+
+    height, width = pixels.shape[:2]
+    fresh = []
+    for label in range(1, count):
+        group = {
+            int(row) * grid.cols + int(col)
+            for row, col in zip(*np.nonzero(labels == label))
+        }
+        x0, y0, x1, y1 = grid.bounds(group)
+        x0, y0 = max(0, x0 - margin), max(0, y0 - margin)
+        x1, y1 = min(width, x1 + margin), min(height, y1 + margin)
+        if isinstance(page, Image.Image):
+            crop = page.crop((x0, y0, x1, y1))
+        else:
+            crop = Image.fromarray(np.ascontiguousarray(pixels[y0:y1, x0:x1]))
+
+        _, _, _, words = engine.extract_text_with_words(crop)
+        for word in words:
+            if word.get("box") is None:
+                continue
+            bx0, by0, bx1, by1 = word["box"]
+            box = (bx0 + x0, by0 + y0, bx1 + x0, by1 + y0)
+            if grid.tile_at(*_box_centre(box)) in group:
+                fresh.append({**word, "box": box})
+    return fresh
+
+
+def extract_text_incremental(engine, img: Image.Image, namespace: Hashable):
+    """Extract text and word boxes, reading only the tiles that changed since a cached page.
+
+    Returns (text, average_conf, tables, words, tiles) where tiles is
+    {"tiles_total", "tiles_reused"}.
+    """
+    config = getattr(settings, "OCR_CONFIG", {})
+    rows = config.get("INCREMENTAL_TILE_ROWS", 16)
+    cols = config.get("INCREMENTAL_TILE_COLS", 4)
+    margin = config.get("INCREMENTAL_TILE_MARGIN", 32)
+    max_changed = config.get("INCREMENTAL_MAX_CHANGED_FRACTION", 0.5)
+    cache = get_tile_cache()
+
+    # The engine's full-page pass below reuses this preprocessed page
+    with shared_preprocessing():
+        with stage_timer("tiles"):
+            page = engine.preprocess_image(img)
+            pixels = np.asarray(page)
+            grid = TileGrid(pixels, rows, cols)
+            layout = (namespace, pixels.shape, grid.rows, grid.cols)
+            reused, changed = _reusable_words(grid, cache, layout)
+
+        if len(changed) > max_changed * len(grid):
+            # Mostly new: one full-page pass is cheaper than many crops
+            text, average_conf, tables, words = engine.extract_text_with_words(img)
+            changed = set(range(len(grid)))
+        else:
+            fresh = _read_changed_tiles(engine, page, pixels, grid, changed, margin)
+            with stage_timer("stitch"):
+                words = stitch_words(reused + fresh)
+            tables = None
+            text = " ".join(word["text"] for word in words)
+            confidences = [word["conf"] for word in words if word["conf"] is not None]
+            average_conf = (
+                round(sum(confidences) / len(confidences), 3) if confidences else None
+            )
+        logging.info(
+            "Incremental OCR: %d of %d tiles reused",
+            len(grid) - len(changed),
+            len(grid),
+        )
+
+    # Every tile is stored, so unchanged blank tiles are reused as well
+    per_tile: Dict[int, List[CachedWord]] = {tile: [] for tile in range(len(grid))}
+    for word in words:
+        if word.get("box") is None:
+            continue
+        overlapped = tuple(
+            (tile, grid.hashes[tile]) for tile in grid.tiles_overlapping(word["box"])
+        )
+        per_tile[grid.tile_at(*_box_centre(word["box"]))].append((word, overlapped))
+    for tile, cached in per_tile.items():
+        cache.put((layout, tile, grid.hashes[tile]), cached)
+
+    tiles = {"tiles_total": len(grid), "tiles_reused": len(grid) - len(changed)}
+    return text, average_conf, tables, words, tiles
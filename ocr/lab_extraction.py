@@ -0,0 +1,343 @@
+"""
+Lab Value Extraction Module
+
+Post-OCR stage that pulls analytes, values, units and reference ranges out of
+recognized words. Analyte and unit names from a loadable dictionary are
+compiled once into a token-level Aho-Corasick automaton, and matches are
+paired with nearby numeric tokens using the word boxes.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+DEFAULT_DICTIONARY_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "lab_dictionary.json"
+)
+
+_STRIP_CHARS = ":;,()[]{}*"
+_VALUE_RE = re.compile(r"^[<>]?=?\d+(?:\.\d+)?$")
+_VALUE_WITH_UNIT_RE = re.compile(r"^([<>]?=?\d+(?:\.\d+)?)(\D.*)$")
+_RANGE_RE = re.compile(r"^\d+(?:\.\d+)?-\d+(?:\.\d+)?$|^[<>]=?\d+(?:\.\d+)?$")
+
+ANALYTE = "analyte"
+UNIT = "unit"
+
+
+def normalize_token(token: str) -> str:
+    """Normalize an OCR token for dictionary lookup"""
+    return token.lower().replace("µ", "u").replace("μ", "u").strip(_STRIP_CHARS)
+
+
+class LabDictionary:
+    """Compiled multi-pattern matcher over analyte and unit names.
+
+    Patterns are sequences of normalized tokens, so multi-word analyte names
+    such as "glycated hemoglobin" match in a single left-to-right pass over
+    the page's words.
+    """
+
+    def __init__(self, analytes: Dict[str, List[str]], units: List[str]):
+        # Automaton states: goto transitions, failure links and outputs, where
+        # each output is (kind, canonical name, pattern length in tokens)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, str, int]]] = [[]]
+
+        for canonical, aliases in analytes.items():
+            for alias in [canonical] + list(aliases):
+                self._add_pattern(alias, (ANALYTE, canonical))
+        for unit in units:
+            self._add_pattern(unit, (UNIT, unit))
+        self._build_failure_links()
+
+        self.units = {normalize_token(unit) for unit in units}
+        self.analyte_count = len(analytes)
+
+    @classmethod
+    def load(cls, path: str) -> "LabDictionary":
+        """Load and compile a dictionary from a JSON file"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("analytes", {}), data.get("units", []))
+
+    def _add_pattern(self, pattern: str, output: Tuple[str, str]) -> None:
+        tokens = [normalize_token(t) for t in pattern.split()]
+        tokens = [t for t in tokens if t]
+        if not tokens:
+            return
+
+        state = 0
+        for token in tokens:
+            if token not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][token] = len(self._goto) - 1
+            state = self._goto[state][token]
+
+        kind, name = output
+        if (kind, name, len(tokens)) not in self._out[state]:
+            self._out[state].append((kind, name, len(tokens)))
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(token, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = (
+                    self._out[next_state] + self._out[self._fail[next_state]]
+                )
+
+    def find(self, tokens: List[str]) -> List[Tuple[str, str, int, int]]:
+        """
+        Find dictionary entries in a sequence of normalized tokens.
+
+        Returns:
+            Non-overlapping (kind, name, start, end) matches, preferring the
+            longest match at each position
+        """
+        raw = []
+        state = 0
+        for i, token in enumerate(tokens):
+            while state and token not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token, 0)
+            for kind, name, length in self._out[state]:
+                raw.append((kind, name, i - length + 1, i + 1))
+
+        # Keep the longest match when patterns overlap ("hdl cholesterol" over "hdl")
+        raw.sort(key=lambda m: (m[2], -(m[3] - m[2])))
+        matches = []
+        last_end = 0
+        for match in raw:
+            if match[2] < last_end:
+                continue
+            if matches and matches[-1][:2] == match[:2] and matches[-1][3] == match[2]:
+                # Adjacent aliases of one entry ("glycated hemoglobin (hba1c)")
+                matches[-1] = match[:2] + (matches[-1][2], match[3])
+            else:
+                matches.append(match)
+            last_end = match[3]
+        return matches
+
+
+_dictionary: Optional[LabDictionary] = None
+_dictionary_mtime: Optional[float] = None
+_dictionary_lock = threading.Lock()
+
+
+def get_dictionary_path() -> str:
+    """Get the configured dictionary path"""
+    return getattr(settings, "OCR_CONFIG", {}).get(
+        "LAB_DICTIONARY_PATH", DEFAULT_DICTIONARY_PATH
+    )
+
+
+def reload_lab_dictionary() -> LabDictionary:
+    """Compile the dictionary from disk and make it the active one"""
+    global _dictionary, _dictionary_mtime
+
+    path = get_dictionary_path()
+    with _dictionary_lock:
+        mtime = os.path.getmtime(path)
+        _dictionary = LabDictionary.load(path)
+        _dictionary_mtime = mtime
+    logging.info(
+        "Lab dictionary compiled from %s (%d analytes)", path, _dictionary.analyte_count
+    )
+    return _dictionary
+
+
+def get_lab_dictionary() -> LabDictionary:
+    """Get the compiled dictionary, recompiling it if the file changed on disk"""
+    try:
+        mtime = os.path.getmtime(get_dictionary_path())
+    except OSError as e:
+        if _dictionary is None:
+            raise
+        logging.warning("Could not stat lab dictionary, keeping current: %s", str(e))
+        return _dictionary
+
+    if _dictionary is None or mtime != _dictionary_mtime:
+        return reload_lab_dictionary()
+    return _dictionary
+
+
+def _words_with_boxes(words) -> List[dict]:
+    """Give every word a box, laying words out on one line when boxes are missing"""
+    laid_out = []
+    for i, word in enumerate(words):
+        box = word.get("box")
+        if box is None:
+            box = (i, 0, i + 1, 1)
+        laid_out.append({"text": word["text"], "conf": word.get("conf"), "box": box})
+    return laid_out
+
+
+def _split_value_unit(token: str, units) -> Tuple[Optional[str], Optional[str]]:
+    """Split a token such as '13.5g/dl' into value and unit"""
+    if _VALUE_RE.match(token):
+        return token, None
+    match = _VALUE_WITH_UNIT_RE.match(token)
+    if match and match.group(2) in units:
+        return match.group(1), match.group(2)
+    return None, None
+
+
+def extract_lab_values_batch(pages: List[list]) -> List[List[dict]]:
+    """
+    Extract lab values from a batch of OCR pages.
+
+    Args:
+        pages: One list of words per page, each word a dict with 'text',
+            'conf' and an optional 'box' of (x0, y0, x1, y1)
+
+    Returns:
+        One list of fields per page, each field a dict with 'analyte',
+        'value', 'unit', 'reference_range' and 'confidence'
+    """
+    dictionary = get_lab_dictionary()
+
+    # Flatten all pages into token arrays, ordered by page
+    tokens = []
+    texts = []
+    page_ids = []
+    boxes = []
+    confs = []
+    matches = []
+    for page_id, words in enumerate(pages):
+        words = _words_with_boxes(words or [])
+        offset = len(tokens)
+        normalized = [normalize_token(w["text"]) for w in words]
+        for kind, name, start, end in dictionary.find(normalized):
+            matches.append((kind, name, offset + start, offset + end))
+        tokens.extend(normalized)
+        texts.extend([w["text"].strip(_STRIP_CHARS) for w in words])
+        page_ids.extend([page_id] * len(words))
+        boxes.extend([w["box"] for w in words])
+        confs.extend([w["conf"] if w["conf"] is not None else np.nan for w in words])
+
+    results: List[List[dict]] = [[] for _ in pages]
+    analyte_matches = [m for m in matches if m[0] == ANALYTE]
+    if not analyte_matches:
+        return results
+
+    page_ids = np.asarray(page_ids)
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    confs = np.asarray(confs, dtype=np.float32)
+    x0, y0, x1, y1 = boxes.T
+    cy = (y0 + y1) / 2
+    height = y1 - y0
+
+    split = [_split_value_unit(t, dictionary.units) for t in tokens]
+    is_value = np.array([v is not None for v, _ in split])
+    # "<200" is a value right after the analyte and a reference range after
+    # the value; position decides, so comparator tokens are both
+    is_range = np.array([bool(_RANGE_RE.match(t)) for t in tokens])
+    is_unit = np.zeros(len(tokens), dtype=bool)
+    for kind, _, start, end in matches:
+        if kind == UNIT:
+            is_unit[start:end] = True
+    in_analyte = np.zeros(len(tokens), dtype=bool)
+    for _, _, start, end in analyte_matches:
+        in_analyte[start:end] = True
+
+    # Analyte boxes as the union of their tokens' boxes
+    starts = np.array([m[2] for m in analyte_matches])
+    ends = np.array([m[3] for m in analyte_matches])
+    a_page = page_ids[starts]
+    a_x0 = np.array([x0[s:e].min() for s, e in zip(starts, ends)])
+    a_x1 = np.array([x1[s:e].max() for s, e in zip(starts, ends)])
+    a_cy = np.array([cy[s:e].mean() for s, e in zip(starts, ends)])
+    a_h = np.array([height[s:e].max() for s, e in zip(starts, ends)])
+
+    # Pairing never crosses pages, so the (analytes x tokens) matrices are
+    # built per page and grow with the page, not the batch
+    token_bounds = np.searchsorted(page_ids, np.arange(len(pages) + 1))
+    analyte_bounds = np.searchsorted(a_page, np.arange(len(pages) + 1))
+    for page_id in range(len(pages)):
+        lo, hi = token_bounds[page_id], token_bounds[page_id + 1]
+        a_lo, a_hi = analyte_bounds[page_id], analyte_bounds[page_id + 1]
+        if a_lo == a_hi:
+            continue
+        page_slice, a_slice = slice(lo, hi), slice(a_lo, a_hi)
+        p_x0, p_cy, p_h = x0[page_slice], cy[page_slice], height[page_slice]
+        pa_x0, pa_x1 = a_x0[a_slice], a_x1[a_slice]
+        pa_cy, pa_h = a_cy[a_slice], a_h[a_slice]
+
+        # Candidates: same line, to the right
+        same_line = np.abs(pa_cy[:, None] - p_cy[None, :]) <= 0.5 * np.maximum(
+            pa_h[:, None], p_h[None, :]
+        )
+        right_of = p_x0[None, :] >= pa_x1[:, None] - 0.25 * pa_h[:, None]
+        candidates = same_line & right_of & ~in_analyte[None, page_slice]
+
+        # A value belongs to the closest analyte, so stop at the next analyte on the line
+        next_analyte = np.where(
+            same_line[:, starts[a_slice] - lo] & (pa_x0[None, :] > pa_x0[:, None]),
+            pa_x0[None, :],
+            np.inf,
+        ).min(axis=1)
+        candidates &= p_x0[None, :] < next_analyte[:, None]
+
+        distance = np.where(candidates, p_x0[None, :] - pa_x1[:, None], np.inf)
+        value_dist = np.where(is_value[None, page_slice], distance, np.inf)
+        value_idx = value_dist.argmin(axis=1)
+        has_value = np.isfinite(value_dist[np.arange(a_hi - a_lo), value_idx])
+
+        for i, (_, name, start, end) in enumerate(analyte_matches[a_lo:a_hi]):
+            field = {
+                "analyte": name,
+                "value": None,
+                "unit": None,
+                "reference_range": None,
+                "confidence": None,
+            }
+            field_confs = confs[start:end]
+
+            if has_value[i]:
+                v = value_idx[i]
+                field["value"], unit = split[lo + v]
+                if unit is not None:
+                    field["unit"] = texts[lo + v][len(field["value"]) :]
+                field_confs = np.append(field_confs, confs[lo + v])
+
+                # Unit and reference range are searched after the value
+                after_value = (
+                    candidates[i] & (p_x0 >= p_x0[v]) & (np.arange(hi - lo) != v)
+                )
+                after_dist = np.where(after_value, p_x0 - p_x0[v], np.inf)
+                if field["unit"] is None:
+                    unit_dist = np.where(is_unit[page_slice], after_dist, np.inf)
+                    u = unit_dist.argmin()
+                    if np.isfinite(unit_dist[u]):
+                        field["unit"] = texts[lo + u]
+                range_dist = np.where(is_range[page_slice], after_dist, np.inf)
+                r = range_dist.argmin()
+                if np.isfinite(range_dist[r]):
+                    field["reference_range"] = texts[lo + r]
+
+            if not np.all(np.isnan(field_confs)):
+                field["confidence"] = round(float(np.nanmin(field_confs)), 3)
+            results[page_id].append(field)
+
+    return results
+
+
+def extract_lab_values(words: list) -> List[dict]:
+    """Extract lab values from a single page of OCR words"""
+    return extract_lab_values_batch([words])[0]
@@ -0,0 +1,42 @@
+"""
+OCR Languages
+
+Requests name a language by ISO 639-1 code; each engine has its own code for
+it (Tesseract traineddata names, PaddleOCR model language names). A language
+is configured in OCR_LANGUAGES with the engines that support it.
+"""
+
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+# Request language -> engine name -> engine-specific language code
+DEFAULT_OCR_LANGUAGES = {
+    "en": {
+        "Tesseract": "eng",
+        "PaddleOCR": "en",
+        "PaddleTable": "en",
+        "PaddleCombined": "en",
+        "PaddleONNX": "en",
+        "PaddleBatched": "en_PP-OCRv5_mobile_rec",
+    },
+}
+
+
+def get_ocr_languages() -> Dict[str, Dict[str, str]]:
+    return getattr(settings, "OCR_CONFIG", {}).get(
+        "OCR_LANGUAGES", DEFAULT_OCR_LANGUAGES
+    )
+
+
+def get_default_language() -> str:
+    return getattr(settings, "OCR_CONFIG", {}).get("DEFAULT_LANGUAGE", "en")
+
+
+def get_available_languages() -> List[str]:
+    return sorted(get_ocr_languages())
+
+
+def engine_language_code(engine_name: str, lang: str) -> Optional[str]:
+    """The engine's code for a request language, or None if unsupported"""
+    return get_ocr_languages().get(lang, {}).get(engine_name)
@@ -0,0 +1,488 @@
+"""
+Tune preprocessing size, resample filter and CPU threads on a labelled corpus.
+
+The corpus is a directory of page images, each with a ground-truth
+transcription in a .txt file of the same name. For every engine, each
+combination of max image size, resample filter and thread count runs over
+the whole corpus in this process. A trial records latency percentiles,
+throughput (pages per second, and pages per CPU-second, which is what a
+fully loaded node scales with) and the character error rate against the
+transcriptions.
+
+The trials that no other trial beats on all of CER, p95 latency and pages
+per CPU-second form the Pareto front. Among the front's trials within
+--max-cer-increase of the best CER, the fastest (--objective) is written to
+--output as an OCR_CONFIG profile, loaded by setting OCR_CONFIG_PROFILE.
+The profile file also keeps every trial and the front for review.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+from PIL import Image
+
+from ocr.engines.factory import OCREngineFactory
+from ocr.languages import get_available_languages, get_default_language
+from ocr.preprocessing import RESAMPLE_FILTERS
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+
+# Settings each engine reads: max image size key, preprocessing configuration
+# (RESAMPLE_FILTERS entry) and CPU_THREADS entry. PaddleONNX takes its threads
+# from PADDLE_ONNX_INTRA_OP_THREADS.
+TUNED_SETTINGS = {
+    "Tesseract": ("TESSERACT_MAX_IMAGE_SIZE", "Tesseract", "Tesseract"),
+    "PaddleOCR": ("PADDLEOCR_MAX_IMAGE_SIZE", "PaddleOCR", "PaddleOCR"),
+    "PaddleONNX": ("PADDLEOCR_MAX_IMAGE_SIZE", "PaddleOCR", None),
+    "PaddleBatched": ("PADDLEOCR_MAX_IMAGE_SIZE", "PaddleOCR", "PaddleBatched"),
+    "PaddleTable": ("PADDLE_TABLE_MAX_IMAGE_SIZE", "PaddleTable", "PaddleTable"),
+    "PaddleCombined": ("PADDLE_TABLE_MAX_IMAGE_SIZE", "PaddleTable", "PaddleTable"),
+}
+
+DEFAULT_MAX_IMAGE_SIZE = {
+    "TESSERACT_MAX_IMAGE_SIZE": 2048,
+    "PADDLEOCR_MAX_IMAGE_SIZE": 1024,
+    "PADDLE_TABLE_MAX_IMAGE_SIZE": 2048,
+}
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace, so line breaks and layout spacing do not count as errors"""
+    return " ".join(text.split())
+
+
+def edit_distance(hypothesis: str, reference: str) -> int:
+    """Levenshtein distance, one numpy row per hypothesis character"""
+    if not hypothesis or not reference:
+        return max(len(hypothesis), len(reference))
+    codes = np.array([ord(ch) for ch in reference])
+    columns = np.arange(len(reference) + 1)
+    previous = columns.copy()
+    for i, ch in enumerate(hypothesis, 1):
+        current = np.empty_like(previous)
+        current[0] = i
+        # Substitution (or match) and deletion
+        current[1:] = np.minimum(previous[:-1] + (codes != ord(ch)), previous[1:] + 1)
+        # Insertions chain along the row: current[j] = min_k current[k] + (j - k)
+        previous = np.minimum.accumulate(current - columns) + columns
+    return int(previous[-1])
+
+
+def load_corpus(directory: str) -> List[Tuple[str, Image.Image, str]]:
+    """(name, image, normalized transcription) for every image with a .txt file"""
+    corpus = []
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        transcription = path.with_suffix(".txt")
+        if not transcription.exists():
+            continue
+        with Image.open(path) as img:
+            img.load()
+            corpus.append(
+                (
+                    path.name,
+                    img.copy(),
+                    normalize_text(transcription.read_text(encoding="utf-8")),
+                )
+            )
+    return corpus
+
+
+def parse_list(value: str, cast=str) -> list:
+    return [cast(part.strip()) for part in value.split(",") if part.strip()]
+
+
+def cpu_seconds() -> float:
+    """CPU time of this process and its finished children (tesseract)"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def pareto_front(trials: List[dict]) -> List[dict]:
+    """Trials not dominated on CER, p95 latency and pages per CPU-second"""
+
+    def objectives(trial):
+        return (trial["cer"], trial["p95_ms"], -trial["pages_per_cpu_second"])
+
+    front = []
+    for trial in trials:
+        mine = objectives(trial)
+        dominated = any(
+            all(a <= b for a, b in zip(objectives(other), mine))
+            and objectives(other) != mine
+            for other in trials
+        )
+        if not dominated:
+            front.append(trial)
+    return sorted(front, key=lambda trial: (trial["cer"], trial["p95_ms"]))
+
+
+def profile_settings(engine_name: str, size: int, resample: str, threads: int):
+    """OCR_CONFIG entries that select a trial's settings for an engine"""
+    size_key, preprocessing, threads_key = TUNED_SETTINGS[engine_name]
+    config = {size_key: size, "RESAMPLE_FILTERS": {preprocessing: resample}}
+    if threads_key is None:
+        config["PADDLE_ONNX_INTRA_OP_THREADS"] = threads
+    else:
+        config["CPU_THREADS"] = {threads_key: threads}
+    return config
+
+
+def merge_config(base: dict, overrides: dict) -> dict:
+    """base with overrides applied, merging per-engine tables key by key"""
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = {**merged[key], **value}
+        else:
+            merged[key] = value
+    return merged
+
+
+def current_settings(engine_name: str) -> Tuple[int, str, int]:
+    """The configured (size, resample filter, threads) of an engine"""
+    config = getattr(settings, "OCR_CONFIG", {})
+    size_key, preprocessing, threads_key = TUNED_SETTINGS[engine_name]
+    size = config.get(size_key, DEFAULT_MAX_IMAGE_SIZE[size_key])
+    resample = config.get("RESAMPLE_FILTERS", {}).get(preprocessing, "lanczos")
+    if threads_key is None:
+        threads = config.get("PADDLE_ONNX_INTRA_OP_THREADS", 0)
+    else:
+        threads = config.get("CPU_THREADS", {}).get(threads_key, 0)
+    return size, resample, threads
+
+
+class Command(BaseCommand):
+    help = (
+        "Search max image size, resample filter and CPU threads per engine on a "
+        "labelled corpus and write the Pareto-optimal settings as an OCR_CONFIG profile"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "corpus",
+            help="Directory of page images, each with a same-named .txt transcription",
+        )
+        parser.add_argument(
+            "--model",
+            nargs="+",
+            default=["Tesseract"],
+            choices=sorted(TUNED_SETTINGS),
+            help="Engines to tune",
+        )
+        parser.add_argument(
+            "--lang",
+            default=get_default_language(),
+            choices=get_available_languages(),
+            help="Corpus language",
+        )
+        parser.add_argument(
+            "--sizes",
+            default="768,1024,1536,2048",
+            help="Comma-separated max image sizes (longest side, px)",
+        )
+        parser.add_argument(
+            "--filters",
+            default="lanczos,bicubic,bilinear",
+            help=f"Comma-separated resample filters ({', '.join(RESAMPLE_FILTERS)})",
+        )
+        parser.add_argument(
+            "--threads",
+            default="0,1,2,4",
+            help="Comma-separated CPU thread counts; 0 is the library default",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=1,
+            help="Timed passes over the corpus per trial",
+        )
+        parser.add_argument(
+            "--max-cer-increase",
+            type=float,
+            default=0.005,
+            help="CER the selected settings may lose against the most accurate trial",
+        )
+        parser.add_argument(
+            "--objective",
+            choices=["latency", "throughput"],
+            default="latency",
+            help="Pick the lowest p95 latency or the most pages per CPU-second",
+        )
+        parser.add_argument(
+            "--output", required=True, help="Profile JSON file to write"
+        )
+
+    def handle(self, *args, **options):
+        sizes = parse_list(options["sizes"], int)
+        filters = parse_list(options["filters"])
+        threads = parse_list(options["threads"], int)
+        unknown = set(filters) - set(RESAMPLE_FILTERS)
+        if unknown:
+            raise CommandError(
+                f"Unknown resample filters: {', '.join(sorted(unknown))}"
+            )
+        if not sizes or min(sizes) < 1:
+            raise CommandError("--sizes needs positive sizes")
+        if not threads or min(threads) < 0:
+            raise CommandError("--threads needs thread counts of at least 0")
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        corpus = load_corpus(options["corpus"])
+        if not corpus:
+            raise CommandError(
+                f"No images with .txt transcriptions found in {options['corpus']}"
+            )
+        self.stdout.write(
+            f"Corpus: {len(corpus)} pages, "
+            f"{sum(len(text) for _, _, text in corpus)} reference characters"
+        )
+
+        results = {}
+        for engine_name in options["model"]:
+            baseline = current_settings(engine_name)
+            # The configured settings are always measured, as the reference point
+            grid_sizes = sorted(set(sizes) | {baseline[0]})
+            grid_filters = filters + [f for f in [baseline[1]] if f not in filters]
+            grid_threads = sorted(set(threads) | {baseline[2]})
+            trials = self._tune_engine(
+                engine_name,
+                options["lang"],
+                corpus,
+                grid_sizes,
+                grid_filters,
+                grid_threads,
+                options["repeat"],
+            )
+            if not trials:
+                continue
+            for trial in trials:
+                trial["baseline"] = (
+                    trial["max_image_size"],
+                    trial["resample"],
+                    trial["threads"],
+                ) == baseline
+            front = pareto_front(trials)
+            selected = self._select(
+                front, options["max_cer_increase"], options["objective"]
+            )
+            results[engine_name] = {
+                "selected": selected,
+                "pareto": front,
+                "trials": trials,
+            }
+            self._print_front(engine_name, front, selected)
+
+        if not results:
+            raise CommandError("No engine could be tuned")
+        profile = self._profile(results)
+        with open(options["output"], "w") as f:
+            json.dump(
+                {
+                    "OCR_CONFIG": profile,
+                    "generated_at": timezone.now().isoformat(),
+                    "corpus": os.path.abspath(options["corpus"]),
+                    "pages": len(corpus),
+                    "lang": options["lang"],
+                    "objective": options["objective"],
+                    "max_cer_increase": options["max_cer_increase"],
+                    "engines": results,
+                },
+                f,
+                indent=2,
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Profile written to {options['output']}; "
+                f"use it with OCR_CONFIG_PROFILE={options['output']}"
+            )
+        )
+
+    def _trial_config(self, overrides: dict) -> dict:
+        """OCR_CONFIG for a trial: engines run in this process, one call at a time"""
+        config = merge_config(getattr(settings, "OCR_CONFIG", {}), overrides)
+        config.update(
+            {
+                "PADDLEOCR_ISOLATED_EXECUTION": False,
+                "BATCHING_ENABLED": False,
+                # PaddleOCR is tuned on its own pipeline, not the table pipeline's
+                "PADDLEOCR_SHARE_TABLE_PIPELINE": False,
+                "DEDUP_ENABLED": False,
+                "ENGINE_MEMORY_BUDGET_MB": 0,
+            }
+        )
+        return config
+
+    def _tune_engine(
+        self, engine_name, lang, corpus, sizes, filters, threads, repeat
+    ) -> List[dict]:
+        trials = []
+        self.stdout.write(
+            f"\n{engine_name}: {len(sizes) * len(filters) * len(threads)} trials"
+        )
+        self.stdout.write(
+            "  size  filter    threads     CER   p50 ms   p95 ms  pages/s  pages/CPU-s"
+        )
+        for thread_count in threads:
+            # Thread counts are fixed when the models load, so each count gets
+            # a fresh engine; size and filter are read on every call
+            load_config = self._trial_config(
+                profile_settings(engine_name, sizes[0], filters[0], thread_count)
+            )
+            self._evict(engine_name, lang)
+            try:
+                with override_settings(OCR_CONFIG=load_config):
+                    try:
+                        engine = OCREngineFactory.get_engine(engine_name, lang)
+                    except (ImportError, ValueError) as e:
+                        self.stderr.write(f"  {engine_name} unavailable: {e}")
+                        return trials
+                    ready, message = engine.is_ready()
+                if not ready:
+                    self.stderr.write(f"  {engine_name} not ready: {message}")
+                    return trials
+                for size in sizes:
+                    for resample in filters:
+                        overrides = profile_settings(
+                            engine_name, size, resample, thread_count
+                        )
+                        with override_settings(
+                            OCR_CONFIG=self._trial_config(overrides)
+                        ):
+                            trial = self._measure(engine, corpus, repeat)
+                        trial.update(
+                            {
+                                "max_image_size": size,
+                                "resample": resample,
+                                "threads": thread_count,
+                                "settings": overrides,
+                            }
+                        )
+                        trials.append(trial)
+                        self._print_trial(trial)
+            finally:
+                self._evict(engine_name, lang)
+        return trials
+
+    @staticmethod
+    def _evict(engine_name: str, lang: str) -> None:
+        """Unload the engine (and the table engine PaddleCombined borrows from)"""
+        OCREngineFactory.evict_engine(engine_name, lang)
+        if engine_name == "PaddleCombined":
+            OCREngineFactory.evict_engine("PaddleTable", lang)
+
+    def _measure(self, engine, corpus, repeat) -> dict:
+        """Run the corpus through an engine: latency, throughput and CER"""
+        # Warm-up page, excluded from timing
+        try:
+            engine.extract_text(corpus[0][1])
+        except Exception:
+            pass
+
+        latencies = []
+        edits = 0
+        errors = 0
+        wall_start = time.perf_counter()
+        cpu_start = cpu_seconds()
+        for iteration in range(repeat):
+            for _, img, reference in corpus:
+                start = time.perf_counter()
+                try:
+                    text = engine.extract_text(img)[0] or ""
+                except Exception:
+                    text = None
+                latencies.append((time.perf_counter() - start) * 1000)
+                if iteration:
+                    continue
+                if text is None:
+                    # A failed page counts as entirely wrong
+                    errors += 1
+                    edits += len(reference)
+                else:
+                    edits += edit_distance(normalize_text(text), reference)
+        wall = time.perf_counter() - wall_start
+        cpu = cpu_seconds() - cpu_start
+
+        pages = len(latencies)
+        reference_chars = sum(len(reference) for _, _, reference in corpus)
+        return {
+            "cer": round(edits / max(1, reference_chars), 4),
+            "errors": errors,
+            "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+            "pages_per_second": round(pages / wall, 3),
+            "pages_per_cpu_second": round(pages / max(cpu, 1e-6), 3),
+        }
+
+    @staticmethod
+    def _select(front: List[dict], max_cer_increase: float, objective: str) -> dict:
+        best_cer = min(trial["cer"] for trial in front)
+        acceptable = [
+            trial for trial in front if trial["cer"] <= best_cer + max_cer_increase
+        ]
+        if objective == "throughput":
+            return max(acceptable, key=lambda trial: trial["pages_per_cpu_second"])
+        return min(acceptable, key=lambda trial: trial["p95_ms"])
+
+    def _profile(self, results: Dict[str, dict]) -> dict:
+        """OCR_CONFIG entries of every engine's selected trial.
+
+        Engines that share a setting (PaddleOCR, PaddleONNX and PaddleBatched
+        share the PaddleOCR size and filter) keep the first engine's value.
+        """
+        profile = {}
+        for engine_name, result in results.items():
+            for key, value in result["selected"]["settings"].items():
+                if isinstance(value, dict):
+                    table = profile.setdefault(key, {})
+                    for name, entry in value.items():
+                        self._set_once(
+                            table, name, entry, f"{key}[{name}]", engine_name
+                        )
+                else:
+                    self._set_once(profile, key, value, key, engine_name)
+        return profile
+
+    def _set_once(self, config, key, value, label, engine_name) -> None:
+        if key in config and config[key] != value:
+            self.stderr.write(
+                f"{engine_name} prefers {label}={value!r}; keeping {config[key]!r} "
+                f"selected for an earlier engine"
+            )
+            return
+        config[key] = value
+
+    def _print_trial(self, trial: dict) -> None:
+        self.stdout.write(
+            f"{trial['max_image_size']:>6}  {trial['resample']:<9} "
+            f"{trial['threads']:>7} {trial['cer']:>7.4f} {trial['p50_ms']:>8.1f} "
+            f"{trial['p95_ms']:>8.1f} {trial['pages_per_second']:>8.2f} "
+            f"{trial['pages_per_cpu_second']:>12.2f}"
+            + (f"  {trial['errors']} errors" if trial["errors"] else "")
+        )
+
+    def _print_front(self, engine_name: str, front: List[dict], selected: dict):
+        self.stdout.write(f"{engine_name} Pareto front (* selected):")
+        for trial in front:
+            marker = "*" if trial is selected else " "
+            note = " (current settings)" if trial["baseline"] else ""
+            self.stdout.write(
+                f"{marker} size {trial['max_image_size']}, {trial['resample']}, "
+                f"{trial['threads']} threads: CER {trial['cer']:.4f}, "
+                f"p95 {trial['p95_ms']:.0f} ms, "
+                f"{trial['pages_per_cpu_second']:.2f} pages/CPU-s{note}"
+            )
+        if not any(trial["baseline"] for trial in front):
+            self.stdout.write(
+                "  current settings are not on the front (see the trials above)"
+            )
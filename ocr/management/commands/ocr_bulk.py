@@ -0,0 +1,236 @@
+"""
+Offline bulk OCR over a local directory or file list.
+
+Images are processed by a pool of worker processes, each holding its own
+engine from OCREngineFactory. Results are appended to a JSONL file in
+chunks, and every finished chunk is recorded in a manifest so an
+interrupted run resumes where it stopped.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+import psutil
+from django.core.management.base import BaseCommand, CommandError
+
+from ocr.engines.factory import OCREngineFactory
+from ocr.languages import (
+    engine_language_code,
+    get_available_languages,
+    get_default_language,
+)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+
+# Approximate resident memory per worker process, used to size the pool
+ENGINE_MEMORY_MB = {
+    "Tesseract": 300,
+    "PaddleOCR": 1500,
+    "PaddleTable": 2500,
+    "PaddleCombined": 2500,
+    "PaddleONNX": 600,
+    "PaddleBatched": 1500,
+}
+
+_worker_engine_name = None
+_worker_lang = None
+
+
+def _init_worker(engine_name, lang):
+    """Pool initializer: set up Django and load only the requested engine"""
+    global _worker_engine_name, _worker_lang
+    import django
+    from django.conf import settings
+
+    django.setup()
+    # The pool worker is already a separate process per engine: an execution
+    # slot would only add a second process with its own copy of the models
+    # and pickle every page over a pipe
+    settings.OCR_CONFIG["PADDLEOCR_ISOLATED_EXECUTION"] = False
+    _worker_engine_name = engine_name
+    _worker_lang = lang
+    engine = OCREngineFactory.get_engine(engine_name, lang)
+    ready, message = engine.is_ready()
+    if not ready:
+        logging.error("Worker %s: %s not ready: %s", os.getpid(), engine_name, message)
+
+
+def _process_chunk(args):
+    """OCR one chunk of image paths in a worker process"""
+    paths, extract_fields = args
+    from PIL import Image
+
+    engine = OCREngineFactory.get_engine(_worker_engine_name, _worker_lang)
+    records = []
+    words_per_page = []
+    for path in paths:
+        record = {"path": path, "model": _worker_engine_name, "lang": _worker_lang}
+        words = []
+        start = time.perf_counter()
+        try:
+            with Image.open(path) as img:
+                img.load()
+                text, average_conf, tables, words = engine.extract_text_with_words(img)
+            record.update(
+                {"text": text, "average_confidence": average_conf, "tables": tables}
+            )
+        except Exception as e:
+            record["error"] = str(e)
+        record["latency"] = round(time.perf_counter() - start, 3)
+        records.append(record)
+        words_per_page.append(words)
+
+    if extract_fields:
+        from ocr.lab_extraction import extract_lab_values_batch
+
+        # One vectorized extraction pass over the whole chunk
+        for record, fields in zip(records, extract_lab_values_batch(words_per_page)):
+            if "error" not in record:
+                record["fields"] = fields
+    return paths, records
+
+
+def default_worker_count(engine_name: str) -> int:
+    """Size the pool by CPU cores and available memory"""
+    cores = os.cpu_count() or 1
+    available_mb = psutil.virtual_memory().available / 1024 / 1024
+    by_memory = int(available_mb // ENGINE_MEMORY_MB.get(engine_name, 1500))
+    return max(1, min(cores, by_memory))
+
+
+class Command(BaseCommand):
+    help = "Run OCR over a local directory or file list, writing results to JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "source", help="Directory of images, or a text file with one path per line"
+        )
+        parser.add_argument("--output", required=True, help="Output JSONL file")
+        parser.add_argument(
+            "--model",
+            default="Tesseract",
+            choices=OCREngineFactory.get_available_engines(),
+        )
+        parser.add_argument(
+            "--lang",
+            default=get_default_language(),
+            choices=get_available_languages(),
+            help="Document language",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help="Worker processes (default: sized to cores and available memory)",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=20, help="Images per written chunk"
+        )
+        parser.add_argument(
+            "--manifest",
+            help="Checkpoint manifest path (default: <output>.manifest)",
+        )
+        parser.add_argument(
+            "--extract-fields",
+            action="store_true",
+            help="Also extract structured lab values",
+        )
+
+    def _collect_paths(self, source):
+        source_path = Path(source)
+        if source_path.is_dir():
+            return sorted(
+                str(p)
+                for p in source_path.rglob("*")
+                if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS
+            )
+        if source_path.is_file():
+            with open(source_path, "r", encoding="utf-8") as f:
+                return [line.strip() for line in f if line.strip()]
+        raise CommandError(f"Source not found: {source}")
+
+    def _load_manifest(self, manifest_path):
+        if not os.path.exists(manifest_path):
+            return set()
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+
+    def handle(self, *args, **options):
+        engine_name = options["model"]
+        lang = options["lang"]
+        if engine_language_code(engine_name, lang) is None:
+            raise CommandError(f"{engine_name} does not support language '{lang}'")
+        output_path = options["output"]
+        manifest_path = options["manifest"] or f"{output_path}.manifest"
+        chunk_size = max(1, options["chunk_size"])
+
+        paths = self._collect_paths(options["source"])
+        done = self._load_manifest(manifest_path)
+        pending = [p for p in paths if p not in done]
+        if done:
+            self.stdout.write(
+                f"Resuming: {len(paths) - len(pending)} of {len(paths)} already done"
+            )
+        if not pending:
+            self.stdout.write(self.style.SUCCESS("Nothing to do"))
+            return
+
+        workers = options["workers"] or default_worker_count(engine_name)
+        workers = min(workers, (len(pending) + chunk_size - 1) // chunk_size)
+        chunks = [
+            (pending[i : i + chunk_size], options["extract_fields"])
+            for i in range(0, len(pending), chunk_size)
+        ]
+
+        # Spawned workers load only their engine and split the cores between
+        # them instead of each inference library using every core
+        os.environ["OCR_EAGER_ENGINE_INIT"] = "False"
+        threads = str(max(1, (os.cpu_count() or 1) // workers))
+        os.environ.setdefault("OMP_NUM_THREADS", threads)
+        os.environ.setdefault("OPENBLAS_NUM_THREADS", threads)
+
+        self.stdout.write(
+            f"Processing {len(pending)} images with {workers} {engine_name} "
+            f"workers in {len(chunks)} chunks"
+        )
+
+        processed = 0
+        errors = 0
+        start = time.perf_counter()
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(
+            workers, initializer=_init_worker, initargs=(engine_name, lang)
+        ) as pool, open(output_path, "a", encoding="utf-8") as output, open(
+            manifest_path, "a", encoding="utf-8"
+        ) as manifest:
+            for chunk_paths, records in pool.imap_unordered(_process_chunk, chunks):
+                # Results are made durable before the chunk is checkpointed, so
+                # a crash can at worst repeat a chunk, never lose one
+                for record in records:
+                    output.write(json.dumps(record) + "\n")
+                output.flush()
+                os.fsync(output.fileno())
+                manifest.write("".join(f"{p}\n" for p in chunk_paths))
+                manifest.flush()
+                os.fsync(manifest.fileno())
+
+                processed += len(records)
+                errors += sum(1 for r in records if "error" in r)
+                elapsed = time.perf_counter() - start
+                rate = processed / elapsed if elapsed else 0.0
+                remaining = (len(pending) - processed) / rate if rate else 0.0
+                self.stdout.write(
+                    f"{processed}/{len(pending)} images, {rate:.2f} images/s, "
+                    f"{errors} errors, ETA {remaining:.0f}s"
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Done: {processed} images in {time.perf_counter() - start:.1f}s "
+                f"({errors} errors), results in {output_path}"
+            )
+        )
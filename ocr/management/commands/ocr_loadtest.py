@@ -0,0 +1,591 @@
+"""
+HTTP load test of the /ocr/ endpoint with a latency SLO report.
+
+Starts the real app under gunicorn (gunicorn.conf.py) on a local port, or
+targets a running server with --url, and ramps through concurrency levels.
+Each step sends a weighted mix of engines and page sizes from closed-loop
+client threads for a fixed time. Per step it records p50/p95/p99 latency,
+throughput, error/503/429/504 rates and the server's peak RSS, including
+execution slot processes. The highest level that still meets the SLO is the
+saturation point. Reports are JSON, so a run can be compared with one from
+another commit via --compare.
+"""
+
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import psutil
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageDraw, ImageFont
+
+from ocr.engines.factory import OCREngineFactory
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+
+# Server RSS sampling interval in seconds
+RSS_SAMPLE_INTERVAL = 0.25
+
+# Environment variables recorded with a report, since they change what the
+# server can sustain
+SERVER_ENV_PREFIXES = ("GUNICORN_", "OCR_", "PADDLE", "TESSERACT_", "WORKER_")
+
+# Lines of a synthetic lab report: analyte, value, unit, reference range
+LAB_ROWS = [
+    ("Glucose, fasting", "95", "mg/dL", "70-99"),
+    ("Hemoglobin A1c", "5.4", "%", "4.0-5.6"),
+    ("Sodium", "139", "mmol/L", "135-145"),
+    ("Potassium", "4.1", "mmol/L", "3.5-5.1"),
+    ("Creatinine", "0.92", "mg/dL", "0.6-1.3"),
+    ("Cholesterol, total", "212", "mg/dL", "<200"),
+    ("Thyroid Stimulating Hormone", "2.31", "uIU/mL", "0.45-4.5"),
+]
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """'Tesseract=3,PaddleOCR=1' -> {'Tesseract': 3.0, 'PaddleOCR': 1.0}"""
+    weights = {}
+    for part in value.split(","):
+        name, _, weight = part.strip().partition("=")
+        weights[name] = float(weight) if weight else 1.0
+    return weights
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+
+def lab_report_page(width: int, height: int) -> bytes:
+    """PNG of a synthetic lab report page filled with rows of results"""
+    img = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=max(12, width // 60))
+    row_height = max(16, width // 35)
+    for i, y in enumerate(range(row_height * 2, height - row_height, row_height)):
+        name, value, unit, reference = LAB_ROWS[i % len(LAB_ROWS)]
+        for x, text in zip((0.05, 0.5, 0.62, 0.78), (name, value, unit, reference)):
+            draw.text((int(width * x), y), text, fill=0, font=font)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def multipart_body(fields: Dict[str, str], filename: str, data: bytes):
+    """Encode a multipart/form-data body with one image file"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"'
+            f"\r\n\r\n{value}\r\n".encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; '
+        f'filename="{filename}"\r\nContent-Type: application/octet-stream'
+        f"\r\n\r\n".encode()
+    )
+    parts.append(data)
+    parts.append(f"\r\n--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    return round(float(np.percentile(values, q)), 1) if values else None
+
+
+def process_tree_rss_mb(pid: int) -> float:
+    """RSS of a process and all its descendants in MB"""
+    try:
+        root = psutil.Process(pid)
+        processes = [root] + root.children(recursive=True)
+    except psutil.Error:
+        return 0.0
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            continue
+    return total / 1024 / 1024
+
+
+class RSSSampler(threading.Thread):
+    """Samples the server's process-tree RSS, keeping the peak since reset()"""
+
+    def __init__(self, pid: int):
+        super().__init__(name="loadtest-rss", daemon=True)
+        self.pid = pid
+        self.peak_mb = 0.0
+        self.stopped = threading.Event()
+
+    def reset(self) -> None:
+        self.peak_mb = process_tree_rss_mb(self.pid)
+
+    def run(self) -> None:
+        while not self.stopped.wait(RSS_SAMPLE_INTERVAL):
+            self.peak_mb = max(self.peak_mb, process_tree_rss_mb(self.pid))
+
+
+class Command(BaseCommand):
+    help = "Ramp concurrent /ocr/ load against the app and report the latency SLO saturation point"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            help="Base URL of a running server (default: start gunicorn locally)",
+        )
+        parser.add_argument(
+            "--server-pid",
+            type=int,
+            help="PID of the server given by --url, to sample its RSS",
+        )
+        parser.add_argument(
+            "--mix",
+            default="Tesseract=1",
+            help="Weighted engine mix, e.g. Tesseract=3,PaddleOCR=1",
+        )
+        parser.add_argument(
+            "--sizes",
+            default="1240x1754=1,2480x3508=1",
+            help="Weighted synthetic page sizes (WIDTHxHEIGHT=weight)",
+        )
+        parser.add_argument(
+            "--images",
+            help="Directory of sample pages to send instead of synthetic ones",
+        )
+        parser.add_argument(
+            "--ramp",
+            default="1,2,4,8",
+            help="Comma-separated concurrency levels, one step each",
+        )
+        parser.add_argument(
+            "--step-seconds", type=float, default=30, help="Duration of each step"
+        )
+        parser.add_argument(
+            "--slo-p99-ms",
+            type=float,
+            default=10000,
+            help="p99 latency a step must stay under",
+        )
+        parser.add_argument(
+            "--max-error-rate",
+            type=float,
+            default=0.01,
+            help="Share of failed requests (any non-2xx) a step may have",
+        )
+        parser.add_argument(
+            "--max-rss-mb",
+            type=float,
+            help="Peak server RSS a step may reach (default: no limit)",
+        )
+        parser.add_argument(
+            "--continue-after-breach",
+            action="store_true",
+            help="Run the remaining steps after the SLO is first missed",
+        )
+        parser.add_argument(
+            "--request-timeout", type=float, default=300, help="Client timeout"
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the request mix"
+        )
+        parser.add_argument(
+            "--server-log",
+            default="loadtest-server.log",
+            help="Where the started server's output goes",
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file")
+        parser.add_argument(
+            "--compare", help="Earlier JSON report to compare this run against"
+        )
+
+    def _payloads(self, options) -> List[Tuple[str, str, bytes, str, float]]:
+        """(engine, page label, body, content type, weight) for every combination"""
+        engines = parse_weights(options["mix"])
+        available = OCREngineFactory.get_available_engines()
+        for name in engines:
+            if name not in available:
+                raise CommandError(f"Unknown engine in --mix: {name}")
+
+        if options["images"]:
+            pages = [
+                (path.name, path.read_bytes(), 1.0)
+                for path in sorted(Path(options["images"]).iterdir())
+                if path.suffix.lower() in IMAGE_EXTENSIONS
+            ]
+            if not pages:
+                raise CommandError(f"No images found in {options['images']}")
+        else:
+            pages = []
+            for size, weight in parse_weights(options["sizes"]).items():
+                width, height = parse_size(size)
+                pages.append((size, lab_report_page(width, height), weight))
+
+        payloads = []
+        for engine, engine_weight in engines.items():
+            for label, data, page_weight in pages:
+                body, content_type = multipart_body(
+                    {"model": engine}, f"{label}.png", data
+                )
+                payloads.append(
+                    (engine, label, body, content_type, engine_weight * page_weight)
+                )
+        return payloads
+
+    def _start_server(self, log_file) -> Tuple[subprocess.Popen, str]:
+        """Run the app under gunicorn with the repo's config on a free local port"""
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        env = dict(os.environ, GUNICORN_BIND=f"127.0.0.1:{port}")
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "-c",
+                "gunicorn.conf.py",
+                "img_medreport_scanner.wsgi:application",
+            ],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+        )
+        return process, f"http://127.0.0.1:{port}"
+
+    def _wait_until_up(self, url: str, server, timeout: float) -> None:
+        """Wait until the app answers (engines load at startup)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server is not None and server.poll() is not None:
+                raise CommandError(f"Server exited with code {server.returncode}")
+            try:
+                with urllib.request.urlopen(f"{url}/ocr/engines/", timeout=5):
+                    return
+            except (urllib.error.URLError, OSError):
+                time.sleep(1)
+        raise CommandError(f"Server at {url} did not come up within {timeout:.0f}s")
+
+    def _send(self, url: str, body: bytes, content_type: str, timeout: float):
+        """POST one page, returning (HTTP status or 0 on connection error, ms)"""
+        request = urllib.request.Request(
+            f"{url}/ocr/",
+            data=body,
+            headers={"Content-Type": content_type},
+            method="POST",
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except (urllib.error.URLError, OSError):
+            status = 0
+        return status, (time.perf_counter() - start) * 1000
+
+    def _run_step(self, url, payloads, concurrency, options, rng_seed, sampler):
+        """Closed-loop load at one concurrency level for step_seconds"""
+        weights = [payload[4] for payload in payloads]
+        results = []
+        results_lock = threading.Lock()
+        stop_at = time.monotonic() + options["step_seconds"]
+
+        def client(index):
+            rng = random.Random(rng_seed * 1000 + index)
+            while time.monotonic() < stop_at:
+                engine, label, body, content_type, _ = rng.choices(payloads, weights)[0]
+                status, latency_ms = self._send(
+                    url, body, content_type, options["request_timeout"]
+                )
+                with results_lock:
+                    results.append((engine, label, status, latency_ms))
+
+        if sampler is not None:
+            sampler.reset()
+        start = time.monotonic()
+        threads = [
+            threading.Thread(target=client, args=(i,), name=f"loadtest-client-{i}")
+            for i in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        return self._step_stats(concurrency, results, elapsed, sampler, options)
+
+    def _step_stats(self, concurrency, results, elapsed, sampler, options) -> dict:
+        total = len(results)
+        ok = [r for r in results if 200 <= r[2] < 300]
+        latencies = [r[3] for r in ok]
+
+        def rate(statuses):
+            count = sum(1 for r in results if r[2] in statuses)
+            return round(count / total, 4) if total else 0.0
+
+        by_engine = {}
+        for engine in sorted({r[0] for r in results}):
+            engine_latencies = [r[3] for r in ok if r[0] == engine]
+            by_engine[engine] = {
+                "requests": sum(1 for r in results if r[0] == engine),
+                "p50_ms": percentile(engine_latencies, 50),
+                "p99_ms": percentile(engine_latencies, 99),
+            }
+
+        step = {
+            "concurrency": concurrency,
+            "requests": total,
+            "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "error_rate": round(1 - len(ok) / total, 4) if total else 0.0,
+            "rate_503": rate({503}),
+            "rate_429": rate({429}),
+            "rate_504": rate({504}),
+            "connection_error_rate": rate({0}),
+            "peak_rss_mb": round(sampler.peak_mb, 1) if sampler else None,
+            "by_engine": by_engine,
+        }
+
+        breaches = []
+        if not latencies:
+            breaches.append("no successful requests")
+        elif step["p99_ms"] > options["slo_p99_ms"]:
+            breaches.append(f"p99 {step['p99_ms']:.0f} ms > {options['slo_p99_ms']:g}")
+        if step["error_rate"] > options["max_error_rate"]:
+            breaches.append(
+                f"error rate {step['error_rate']:.2%} > {options['max_error_rate']:.2%}"
+            )
+        if (
+            options["max_rss_mb"] is not None
+            and step["peak_rss_mb"] is not None
+            and step["peak_rss_mb"] > options["max_rss_mb"]
+        ):
+            breaches.append(
+                f"peak RSS {step['peak_rss_mb']:.0f} MB > {options['max_rss_mb']:g}"
+            )
+        step["slo_breaches"] = breaches
+        return step
+
+    def _print_step(self, step) -> None:
+        def ms(value):
+            return f"{value:8.0f}" if value is not None else "       -"
+
+        rss = (
+            f"{step['peak_rss_mb']:7.0f}"
+            if step["peak_rss_mb"] is not None
+            else "      -"
+        )
+        line = (
+            f"{step['concurrency']:>5} {step['requests']:>6} "
+            f"{step['throughput_rps']:7.2f} {ms(step['p50_ms'])} {ms(step['p95_ms'])} "
+            f"{ms(step['p99_ms'])} {step['error_rate']:6.1%} {step['rate_503']:6.1%} "
+            f"{step['rate_429']:6.1%} {rss}"
+        )
+        if step["slo_breaches"]:
+            self.stdout.write(
+                self.style.ERROR(
+                    f"{line}  SLO missed: {'; '.join(step['slo_breaches'])}"
+                )
+            )
+        else:
+            self.stdout.write(line)
+
+    def _saturation(self, steps) -> dict:
+        """Highest concurrency meeting the SLO before it was first missed"""
+        within = None
+        breached = None
+        for step in steps:
+            if step["slo_breaches"]:
+                breached = step
+                break
+            within = step
+        return {
+            "max_concurrency_within_slo": within["concurrency"] if within else None,
+            "throughput_rps_at_saturation": (
+                within["throughput_rps"] if within else None
+            ),
+            "p99_ms_at_saturation": within["p99_ms"] if within else None,
+            "breached_at_concurrency": breached["concurrency"] if breached else None,
+            "breach_reasons": breached["slo_breaches"] if breached else [],
+        }
+
+    def _git_commit(self) -> Optional[str]:
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def _compare(self, report, baseline_path) -> None:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    "Baseline was run with a different configuration; "
+                    "differences may not come from the code"
+                )
+            )
+
+        def change(old, new):
+            if old is None or new is None:
+                return "       -"
+            if not old:
+                return f"{new:8.1f}"
+            return f"{(new - old) / old:+8.1%}"
+
+        self.stdout.write(
+            f"\nCompared with {baseline.get('commit') or baseline_path}:\n"
+            "conc.   p50 Δ    p95 Δ    p99 Δ    rps Δ  errors (base -> now)"
+        )
+        base_steps = {step["concurrency"]: step for step in baseline["steps"]}
+        for step in report["steps"]:
+            base = base_steps.get(step["concurrency"])
+            if base is None:
+                continue
+            self.stdout.write(
+                f"{step['concurrency']:>5} {change(base['p50_ms'], step['p50_ms'])} "
+                f"{change(base['p95_ms'], step['p95_ms'])} "
+                f"{change(base['p99_ms'], step['p99_ms'])} "
+                f"{change(base['throughput_rps'], step['throughput_rps'])}  "
+                f"{base['error_rate']:.1%} -> {step['error_rate']:.1%}"
+            )
+        old = baseline["saturation"]["max_concurrency_within_slo"]
+        new = report["saturation"]["max_concurrency_within_slo"]
+        self.stdout.write(f"Saturation point: concurrency {old} -> {new}")
+
+    def handle(self, *args, **options):
+        ramp = [int(level) for level in options["ramp"].split(",") if level.strip()]
+        if not ramp or min(ramp) < 1:
+            raise CommandError("--ramp needs concurrency levels of at least 1")
+        payloads = self._payloads(options)
+
+        server = None
+        server_log = None
+        url = (options["url"] or "").rstrip("/")
+        pid = options["server_pid"]
+        if not url:
+            server_log = open(options["server_log"], "ab")
+            server, url = self._start_server(server_log)
+            pid = server.pid
+            self.stdout.write(
+                f"Started gunicorn (pid {pid}) at {url}, "
+                f"logging to {options['server_log']}"
+            )
+
+        sampler = RSSSampler(pid) if pid else None
+        steps = []
+        try:
+            self._wait_until_up(url, server, options["request_timeout"] * 2)
+            # One request per engine and page first, so lazily loaded engines
+            # and caches do not count against the first step
+            for engine, label, body, content_type, _ in payloads:
+                status, latency_ms = self._send(
+                    url, body, content_type, options["request_timeout"]
+                )
+                self.stdout.write(
+                    f"Warm-up {engine} {label}: HTTP {status} in {latency_ms:.0f} ms"
+                )
+
+            if sampler is not None:
+                sampler.start()
+            self.stdout.write(
+                " conc.   reqs     rps      p50      p95      p99 errors    503    429  RSS MB"
+            )
+            for index, concurrency in enumerate(ramp):
+                step = self._run_step(
+                    url,
+                    payloads,
+                    concurrency,
+                    options,
+                    options["seed"] + index,
+                    sampler,
+                )
+                steps.append(step)
+                self._print_step(step)
+                if step["slo_breaches"] and not options["continue_after_breach"]:
+                    break
+        finally:
+            if sampler is not None:
+                sampler.stopped.set()
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(timeout=60)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+            if server_log is not None:
+                server_log.close()
+
+        report = {
+            "commit": self._git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {
+                "mix": options["mix"],
+                "pages": options["images"] or options["sizes"],
+                "ramp": ramp,
+                "step_seconds": options["step_seconds"],
+                "slo_p99_ms": options["slo_p99_ms"],
+                "max_error_rate": options["max_error_rate"],
+                "max_rss_mb": options["max_rss_mb"],
+                "environment": {
+                    key: value
+                    for key, value in sorted(os.environ.items())
+                    if key.startswith(SERVER_ENV_PREFIXES)
+                },
+            },
+            "steps": steps,
+            "saturation": self._saturation(steps),
+        }
+
+        saturation = report["saturation"]
+        if saturation["max_concurrency_within_slo"] is None:
+            self.stdout.write(self.style.ERROR("SLO missed at the first step"))
+        elif saturation["breached_at_concurrency"] is None:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"SLO met at every step up to concurrency "
+                    f"{saturation['max_concurrency_within_slo']}; extend --ramp to "
+                    f"find the saturation point"
+                )
+            )
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Saturation point: concurrency "
+                    f"{saturation['max_concurrency_within_slo']} at "
+                    f"{saturation['throughput_rps_at_saturation']:.2f} req/s, "
+                    f"p99 {saturation['p99_ms_at_saturation']:.0f} ms"
+                )
+            )
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+        if options["compare"]:
+            self._compare(report, options["compare"])
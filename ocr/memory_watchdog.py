@@ -0,0 +1,202 @@
+"""
+Worker Memory Watchdog Module
+
+Tracks per-worker RSS after each request and decides when the worker should
+be recycled: when RSS crosses an absolute threshold, or when it keeps
+growing at a steady slope. Before a recycle the watchdog records a
+tracemalloc snapshot diff so the source of the growth is logged.
+
+Paddle inference runs in execution slot child processes (execution.py),
+whose memory is not part of the worker's RSS. A slot above SLOT_MAX_RSS_MB
+is restarted once its in-flight calls finish; the worker keeps serving.
+"""
+
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+
+from .utils import get_rss_mb
+
+TRACEMALLOC_FRAMES = 5
+LEAK_REPORT_TOP_N = 25
+
+
+class MemoryWatchdog:
+    """Per-process RSS tracker deciding when to gracefully recycle the worker"""
+
+    def __init__(
+        self,
+        max_rss_mb: float,
+        max_growth_mb_per_request: float,
+        min_growth_mb: float,
+        window: int,
+        snapshot_fraction: float,
+        report_dir: str,
+    ):
+        self.max_rss_mb = max_rss_mb
+        self.max_growth_mb_per_request = max_growth_mb_per_request
+        self.min_growth_mb = min_growth_mb
+        self.window = window
+        self.snapshot_fraction = snapshot_fraction
+        self.report_dir = report_dir
+
+        self.samples = deque(maxlen=window)
+        self.baseline_rss_mb: Optional[float] = None
+        self.requests = 0
+        self._baseline_snapshot = None
+
+    @classmethod
+    def from_settings(cls) -> "MemoryWatchdog":
+        config = getattr(settings, "OCR_CONFIG", {})
+        return cls(
+            max_rss_mb=config.get("WORKER_MAX_RSS_MB", 4500),
+            max_growth_mb_per_request=config.get(
+                "WORKER_MAX_RSS_GROWTH_MB_PER_REQUEST", 2.0
+            ),
+            min_growth_mb=config.get("WORKER_MIN_RSS_GROWTH_MB", 512),
+            window=config.get("WORKER_RSS_WINDOW", 50),
+            snapshot_fraction=config.get("WORKER_LEAK_SNAPSHOT_FRACTION", 0.8),
+            report_dir=config.get(
+                "PROFILING_DIR", os.path.join(settings.BASE_DIR, "profiles")
+            ),
+        )
+
+    def _growth_slope(self) -> float:
+        """Least-squares RSS growth in MB per request over the sample window"""
+        if len(self.samples) < self.window:
+            return 0.0
+        y = np.fromiter(self.samples, dtype=np.float64)
+        return float(np.polyfit(np.arange(len(y)), y, 1)[0])
+
+    def _maybe_start_leak_tracking(self, rss_mb: float) -> None:
+        """Take a baseline tracemalloc snapshot once RSS nears either recycle trigger"""
+        near_max = rss_mb >= self.max_rss_mb * self.snapshot_fraction
+        near_growth = (
+            rss_mb - self.baseline_rss_mb >= self.min_growth_mb * self.snapshot_fraction
+        )
+        if not (near_max or near_growth):
+            return
+        if self._baseline_snapshot is not None and tracemalloc.is_tracing():
+            return
+
+        logging.info(
+            "Worker RSS %.2f MB near recycle threshold, starting leak tracking",
+            rss_mb,
+        )
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._baseline_snapshot = tracemalloc.take_snapshot()
+
+    def record_request(self) -> Optional[str]:
+        """
+        Record RSS after a request.
+
+        Returns:
+            The reason the worker should be recycled, or None to keep serving
+        """
+        rss_mb = get_rss_mb()
+        self.requests += 1
+        self.samples.append(rss_mb)
+        if self.baseline_rss_mb is None:
+            # First request includes lazy allocations; treat it as the baseline
+            self.baseline_rss_mb = rss_mb
+
+        self._maybe_start_leak_tracking(rss_mb)
+
+        if rss_mb >= self.max_rss_mb:
+            return f"RSS {rss_mb:.2f} MB >= {self.max_rss_mb} MB"
+
+        slope = self._growth_slope()
+        growth = rss_mb - self.baseline_rss_mb
+        if slope >= self.max_growth_mb_per_request and growth >= self.min_growth_mb:
+            return (
+                f"RSS growing {slope:.2f} MB/request over {self.window} requests "
+                f"(+{growth:.2f} MB since first request)"
+            )
+        return None
+
+    def write_leak_report(self, reason: str) -> Optional[str]:
+        """Log and save the tracemalloc diff since the baseline snapshot"""
+        if self._baseline_snapshot is None or not tracemalloc.is_tracing():
+            logging.warning("No tracemalloc baseline, skipping leak report")
+            return None
+
+        snapshot = tracemalloc.take_snapshot()
+        diff = snapshot.compare_to(self._baseline_snapshot, "traceback")
+
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(
+            self.report_dir,
+            f"leak-{time.strftime('%Y%m%d-%H%M%S')}-pid{os.getpid()}.txt",
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"# Recycle reason: {reason}\n")
+            f.write(f"# Requests served: {self.requests}\n")
+            f.write(f"# RSS samples (MB): {list(self.samples)[-10:]}\n")
+            for stat in diff[:LEAK_REPORT_TOP_N]:
+                f.write(f"{stat}\n")
+                for line in stat.traceback.format():
+                    f.write(f"    {line}\n")
+
+        for stat in diff[:5]:
+            logging.warning("Memory growth: %s", stat)
+        logging.warning("Leak report saved to %s", path)
+        return path
+
+
+_watchdog: Optional[MemoryWatchdog] = None
+_watchdog_pid: Optional[int] = None
+
+
+def get_watchdog() -> MemoryWatchdog:
+    """Get this process's watchdog, creating a fresh one after fork"""
+    global _watchdog, _watchdog_pid
+    if _watchdog is None or _watchdog_pid != os.getpid():
+        _watchdog = MemoryWatchdog.from_settings()
+        _watchdog_pid = os.getpid()
+    return _watchdog
+
+
+def check_slot_memory() -> None:
+    """Restart execution slots whose RSS exceeds SLOT_MAX_RSS_MB"""
+    from .engines.factory import OCREngineFactory
+
+    max_rss_mb = getattr(settings, "OCR_CONFIG", {}).get("SLOT_MAX_RSS_MB", 3000)
+    for slot in OCREngineFactory.get_slots():
+        rss_mb = slot.rss_mb()
+        if rss_mb < max_rss_mb:
+            continue
+        threading.Thread(
+            target=slot.recycle,
+            args=(f"RSS {rss_mb:.2f} MB >= {max_rss_mb} MB",),
+            name=f"ocr-slot-recycle-{slot.primary_engine}",
+            daemon=True,
+        ).start()
+
+
+def check_worker_memory(worker) -> None:
+    """
+    Gunicorn post_request hook body: recycle the worker gracefully when the
+    watchdog reports excessive or steadily growing RSS.
+    """
+    check_slot_memory()
+    watchdog = get_watchdog()
+    reason = watchdog.record_request()
+    if reason is None:
+        return
+
+    logging.warning("Recycling worker %s: %s", os.getpid(), reason)
+    try:
+        watchdog.write_leak_report(reason)
+    except Exception as e:
+        logging.error("Failed to write leak report: %s", str(e))
+    # The sync worker finishes the current request and exits; the arbiter
+    # then starts a replacement
+    worker.alive = False
@@ -0,0 +1,60 @@
+"""OCR request middleware."""
+
+import logging
+import time
+
+from ocr.profiling import (
+    RequestProfiler,
+    finish_request_timings,
+    format_server_timing,
+    is_profiling_authorized,
+    start_request_timings,
+)
+
+PROFILE_HEADER = "X-OCR-Profile"
+PROFILE_ID_HEADER = "X-OCR-Profile-Id"
+
+
+class ServerTimingMiddleware:
+    """Report per-stage durations as a Server-Timing header.
+
+    Requests carrying an X-OCR-Profile header that matches the configured
+    PROFILING_TOKEN are also run under a profiler. Requests without the
+    header never touch the profiler.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = start_request_timings()
+        start = time.perf_counter()
+        profiler = None
+
+        profile_header = request.headers.get(PROFILE_HEADER)
+        if profile_header is not None:
+            if is_profiling_authorized(profile_header):
+                profiler = RequestProfiler(f"{request.method} {request.path}")
+                profiler.start()
+            else:
+                logging.warning("Rejected unauthorized profiling request")
+
+        try:
+            response = self.get_response(request)
+        finally:
+            profile_id = None
+            if profiler:
+                # A failed report must not replace the finished response
+                try:
+                    profile_id = profiler.stop()
+                except Exception as e:
+                    logging.error(
+                        "Failed to save request profile: %s", str(e), exc_info=True
+                    )
+            timings = finish_request_timings(token)
+
+        timings["total"] = (time.perf_counter() - start) * 1000
+        response["Server-Timing"] = format_server_timing(timings)
+        if profile_id:
+            response[PROFILE_ID_HEADER] = profile_id
+        return response
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="OCRResult",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("engine", models.CharField(max_length=32)),
+                ("lang", models.CharField(max_length=16)),
+                (
+                    "patient_id",
+                    models.CharField(blank=True, default="", max_length=128),
+                ),
+                ("document", models.CharField(blank=True, default="", max_length=255)),
+                ("page", models.PositiveIntegerField(blank=True, null=True)),
+                ("text", models.TextField(blank=True, default="")),
+                ("table_text", models.TextField(blank=True, default="")),
+                ("tables", models.JSONField(blank=True, null=True)),
+                ("fields", models.JSONField(blank=True, null=True)),
+                ("average_confidence", models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["-created_at", "-id"],
+                "indexes": [
+                    models.Index(
+                        fields=["-created_at", "-id"], name="ocr_result_created_idx"
+                    ),
+                    models.Index(
+                        fields=["engine", "-created_at", "-id"],
+                        name="ocr_result_engine_idx",
+                    ),
+                    models.Index(
+                        fields=["patient_id", "-created_at", "-id"],
+                        name="ocr_result_patient_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,89 @@
+from django.db import migrations
+
+# PostgreSQL: a generated tsvector over text (weight A) and table cell text
+# (weight B), with a GIN index
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE ocr_ocrresult ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(text, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(table_text, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX ocr_result_search_idx ON ocr_ocrresult USING GIN (search_vector)",
+]
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS ocr_result_search_idx",
+    "ALTER TABLE ocr_ocrresult DROP COLUMN IF EXISTS search_vector",
+]
+
+# SQLite (development): an external-content FTS5 table kept in sync by triggers
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE ocr_ocrresult_fts USING fts5(
+        text, table_text,
+        content='ocr_ocrresult', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER ocr_ocrresult_fts_insert AFTER INSERT ON ocr_ocrresult BEGIN
+        INSERT INTO ocr_ocrresult_fts(rowid, text, table_text)
+        VALUES (new.id, new.text, new.table_text);
+    END
+    """,
+    """
+    CREATE TRIGGER ocr_ocrresult_fts_delete AFTER DELETE ON ocr_ocrresult BEGIN
+        INSERT INTO ocr_ocrresult_fts(ocr_ocrresult_fts, rowid, text, table_text)
+        VALUES ('delete', old.id, old.text, old.table_text);
+    END
+    """,
+    """
+    CREATE TRIGGER ocr_ocrresult_fts_update AFTER UPDATE ON ocr_ocrresult BEGIN
+        INSERT INTO ocr_ocrresult_fts(ocr_ocrresult_fts, rowid, text, table_text)
+        VALUES ('delete', old.id, old.text, old.table_text);
+        INSERT INTO ocr_ocrresult_fts(rowid, text, table_text)
+        VALUES (new.id, new.text, new.table_text);
+    END
+    """,
+    "INSERT INTO ocr_ocrresult_fts(ocr_ocrresult_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS ocr_ocrresult_fts_insert",
+    "DROP TRIGGER IF EXISTS ocr_ocrresult_fts_delete",
+    "DROP TRIGGER IF EXISTS ocr_ocrresult_fts_update",
+    "DROP TABLE IF EXISTS ocr_ocrresult_fts",
+]
+
+STATEMENTS = {
+    "postgresql": (POSTGRES_FORWARD, POSTGRES_REVERSE),
+    "sqlite": (SQLITE_FORWARD, SQLITE_REVERSE),
+}
+
+
+def _run(schema_editor, forward):
+    statements = STATEMENTS.get(schema_editor.connection.vendor)
+    # Other databases fall back to unindexed substring search
+    if statements is None:
+        return
+    for sql in statements[0 if forward else 1]:
+        schema_editor.execute(sql)
+
+
+def create_search_index(apps, schema_editor):
+    _run(schema_editor, forward=True)
+
+
+def drop_search_index(apps, schema_editor):
+    _run(schema_editor, forward=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ocr", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
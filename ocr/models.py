@@ -1,4 +1,42 @@
 from django.db import models
+from django.utils import timezone
 
-# OCR models can be added here in the future
-# For example: OCRResult, ProcessedImage, etc.
+
+class OCRResult(models.Model):
+    """One engine's OCR output for one page, kept for full-text search.
+
+    The search index is maintained by the database (see migration 0002): a
+    generated tsvector column with a GIN index on PostgreSQL, an FTS5 table
+    kept in sync by triggers on SQLite.
+    """
+
+    created_at = models.DateTimeField(default=timezone.now)
+    engine = models.CharField(max_length=32)
+    lang = models.CharField(max_length=16)
+    # Caller-supplied identifiers, empty when not given
+    patient_id = models.CharField(max_length=128, blank=True, default="")
+    document = models.CharField(max_length=255, blank=True, default="")
+    page = models.PositiveIntegerField(null=True, blank=True)
+    text = models.TextField(blank=True, default="")
+    # Cell text of the recognized tables, searched together with text
+    table_text = models.TextField(blank=True, default="")
+    tables = models.JSONField(null=True, blank=True)
+    fields = models.JSONField(null=True, blank=True)
+    average_confidence = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        # Keyset pagination walks (created_at, id) newest first
+        ordering = ["-created_at", "-id"]
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="ocr_result_created_idx"),
+            models.Index(
+                fields=["engine", "-created_at", "-id"], name="ocr_result_engine_idx"
+            ),
+            models.Index(
+                fields=["patient_id", "-created_at", "-id"],
+                name="ocr_result_patient_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.engine} result {self.pk} ({self.created_at:%Y-%m-%d %H:%M})"
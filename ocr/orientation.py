@@ -0,0 +1,171 @@
+"""
+Page Orientation Module
+
+Detects whole-page rotation (0/90/180/270 degrees) on a downscaled copy of
+the page so that engines can rotate once up front instead of classifying
+the angle of every detected text line.
+"""
+
+import logging
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image
+
+ORIENTATION_METHODS = {"off", "projection", "osd"}
+
+# Detection works on a small thumbnail; orientation is a page-level property
+# and does not need full resolution.
+ORIENTATION_THUMBNAIL_SIZE = 768
+
+_TRANSPOSE_FOR_ROTATION = {
+    90: Image.Transpose.ROTATE_270,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_90,
+}
+
+
+def _to_gray_image(img: Union[Image.Image, np.ndarray]) -> Image.Image:
+    """Get a grayscale PIL view of a page given as PIL Image or ndarray"""
+    if isinstance(img, np.ndarray):
+        img = Image.fromarray(img)
+    return img.convert("L")
+
+
+def _to_ink_mask(img: Union[Image.Image, np.ndarray]) -> np.ndarray:
+    """Downscale to a grayscale thumbnail and return a boolean ink mask"""
+    thumb = _to_gray_image(img)
+    thumb.thumbnail(
+        (ORIENTATION_THUMBNAIL_SIZE, ORIENTATION_THUMBNAIL_SIZE),
+        Image.Resampling.BILINEAR,
+    )
+    gray = np.asarray(thumb, dtype=np.float32)
+    # Dark pixels noticeably below the page background are treated as ink
+    threshold = gray.mean() - gray.std() * 0.5
+    return gray < threshold
+
+
+def _row_profile_score(mask: np.ndarray) -> float:
+    """Variance of the normalized row profile; high when text lines run horizontally"""
+    rows = mask.sum(axis=1, dtype=np.float32)
+    if rows.size == 0 or rows.max() == 0:
+        return 0.0
+    rows /= rows.max()
+    return float(rows.var())
+
+
+def _line_asymmetry(mask: np.ndarray) -> float:
+    """
+    Compare ink in the ascender and descender zones of each text line.
+
+    The dense x-height core of a Latin text line has ascenders, capitals and
+    digits above it but only the rarer descenders below, so for an upright
+    page the zone above the core carries more ink than the zone below.
+    Returns a positive value for upright text and negative for upside-down.
+    """
+    rows = mask.sum(axis=1)
+    if rows.size == 0 or rows.max() == 0:
+        return 0.0
+
+    in_line = rows > rows.max() * 0.05
+    # Find the start and end of each run of text rows
+    edges = np.diff(in_line.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    score = 0.0
+    for start, end in zip(starts, ends):
+        if end - start < 4:
+            continue
+        band = rows[start:end].astype(np.float32)
+        core = np.flatnonzero(band >= band.max() * 0.5)
+        above = band[: core[0]].sum()
+        below = band[core[-1] + 1 :].sum()
+        total = band.sum()
+        if total:
+            score += (above - below) / total
+    return score
+
+
+def detect_rotation_projection(img: Union[Image.Image, np.ndarray]) -> int:
+    """
+    Estimate page rotation with a projection-profile heuristic.
+
+    Returns:
+        Clockwise rotation in degrees (0, 90, 180 or 270) that uprights the page
+    """
+    mask = _to_ink_mask(img)
+    if not mask.any():
+        return 0
+
+    # Text lines produce a strongly varying row profile when horizontal
+    sideways = _row_profile_score(mask.T) > _row_profile_score(mask)
+    if sideways:
+        # Rotating the mask 90 degrees clockwise gives the 90-degree candidate
+        candidate = np.rot90(mask, k=-1)
+        return 90 if _line_asymmetry(candidate) >= 0 else 270
+
+    return 0 if _line_asymmetry(mask) >= 0 else 180
+
+
+def detect_rotation_osd(img: Union[Image.Image, np.ndarray]) -> int:
+    """
+    Estimate page rotation with Tesseract orientation and script detection.
+
+    Returns:
+        Clockwise rotation in degrees (0, 90, 180 or 270) that uprights the page
+    """
+    import pytesseract
+
+    thumb = _to_gray_image(img)
+    thumb.thumbnail(
+        (ORIENTATION_THUMBNAIL_SIZE, ORIENTATION_THUMBNAIL_SIZE),
+        Image.Resampling.BILINEAR,
+    )
+    osd = pytesseract.image_to_osd(thumb, output_type=pytesseract.Output.DICT)
+    return int(osd.get("rotate", 0)) % 360
+
+
+def detect_page_rotation(
+    img: Union[Image.Image, np.ndarray], method: str = "projection"
+) -> int:
+    """
+    Detect page rotation using the given method.
+
+    Args:
+        img: PIL Image or numpy array of the page
+        method: 'projection', 'osd' or 'off'
+
+    Returns:
+        Clockwise rotation in degrees that uprights the page; 0 if detection fails
+    """
+    if method not in ORIENTATION_METHODS:
+        raise ValueError(f"Unknown page orientation method: {method}")
+    if method == "off":
+        return 0
+
+    try:
+        if method == "osd":
+            return detect_rotation_osd(img)
+        return detect_rotation_projection(img)
+    except Exception as e:
+        logging.warning("Page orientation detection failed: %s", str(e))
+        return 0
+
+
+def correct_page_orientation(
+    img: Union[Image.Image, np.ndarray], method: Optional[str] = "projection"
+) -> Union[Image.Image, np.ndarray]:
+    """Rotate the page upright once, returning the original image if no rotation is needed"""
+    if not method or method == "off":
+        return img
+
+    rotation = detect_page_rotation(img, method)
+    if rotation not in _TRANSPOSE_FOR_ROTATION:
+        return img
+
+    logging.info("Rotating page %d degrees clockwise (%s)", rotation, method)
+    if isinstance(img, np.ndarray):
+        # np.rot90 turns counter-clockwise for positive k
+        return np.ascontiguousarray(np.rot90(img, k=-(rotation // 90)))
+    return img.transpose(_TRANSPOSE_FOR_ROTATION[rotation])
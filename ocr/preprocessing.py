@@ -0,0 +1,461 @@
+"""
+Image Preprocessing Module
+
+Configurable OpenCV preprocessing shared by all OCR engines: resizing,
+single-channel grayscale, skew correction, light denoising and adaptive
+binarization. Steps work on numpy arrays, in place where OpenCV allows it.
+"""
+
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import cv2
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+PREPROCESSING_STEPS = ("grayscale", "deskew", "denoise", "binarize")
+
+# Default steps per engine. Tesseract binarizes internally and gains nothing
+# from three channels; the Paddle models expect 3-channel input.
+DEFAULT_PREPROCESSING = {
+    "Tesseract": ["grayscale"],
+    "PaddleOCR": [],
+    "PaddleTable": [],
+}
+
+# Resampling filters for downsizing pages to the engine's max size, by the
+# names used in OCR_CONFIG["RESAMPLE_FILTERS"]
+RESAMPLE_FILTERS = {
+    "nearest": Image.Resampling.NEAREST,
+    "bilinear": Image.Resampling.BILINEAR,
+    "bicubic": Image.Resampling.BICUBIC,
+    "lanczos": Image.Resampling.LANCZOS,
+    "box": Image.Resampling.BOX,
+    "hamming": Image.Resampling.HAMMING,
+}
+
+# Skew estimation settings
+SKEW_ESTIMATION_SIZE = 1000  # Longest side of the image used to estimate skew
+SKEW_MAX_ANGLE = 5.0  # Degrees searched either side of horizontal
+SKEW_COARSE_STEP = 0.5
+SKEW_FINE_STEP = 0.1
+SKEW_MIN_ANGLE = 0.2  # Smaller skews are left alone
+
+# Adaptive binarization settings
+BINARIZE_BLOCK_SIZE = 31
+BINARIZE_OFFSET = 15
+
+# Preprocessed pages shared between engines running on the same image within
+# one request, keyed by image and pipeline configuration, or None outside
+# shared_preprocessing()
+_shared_outputs: contextvars.ContextVar[Optional[Dict[tuple, Any]]] = (
+    contextvars.ContextVar("ocr_shared_preprocessing", default=None)
+)
+_shared_locks: Dict[tuple, threading.Lock] = {}
+_shared_locks_guard = threading.Lock()
+
+
+def resize_to_max(
+    img: Image.Image,
+    max_size: int,
+    resample: Image.Resampling = Image.Resampling.LANCZOS,
+) -> Image.Image:
+    """Resize image so its longest side is at most max_size, keeping aspect ratio"""
+    width, height = img.size
+    logging.info("Original image size: %dx%d", width, height)
+
+    if max(width, height) <= max_size:
+        return img
+
+    if width > height:
+        new_width = max_size
+        new_height = int(height * (max_size / width))
+    else:
+        new_height = max_size
+        new_width = int(width * (max_size / height))
+
+    resized_img = img.resize((new_width, new_height), resample)
+    logging.info("Resized image to: %dx%d", new_width, new_height)
+    return resized_img
+
+
+def _skew_score(xs: np.ndarray, ys: np.ndarray, angle: float, bins: int) -> float:
+    """Row-profile variance of ink pixels after rotating their coordinates"""
+    theta = np.deg2rad(angle)
+    rows = ys * np.cos(theta) - xs * np.sin(theta)
+    rows = (rows - rows.min()).astype(np.int32)
+    profile = np.bincount(rows, minlength=bins)
+    return float(profile.var())
+
+
+def estimate_skew_from_mask(ink: np.ndarray) -> float:
+    """
+    Estimate text skew from a boolean ink mask with a projection-profile search.
+
+    Ink pixel coordinates are rotated instead of the image, so each candidate
+    angle costs one vectorized pass over the ink pixels.
+
+    Returns:
+        Correction angle in degrees; rotating the page counter-clockwise by
+        this angle straightens the text lines
+    """
+    ys, xs = np.nonzero(ink)
+    if len(xs) < 100:
+        return 0.0
+    xs = xs.astype(np.float32)
+    ys = ys.astype(np.float32)
+    bins = int(np.hypot(*ink.shape[:2])) + 2
+
+    def best_angle(angles):
+        scores = [_skew_score(xs, ys, a, bins) for a in angles]
+        return float(angles[int(np.argmax(scores))])
+
+    coarse = best_angle(
+        np.arange(-SKEW_MAX_ANGLE, SKEW_MAX_ANGLE + 1e-6, SKEW_COARSE_STEP)
+    )
+    fine = best_angle(
+        np.arange(
+            coarse - SKEW_COARSE_STEP, coarse + SKEW_COARSE_STEP + 1e-6, SKEW_FINE_STEP
+        )
+    )
+    return fine
+
+
+def estimate_skew(gray: np.ndarray) -> float:
+    """Estimate text skew of a grayscale page on a small Otsu-binarized copy"""
+    scale = min(1.0, SKEW_ESTIMATION_SIZE / max(gray.shape[:2]))
+    small = (
+        cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        if scale < 1.0
+        else gray
+    )
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return estimate_skew_from_mask(ink)
+
+
+def deskew(arr: np.ndarray, angle: Optional[float] = None) -> np.ndarray:
+    """Rotate the page so text lines are horizontal, estimating the skew if not given"""
+    if angle is None:
+        gray = arr if arr.ndim == 2 else cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+        angle = estimate_skew(gray)
+    if abs(angle) < SKEW_MIN_ANGLE:
+        return arr
+
+    logging.info("Deskewing image by %.2f degrees", angle)
+    height, width = arr.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    border = 255 if arr.ndim == 2 else (255, 255, 255)
+    return cv2.warpAffine(
+        arr,
+        matrix,
+        (width, height),
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=border,
+    )
+
+
+def denoise(arr: np.ndarray) -> np.ndarray:
+    """Light median denoise to remove fax speckle, in place"""
+    return cv2.medianBlur(arr, 3, dst=arr)
+
+
+def binarize(arr: np.ndarray) -> np.ndarray:
+    """Adaptive (local Gaussian) binarization of a grayscale page, in place"""
+    if arr.ndim != 2:
+        arr = cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+    return cv2.adaptiveThreshold(
+        arr,
+        255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY,
+        BINARIZE_BLOCK_SIZE,
+        BINARIZE_OFFSET,
+        dst=arr,
+    )
+
+
+# Packed bilevel (PIL mode "1") pages: 8 pixels per byte, most significant bit
+# first, 1 = white and 0 = ink.
+
+
+def _build_halve_lut() -> np.ndarray:
+    """Map a byte of 8 pixels to a nibble of 4 pixels, each the AND of a pair"""
+    lut = np.zeros(256, dtype=np.uint8)
+    for value in range(256):
+        nibble = 0
+        for i in range(4):
+            pair = (value >> (6 - 2 * i)) & 0b11
+            # A pixel stays white only if both source pixels are white
+            nibble = (nibble << 1) | (1 if pair == 0b11 else 0)
+        lut[value] = nibble
+    return lut
+
+
+_HALVE_LUT = _build_halve_lut()
+_POPCOUNT_LUT = np.array([bin(v).count("1") for v in range(256)], dtype=np.uint8)
+
+BLANK_INK_RATIO = 0.001  # Pages with less ink than this are treated as blank
+
+
+def _pack_bilevel(img: Image.Image) -> np.ndarray:
+    """Get the packed bitplane of a mode '1' image with row padding set to white"""
+    width, height = img.size
+    packed = np.frombuffer(img.tobytes(), dtype=np.uint8).reshape(
+        height, (width + 7) // 8
+    )
+    padding = packed.shape[1] * 8 - width
+    if padding:
+        packed = packed.copy()
+        packed[:, -1] |= (1 << padding) - 1
+    return packed
+
+
+def _halve_packed(packed: np.ndarray, width: int):
+    """
+    Downsample a packed bitplane by 2 in both directions without unpacking.
+
+    A destination pixel is ink if any of its 2x2 source pixels is ink, which
+    keeps thin fax strokes intact.
+
+    Returns:
+        (packed, width) of the halved bitplane
+    """
+    if packed.shape[0] % 2:
+        packed = np.vstack([packed, np.full((1, packed.shape[1]), 0xFF, np.uint8)])
+    rows = packed[0::2] & packed[1::2]
+
+    if rows.shape[1] % 2:
+        rows = np.hstack([rows, np.full((rows.shape[0], 1), 0xFF, np.uint8)])
+    nibbles = _HALVE_LUT[rows]
+    halved = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+
+    new_width = (width + 1) // 2
+    padding = halved.shape[1] * 8 - new_width
+    if padding:
+        halved[:, -1] |= (1 << padding) - 1
+    return halved, new_width
+
+
+def _unpack_bilevel(packed: np.ndarray, width: int) -> np.ndarray:
+    """Expand a packed bitplane to a uint8 grayscale array (0 = ink, 255 = white)"""
+    bits = np.unpackbits(packed, axis=1, count=width)
+    return bits * np.uint8(255)
+
+
+def is_blank_page(img: Any) -> bool:
+    """
+    Cheap blank-page check for bilevel input, counting ink on the packed bitplane.
+
+    Returns False for other image modes, which are not checked.
+    """
+    if not isinstance(img, Image.Image) or img.mode != "1":
+        return False
+    packed = _pack_bilevel(img)
+    white = int(_POPCOUNT_LUT[packed].sum(dtype=np.int64))
+    total = packed.size * 8
+    ink_ratio = (total - white) / total
+    if ink_ratio < BLANK_INK_RATIO:
+        logging.info("Blank bilevel page detected (ink ratio %.5f)", ink_ratio)
+        return True
+    return False
+
+
+_STEP_FUNCTIONS = {
+    "deskew": deskew,
+    "denoise": denoise,
+    "binarize": binarize,
+}
+
+
+class PreprocessingPipeline:
+    """Ordered preprocessing steps for one engine.
+
+    The image is converted once (to grayscale when the 'grayscale' step is
+    configured, otherwise RGB), resized, and then passed through the ndarray
+    steps. When the engine needs 3-channel input, grayscale output is
+    expanded only at the very end.
+
+    Bilevel (1-bit) pages such as Group 4 fax TIFFs stay packed through
+    downsampling and skew estimation and are only expanded at the target
+    size, or not at all for engines that accept bilevel input.
+    """
+
+    def __init__(
+        self,
+        steps: Sequence[str] = (),
+        output_channels: int = 3,
+        accepts_bilevel: bool = False,
+    ):
+        unknown = set(steps) - set(PREPROCESSING_STEPS)
+        if unknown:
+            raise ValueError(
+                f"Unknown preprocessing steps: {', '.join(sorted(unknown))}"
+            )
+        self.steps = list(steps)
+        self.output_channels = output_channels
+        # Engines that read 1-bit input (Tesseract) get bilevel pages as-is
+        self.accepts_bilevel = accepts_bilevel
+        # Binarization works on a single channel, so it implies grayscale
+        self.grayscale = "grayscale" in self.steps or "binarize" in self.steps
+
+    def run(
+        self,
+        img: Image.Image,
+        max_size: int,
+        resample: Image.Resampling = Image.Resampling.LANCZOS,
+    ) -> Union[np.ndarray, Image.Image]:
+        """Convert, resize and run the configured steps, returning a uint8 array (or a 1-bit image for bilevel-capable engines)"""
+        shared = _shared_outputs.get()
+        if shared is None:
+            return self._run(img, max_size, resample)
+
+        # Engines with the same configuration reuse one preprocessed page;
+        # concurrent callers wait for the first to finish instead of redoing it
+        key = (
+            id(img),
+            tuple(self.steps),
+            self.output_channels,
+            self.accepts_bilevel,
+            max_size,
+            resample,
+        )
+        with _shared_locks_guard:
+            lock = _shared_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in shared:
+                shared[key] = self._run(img, max_size, resample)
+            return shared[key]
+
+    def _run(
+        self,
+        img: Image.Image,
+        max_size: int,
+        resample: Image.Resampling,
+    ) -> Union[np.ndarray, Image.Image]:
+        if img.mode == "1":
+            return self._run_bilevel(img, max_size)
+
+        target_mode = "L" if self.grayscale else "RGB"
+        if img.mode != target_mode:
+            img = img.convert(target_mode)
+
+        img = resize_to_max(img, max_size, resample)
+        # Writable copy so the steps below can work in place
+        arr = np.array(img)
+
+        for step in self.steps:
+            if step in _STEP_FUNCTIONS:
+                arr = _STEP_FUNCTIONS[step](arr)
+
+        if arr.ndim == 2 and self.output_channels == 3:
+            arr = cv2.cvtColor(arr, cv2.COLOR_GRAY2RGB)
+        return arr
+
+    def _run_bilevel(self, img: Image.Image, max_size: int):
+        """Process a 1-bit page, keeping it packed for as long as possible"""
+        width, height = img.size
+        logging.info("Original bilevel image size: %dx%d", width, height)
+
+        packed = _pack_bilevel(img)
+        # Power-of-two downsampling directly on the packed bits
+        while max(packed.shape[0], width) // 2 >= max_size:
+            packed, width = _halve_packed(packed, width)
+
+        skew_angle = None
+        if "deskew" in self.steps:
+            # Estimate skew on a small copy of the bitplane
+            small, small_width = packed, width
+            while max(small.shape[0], small_width) > SKEW_ESTIMATION_SIZE:
+                small, small_width = _halve_packed(small, small_width)
+            skew_angle = estimate_skew_from_mask(
+                np.unpackbits(small, axis=1, count=small_width) == 0
+            )
+
+        needs_resize = max(packed.shape[0], width) > max_size
+        needs_rotation = skew_angle is not None and abs(skew_angle) >= SKEW_MIN_ANGLE
+        if (
+            self.accepts_bilevel
+            and not needs_resize
+            and not needs_rotation
+            and "denoise" not in self.steps
+        ):
+            # Hand the packed bits straight to the engine
+            logging.info("Passing bilevel image at %dx%d", width, packed.shape[0])
+            return Image.frombytes("1", (width, packed.shape[0]), packed.tobytes())
+
+        # Expand to 8-bit only now, at (close to) the target size
+        arr = _unpack_bilevel(packed, width)
+        if needs_resize:
+            scale = max_size / max(arr.shape[:2])
+            arr = cv2.resize(
+                arr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+        logging.info("Bilevel image expanded at %dx%d", arr.shape[1], arr.shape[0])
+
+        for step in self.steps:
+            if step == "deskew":
+                arr = deskew(arr, skew_angle)
+            elif step == "denoise":
+                arr = denoise(arr)
+
+        if self.accepts_bilevel:
+            return Image.fromarray(arr >= 128)
+        if self.output_channels == 3:
+            arr = cv2.cvtColor(arr, cv2.COLOR_GRAY2RGB)
+        return arr
+
+
+@contextmanager
+def shared_preprocessing():
+    """Share preprocessed pages between engines run on the same image in this block.
+
+    Engines running in worker threads see the block when they are started
+    with a copy of the caller's context.
+    """
+    token = _shared_outputs.set({})
+    try:
+        yield
+    finally:
+        keys = list(_shared_outputs.get())
+        _shared_outputs.reset(token)
+        with _shared_locks_guard:
+            for key in keys:
+                _shared_locks.pop(key, None)
+
+
+def get_preprocessing_steps(engine_name: str) -> List[str]:
+    """Get the configured preprocessing steps for an engine"""
+    configured: Dict[str, List[str]] = getattr(settings, "OCR_CONFIG", {}).get(
+        "PREPROCESSING", {}
+    )
+    return list(configured.get(engine_name, DEFAULT_PREPROCESSING.get(engine_name, [])))
+
+
+def get_resample_filter(engine_name: str) -> Image.Resampling:
+    """Get the configured resampling filter for an engine (Lanczos by default)"""
+    configured: Dict[str, str] = getattr(settings, "OCR_CONFIG", {}).get(
+        "RESAMPLE_FILTERS", {}
+    )
+    name = configured.get(engine_name, "lanczos")
+    if name not in RESAMPLE_FILTERS:
+        raise ValueError(f"Unknown resample filter: {name}")
+    return RESAMPLE_FILTERS[name]
+
+
+def get_preprocessing_pipeline(
+    engine_name: str,
+    output_channels: int = 3,
+    steps: Optional[Sequence[str]] = None,
+    accepts_bilevel: bool = False,
+) -> PreprocessingPipeline:
+    """Build the preprocessing pipeline configured for an engine"""
+    if steps is None:
+        steps = get_preprocessing_steps(engine_name)
+    return PreprocessingPipeline(
+        steps, output_channels=output_channels, accepts_bilevel=accepts_bilevel
+    )
@@ -0,0 +1,232 @@
+"""
+Request Profiling Module
+
+Per-request stage timings (reported as Server-Timing headers) and opt-in
+profiling of a single request with a sampling profiler and tracemalloc.
+"""
+
+import contextvars
+import hmac
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+
+TRACEMALLOC_TOP_N = 25
+
+# Stage durations in milliseconds for the request being served, or None
+# outside a request
+_stage_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = (
+    contextvars.ContextVar("ocr_stage_timings", default=None)
+)
+
+
+def start_request_timings() -> contextvars.Token:
+    """Start collecting stage timings for the current request"""
+    return _stage_timings.set({})
+
+
+def finish_request_timings(token: contextvars.Token) -> Dict[str, float]:
+    """Stop collecting stage timings and return what was recorded"""
+    timings = _stage_timings.get() or {}
+    _stage_timings.reset(token)
+    return timings
+
+
+# Optional callback notified as stages start (duration None) and finish, used
+# to stream progress out of engine execution slots
+_stage_listener: contextvars.ContextVar[
+    Optional[Callable[[str, Optional[float]], None]]
+] = contextvars.ContextVar("ocr_stage_listener", default=None)
+
+
+def set_stage_listener(
+    listener: Optional[Callable[[str, Optional[float]], None]],
+) -> contextvars.Token:
+    """Install a callback receiving (stage, duration_ms or None when starting)"""
+    return _stage_listener.set(listener)
+
+
+def get_request_timings() -> Dict[str, float]:
+    """Copy of the stage timings recorded so far for the current request"""
+    return dict(_stage_timings.get() or {})
+
+
+def record_stage(name: str, duration_ms: float) -> None:
+    """Add a stage duration to the current request, if one is being timed"""
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + duration_ms
+    listener = _stage_listener.get()
+    if listener is not None:
+        listener(name, duration_ms)
+
+
+@contextmanager
+def stage_timer(name: str):
+    """Time a processing stage (decode, preprocess, predict, postprocess, ...)"""
+    listener = _stage_listener.get()
+    if listener is not None:
+        listener(name, None)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, (time.perf_counter() - start) * 1000)
+
+
+def run_with_stage_prefix(prefix: str, fn: Callable, *args) -> Any:
+    """
+    Run fn recording its stage timings as "<prefix>-<stage>".
+
+    Used for engines running concurrently in one request, so their stages
+    are reported separately instead of being summed together.
+    """
+    parent = _stage_timings.get()
+    if parent is None:
+        return fn(*args)
+
+    token = _stage_timings.set({})
+    try:
+        return fn(*args)
+    finally:
+        timings = _stage_timings.get()
+        _stage_timings.reset(token)
+        for name, duration in timings.items():
+            key = f"{prefix}-{name}"
+            parent[key] = parent.get(key, 0.0) + duration
+
+
+# Id of the profile being recorded for the current request, or None; calls
+# into execution slots pass it on so the slot profiles them as well
+_active_profile_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "ocr_active_profile_id", default=None
+)
+
+
+def get_active_profile_id() -> Optional[str]:
+    """Profile id of the current request if it is being profiled"""
+    return _active_profile_id.get()
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """Format stage timings as a Server-Timing header value"""
+    return ", ".join(f"{name};dur={duration:.1f}" for name, duration in timings.items())
+
+
+def _get_profiling_config() -> dict:
+    config = getattr(settings, "OCR_CONFIG", {})
+    return {
+        "token": config.get("PROFILING_TOKEN"),
+        "dir": config.get("PROFILING_DIR", os.path.join(settings.BASE_DIR, "profiles")),
+    }
+
+
+def is_profiling_authorized(header_value: Optional[str]) -> bool:
+    """Check the profiling request header against the configured token"""
+    token = _get_profiling_config()["token"]
+    if not token or not header_value:
+        return False
+    return hmac.compare_digest(header_value.encode(), token.encode())
+
+
+# tracemalloc is process-global: concurrently profiled requests share it, and
+# it is stopped when the last of them finishes (unless it was already on)
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False
+
+
+def _acquire_tracemalloc() -> None:
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def _release_tracemalloc() -> None:
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+class RequestProfiler:
+    """Profile a single request with a sampling profiler and tracemalloc.
+
+    Uses pyinstrument (see requirements.txt) and falls back to cProfile,
+    whose overhead skews timings, when it is missing. The profile and the
+    top allocations are written to the configured PROFILING_DIR.
+    """
+
+    def __init__(self, label: str = "request", profile_id: Optional[str] = None):
+        self.profile_id = (
+            profile_id or f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        )
+        self.label = label
+        self.output_dir = _get_profiling_config()["dir"]
+        self._profiler = None
+        self._sampling = False
+        self._active_token = None
+
+    def start(self) -> None:
+        try:
+            from pyinstrument import Profiler
+
+            self._profiler = Profiler()
+            self._sampling = True
+        except ImportError:
+            import cProfile
+
+            logging.warning(
+                "pyinstrument not installed, profiling with cProfile; "
+                "timings include its overhead"
+            )
+            self._profiler = cProfile.Profile()
+            self._sampling = False
+
+        _acquire_tracemalloc()
+        self._active_token = _active_profile_id.set(self.profile_id)
+        if self._sampling:
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self) -> str:
+        """Stop profiling, write the results and return the profile id"""
+        try:
+            if self._sampling:
+                self._profiler.stop()
+            else:
+                self._profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            _active_profile_id.reset(self._active_token)
+            _release_tracemalloc()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base_path = os.path.join(self.output_dir, self.profile_id)
+
+        if self._sampling:
+            with open(f"{base_path}.html", "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+        else:
+            self._profiler.dump_stats(f"{base_path}.prof")
+
+        with open(f"{base_path}.tracemalloc.txt", "w", encoding="utf-8") as f:
+            f.write(f"# {self.label}\n")
+            for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP_N]:
+                f.write(f"{stat}\n")
+
+        logging.info("Saved request profile %s to %s", self.profile_id, self.output_dir)
+        return self.profile_id
@@ -0,0 +1,646 @@
+"""
+Consistent-Hash Request Router
+
+Sends /ocr/ requests to pools of engine-specialized nodes. Each pool serves
+a set of engines and languages (nodes load only those, see
+OCR_NODE_ENGINES). Within a pool, nodes sit on a consistent-hash ring and
+a request goes to the node owning its image digest, so the same page always
+lands on the same node and that node's per-process caches (near-duplicate
+index, warm engines) stay hot. Incremental requests with a patient_id route
+by the patient instead, so an amended page reaches the node holding the
+tiles of its earlier version. Adding or removing a node moves only the keys
+it owns.
+
+A chunked upload is spooled on the node that started it, so all of its
+requests must reach that node. At the start the router picks the upload id
+itself: one that the any-node ring places on a node of the pool serving the
+upload's declared model and language. It passes the id to the node in the
+X-OCR-Upload-Id header. Chunks and the commit then route by that id on the
+same ring.
+
+Nodes are health-checked in the background (GET /ocr/health/) and marked
+down after consecutive failures, whether found by the check or by a failed
+request. A request whose node is down or refuses the connection fails over
+to the next node clockwise on the ring, which is where its key would move if
+the node were removed.
+
+The router uses only the standard library and never imports Django or the
+engines:
+
+    python -m ocr.routing --listen 0.0.0.0:8080 \\
+        --pool "PaddleOCR,PaddleTable,PaddleCombined:en=http://10.0.0.1:8000,http://10.0.0.2:8000" \\
+        --pool "Tesseract=http://10.0.0.3:8000"
+"""
+
+import argparse
+import bisect
+import hashlib
+import http.client
+import json
+import logging
+import re
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# Points per node on the ring; more points even out the key shares
+RING_REPLICAS = 128
+
+# Request field defaults, as in OCRImageSerializer
+DEFAULT_MODEL = "Tesseract"
+
+# Headers that apply to one connection and are not forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+
+_UPLOAD_PATH = re.compile(r"^/ocr/uploads/([0-9a-fA-F-]+)/")
+_DISPOSITION_PARAM = re.compile(rb'\b(name|filename)="([^"]*)"')
+
+# Upload id chosen by the router for an upload it starts (see UploadStartView)
+UPLOAD_ID_HEADER = "X-OCR-Upload-Id"
+# Random ids tried before giving up on placing an upload in its pool
+UPLOAD_ID_ATTEMPTS = 1000
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring of node URLs"""
+
+    def __init__(self, nodes: Sequence[str], replicas: int = RING_REPLICAS):
+        self.nodes = list(dict.fromkeys(nodes))
+        points = sorted(
+            (_hash(f"{node}#{i}".encode()), node)
+            for node in self.nodes
+            for i in range(replicas)
+        )
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def nodes_for(self, key: bytes) -> Iterator[str]:
+        """Every node once, starting with the key's owner and going clockwise"""
+        if not self._keys:
+            return
+        start = bisect.bisect(self._keys, _hash(key))
+        seen = set()
+        for i in range(len(self._keys)):
+            node = self._owners[(start + i) % len(self._keys)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+
+class Pool:
+    """Nodes serving a set of engines (None: any) for a set of languages (None: any)"""
+
+    def __init__(
+        self,
+        nodes: Sequence[str],
+        engines: Optional[Set[str]] = None,
+        langs: Optional[Set[str]] = None,
+    ):
+        self.engines = engines
+        self.langs = langs
+        self.ring = HashRing(nodes)
+        # Names match case-insensitively, like the API's engine names
+        self._engine_keys = {e.lower() for e in engines} if engines else None
+        self._lang_keys = {lang.lower() for lang in langs} if langs else None
+
+    @classmethod
+    def parse(cls, spec: str) -> "Pool":
+        """'PaddleOCR,PaddleTable:en,es=http://a:8000,http://b:8000'; '*' matches all"""
+        selector, _, urls = spec.partition("=")
+        engines, _, langs = selector.partition(":")
+        nodes = [url.strip().rstrip("/") for url in urls.split(",") if url.strip()]
+        if not nodes:
+            raise ValueError(f"Pool has no nodes: {spec}")
+        for node in nodes:
+            if urlsplit(node).scheme not in ("http", "https"):
+                raise ValueError(
+                    f"Node URL must start with http:// or https://: {node}"
+                )
+
+        def names(value):
+            value = value.strip()
+            if value in ("", "*"):
+                return None
+            return {name.strip() for name in value.split(",") if name.strip()}
+
+        return cls(nodes, names(engines), names(langs))
+
+    def serves(self, engines: Sequence[str], lang: Optional[str]) -> bool:
+        if self._engine_keys is not None and not all(
+            engine.lower() in self._engine_keys for engine in engines
+        ):
+            return False
+        if (
+            self._lang_keys is not None
+            and lang is not None
+            and lang.lower() not in self._lang_keys
+        ):
+            return False
+        return True
+
+    def describe(self) -> str:
+        engines = ",".join(sorted(self.engines)) if self.engines else "*"
+        langs = ",".join(sorted(self.langs)) if self.langs else "*"
+        return f"{engines}:{langs}"
+
+
+class NodeState:
+    """Health and traffic counters of one node"""
+
+    def __init__(self):
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.last_check: Optional[float] = None
+        self.engines: Optional[List[str]] = None
+        # Engines of the node's pools missing from its health response
+        self.missing_engines: List[str] = []
+        self.requests = 0
+        self.errors = 0
+
+
+def parse_form(content_type: str, body: bytes) -> Tuple[Dict[str, List[str]], bytes]:
+    """Text fields and the image bytes of a multipart, JSON or urlencoded body"""
+    fields: Dict[str, List[str]] = {}
+    image = b""
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type == "multipart/form-data":
+        match = re.search(r'boundary="?([^";]+)"?', content_type)
+        if not match:
+            return fields, image
+        delimiter = b"--" + match.group(1).encode("latin-1")
+        for part in body.split(delimiter)[1:]:
+            if part.startswith(b"--"):
+                break
+            headers, _, content = part.partition(b"\r\n\r\n")
+            if content.endswith(b"\r\n"):
+                content = content[:-2]
+            params = dict(_DISPOSITION_PARAM.findall(headers))
+            name = params.get(b"name", b"").decode("utf-8", "replace")
+            if b"filename" in params:
+                if name == "image":
+                    image = content
+            elif name:
+                fields.setdefault(name, []).append(content.decode("utf-8", "replace"))
+    elif media_type == "application/json":
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            data = {}
+        if isinstance(data, dict):
+            for name, value in data.items():
+                values = value if isinstance(value, list) else [value]
+                fields[name] = [str(v) for v in values]
+    elif media_type == "application/x-www-form-urlencoded":
+        fields = parse_qs(body.decode("utf-8", "replace"))
+    return fields, image
+
+
+def requested_engines(fields: Dict[str, List[str]]) -> List[str]:
+    """Engines a request runs: its models (repeated or comma-separated), else its model"""
+    names = []
+    for item in fields.get("models", []):
+        names.extend(name.strip() for name in item.split(",") if name.strip())
+    if not names:
+        names = [(fields.get("model") or [DEFAULT_MODEL])[0]]
+    return list(dict.fromkeys(names))
+
+
+class NoNodeAvailable(Exception):
+    """No pool serves the request, or none of its nodes answered"""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class Router:
+    """Chooses and calls the node for each request, tracking node health"""
+
+    def __init__(
+        self,
+        pools: Sequence[Pool],
+        request_timeout: float = 300.0,
+        connect_timeout: float = 2.0,
+        health_interval: float = 2.0,
+        failure_threshold: int = 2,
+        max_attempts: int = 3,
+    ):
+        if not pools:
+            raise ValueError("At least one pool is required")
+        self.pools = list(pools)
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self.health_interval = health_interval
+        self.failure_threshold = failure_threshold
+        self.max_attempts = max_attempts
+        nodes = [node for pool in self.pools for node in pool.ring.nodes]
+        # Requests other than OCR (search, uploads, metrics) may go to any node
+        self.any_node = HashRing(nodes)
+        self.nodes: Dict[str, NodeState] = {node: NodeState() for node in nodes}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._checker: Optional[threading.Thread] = None
+        self.requests = 0
+        self.failovers = 0
+        self.unavailable = 0
+
+    # Health
+
+    def start(self) -> None:
+        self.check_health()
+        self._checker = threading.Thread(
+            target=self._check_loop, name="ocr-router-health", daemon=True
+        )
+        self._checker.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _check_loop(self) -> None:
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def check_health(self) -> None:
+        """Probe every node's /ocr/health/ concurrently"""
+        threads = [
+            threading.Thread(target=self._check_node, args=(node,), daemon=True)
+            for node in self.nodes
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _check_node(self, node: str) -> None:
+        try:
+            status, _, body = self._send(
+                node, "GET", "/ocr/health/", {}, b"", self.connect_timeout
+            )
+            if status != 200:
+                raise OSError(f"health check returned {status}")
+            engines = json.loads(body).get("engines")
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            self.mark_failure(node, f"health check: {e}")
+            return
+        missing = self._missing_engines(node, engines or [])
+        with self._lock:
+            state = self.nodes[node]
+            state.last_check = time.time()
+            state.engines = engines
+            if missing and missing != state.missing_engines:
+                # The node answers, so it stays up; requests for these engines
+                # get its 400
+                logging.warning(
+                    "Node %s does not serve %s (check OCR_NODE_ENGINES)",
+                    node,
+                    ", ".join(missing),
+                )
+            state.missing_engines = missing
+        self.mark_success(node)
+
+    def _missing_engines(self, node: str, served: List[str]) -> List[str]:
+        """Engines of the node's pools that the node does not load"""
+        served = {engine.lower() for engine in served}
+        expected = set()
+        for pool in self.pools:
+            if node in pool.ring.nodes and pool.engines:
+                expected |= pool.engines
+        return sorted(engine for engine in expected if engine.lower() not in served)
+
+    def mark_failure(self, node: str, error: str) -> None:
+        with self._lock:
+            state = self.nodes[node]
+            state.consecutive_failures += 1
+            state.last_error = error
+            if state.healthy and state.consecutive_failures >= self.failure_threshold:
+                state.healthy = False
+                logging.warning("Node %s marked down: %s", node, error)
+
+    def mark_success(self, node: str) -> None:
+        with self._lock:
+            state = self.nodes[node]
+            state.consecutive_failures = 0
+            if not state.healthy:
+                state.healthy = True
+                logging.info("Node %s is back up", node)
+
+    # Routing
+
+    def select_pool(self, engines: Sequence[str], lang: Optional[str]) -> Pool:
+        for pool in self.pools:
+            if pool.serves(engines, lang):
+                return pool
+        language = f"language '{lang}'" if lang else "the default language"
+        raise NoNodeAvailable(
+            f"No node pool serves {', '.join(engines)} for {language}", 400
+        )
+
+    def candidates(self, ring: HashRing, key: bytes) -> List[str]:
+        """Nodes to try in order: healthy ones in ring order, then the rest"""
+        nodes = list(ring.nodes_for(key))
+        with self._lock:
+            healthy = [node for node in nodes if self.nodes[node].healthy]
+        down = [node for node in nodes if node not in healthy]
+        return (healthy + down)[: self.max_attempts]
+
+    def upload_id_for(self, pool: Pool) -> str:
+        """A new upload id whose node on the any-node ring belongs to pool"""
+        with self._lock:
+            healthy = any(self.nodes[node].healthy for node in pool.ring.nodes)
+        # With the whole pool down, ids would only hash to healthy nodes
+        # outside it
+        if healthy:
+            for _ in range(UPLOAD_ID_ATTEMPTS):
+                upload_id = str(uuid.uuid4())
+                node = self.candidates(self.any_node, upload_id.encode())[0]
+                if node in pool.ring.nodes:
+                    return upload_id
+        raise NoNodeAvailable(f"No node of pool {pool.describe()} is up", 503)
+
+    def route(self, method: str, path: str, content_type: str, body: bytes):
+        """(hash ring, key, description) for a request"""
+        route_path = urlsplit(path).path
+        if method == "POST" and route_path.rstrip("/") == "/ocr/uploads":
+            # The upload is pinned to a node serving the model it declares
+            fields, _ = parse_form(content_type, body)
+            lang = (fields.get("lang") or [None])[0]
+            pool = self.select_pool(requested_engines(fields), lang)
+            return self.any_node, self.upload_id_for(pool).encode(), pool.describe()
+        upload = _UPLOAD_PATH.match(route_path)
+        if upload:
+            # Chunks and commit follow the upload to its node
+            return self.any_node, upload.group(1).encode(), "*"
+        if method == "POST" and route_path.rstrip("/") == "/ocr":
+            fields, image = parse_form(content_type, body)
+            engines = requested_engines(fields)
+            lang = (fields.get("lang") or [None])[0]
+            pool = self.select_pool(engines, lang)
+            patient_id = (fields.get("patient_id") or [""])[0]
+            incremental = (fields.get("incremental") or [""])[0].lower()
+            if patient_id and incremental in ("true", "1"):
+                # Re-issues of a patient's report reach the node caching
+                # the earlier version's tiles
+                key = b"patient:" + patient_id.encode()
+            else:
+                # Pages route by content
+                key = image or body
+            return pool.ring, key, pool.describe()
+        return self.any_node, route_path.encode(), "*"
+
+    def handle(
+        self, method: str, path: str, headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, List[Tuple[str, str]], bytes, str]:
+        """Forward a request, failing over along the ring. Returns (status, headers, body, node)."""
+        ring, key, pool = self.route(
+            method, path, headers.get("Content-Type", ""), body
+        )
+        if method == "POST" and urlsplit(path).path.rstrip("/") == "/ocr/uploads":
+            headers = {**headers, UPLOAD_ID_HEADER: key.decode()}
+        with self._lock:
+            self.requests += 1
+        errors = []
+        candidates = self.candidates(ring, key)
+        for attempt, node in enumerate(candidates):
+            if attempt:
+                with self._lock:
+                    self.failovers += 1
+                logging.info("Failing over %s %s to %s", method, path, node)
+            try:
+                status, response_headers, response_body = self._send(
+                    node, method, path, headers, body, self.request_timeout
+                )
+            except socket.timeout:
+                # The node may still be working on it; retrying would run the
+                # page twice
+                self._count(node, error=True)
+                raise NoNodeAvailable(
+                    f"{node} did not answer within {self.request_timeout:.0f}s", 504
+                )
+            except (OSError, http.client.HTTPException) as e:
+                # Refused, unreachable or dropped: the next node can take it
+                self._count(node, error=True)
+                self.mark_failure(node, str(e))
+                errors.append(f"{node}: {e}")
+                continue
+            self._count(node, error=status >= 500)
+            # A node still loading its engines can hand the page on
+            if status == 503 and attempt + 1 < len(candidates):
+                errors.append(f"{node}: 503")
+                continue
+            return status, response_headers, response_body, node
+        with self._lock:
+            self.unavailable += 1
+        raise NoNodeAvailable(
+            f"No node of pool {pool} answered ({'; '.join(errors) or 'no nodes'})",
+            502,
+        )
+
+    def _count(self, node: str, error: bool) -> None:
+        with self._lock:
+            self.nodes[node].requests += 1
+            if error:
+                self.nodes[node].errors += 1
+
+    def _send(
+        self,
+        node: str,
+        method: str,
+        path: str,
+        headers: Dict[str, str],
+        body: bytes,
+        timeout: float,
+    ) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        url = urlsplit(node)
+        connection_class = (
+            http.client.HTTPSConnection
+            if url.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        connection = connection_class(
+            url.hostname, url.port, timeout=self.connect_timeout
+        )
+        try:
+            try:
+                connection.connect()
+            except OSError as e:
+                # Connect timeouts included: the node never saw the request
+                raise ConnectionError(f"connect failed: {e}") from e
+            connection.sock.settimeout(timeout)
+            forwarded = {
+                name: value
+                for name, value in headers.items()
+                if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != "host"
+            }
+            forwarded["Content-Length"] = str(len(body))
+            connection.request(method, path, body=body, headers=forwarded)
+            response = connection.getresponse()
+            response_headers = [
+                (name, value)
+                for name, value in response.getheaders()
+                if name.lower() not in HOP_BY_HOP_HEADERS
+                # Set by the router's own response
+                and name.lower() not in ("content-length", "server", "date")
+            ]
+            return response.status, response_headers, response.read()
+        finally:
+            connection.close()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "failovers": self.failovers,
+                "unavailable": self.unavailable,
+                "pools": [
+                    {"serves": pool.describe(), "nodes": pool.ring.nodes}
+                    for pool in self.pools
+                ],
+                "nodes": {
+                    node: {
+                        "healthy": state.healthy,
+                        "consecutive_failures": state.consecutive_failures,
+                        "last_error": state.last_error,
+                        "last_check": state.last_check,
+                        "engines": state.engines,
+                        "missing_engines": state.missing_engines,
+                        "requests": state.requests,
+                        "errors": state.errors,
+                    }
+                    for node, state in self.nodes.items()
+                },
+            }
+
+
+class RouterHandler(BaseHTTPRequestHandler):
+    router: Router
+    protocol_version = "HTTP/1.1"
+
+    def _proxy(self) -> None:
+        if urlsplit(self.path).path.rstrip("/") == "/router/status":
+            self._reply(200, [], json.dumps(self.router.status()).encode())
+            return
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            # The unread body cannot be skipped, so the connection is closed
+            self.close_connection = True
+            self._reply(411, [], b'{"error": "Content-Length is required"}')
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        headers = dict(self.headers.items())
+        headers["X-Forwarded-For"] = self.client_address[0]
+        try:
+            status, response_headers, response_body, node = self.router.handle(
+                self.command, self.path, headers, body
+            )
+        except NoNodeAvailable as e:
+            self._reply(
+                e.status,
+                [],
+                json.dumps({"error": str(e), "status": "unavailable"}).encode(),
+            )
+            return
+        self._reply(status, response_headers + [("X-OCR-Node", node)], response_body)
+
+    def _reply(self, status: int, headers: List[Tuple[str, str]], body: bytes) -> None:
+        self.send_response(status)
+        if not any(name.lower() == "content-type" for name, _ in headers):
+            headers = headers + [("Content-Type", "application/json")]
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = do_HEAD = _proxy
+
+    def log_message(self, format, *args):
+        logging.info("%s %s", self.address_string(), format % args)
+
+
+def serve(router: Router, host: str, port: int) -> ThreadingHTTPServer:
+    """Start the router's health checks and HTTP server (call serve_forever on it)"""
+    handler = type("Handler", (RouterHandler,), {"router": router})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    router.start()
+    return server
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Route /ocr/ requests to engine-specialized node pools"
+    )
+    parser.add_argument(
+        "--listen", default="0.0.0.0:8080", help="host:port to listen on"
+    )
+    parser.add_argument(
+        "--pool",
+        action="append",
+        required=True,
+        help="ENGINES[:LANGS]=URL[,URL...], e.g. 'PaddleOCR,PaddleTable:en=http://a:8000'; "
+        "'*' matches any engine or language. The first matching pool is used.",
+    )
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--health-interval", type=float, default=2.0)
+    parser.add_argument(
+        "--failure-threshold",
+        type=int,
+        default=2,
+        help="Consecutive failures before a node is marked down",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="Nodes tried per request, along the ring",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    try:
+        pools = [Pool.parse(spec) for spec in args.pool]
+    except ValueError as e:
+        parser.error(str(e))
+    router = Router(
+        pools,
+        request_timeout=args.request_timeout,
+        health_interval=args.health_interval,
+        failure_threshold=args.failure_threshold,
+        max_attempts=args.max_attempts,
+    )
+    host, _, port = args.listen.rpartition(":")
+    server = serve(router, host or "0.0.0.0", int(port))
+    for pool in pools:
+        logging.info("Pool %s: %s", pool.describe(), ", ".join(pool.ring.nodes))
+    logging.info("Router listening on %s", args.listen)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        router.stop()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Stored OCR Results and Full-Text Search
+
+Successful OCR results are saved as OCRResult rows, with the cell text of
+recognized tables alongside the page text. Search runs in the database:
+PostgreSQL matches a GIN-indexed tsvector with websearch_to_tsquery, SQLite
+(development) an FTS5 table. Other databases fall back to a substring scan.
+
+Pages are returned newest first and paginated by keyset: the cursor holds
+the (created_at, id) of the last row returned, so every page is an index
+range scan however deep the caller pages.
+
+Results are patient report text: storage is opt-in (RESULT_STORE_ENABLED),
+rows older than RESULT_RETENTION_DAYS are purged, and the search view is
+restricted to staff users.
+"""
+
+import base64
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import OCRResult
+
+MAX_PAGE_SIZE = 100
+
+# Expired results are purged at most this often per process
+PURGE_INTERVAL_SECONDS = 3600
+
+_last_purge = 0.0
+_purge_lock = threading.Lock()
+
+
+class InvalidCursor(ValueError):
+    """A search cursor that was not issued by search_results"""
+
+
+def is_enabled() -> bool:
+    return getattr(settings, "OCR_CONFIG", {}).get("RESULT_STORE_ENABLED", False)
+
+
+class _TableCellParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.rows: List[List[str]] = []
+        self._cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self.rows.append([])
+        elif tag in ("td", "th"):
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._cell is not None:
+            if not self.rows:
+                self.rows.append([])
+            self.rows[-1].append(" ".join("".join(self._cell).split()))
+            self._cell = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def table_cell_text(tables: Optional[Iterable[str]]) -> str:
+    """Cell text of HTML tables, one line per row"""
+    lines = []
+    for html in tables or []:
+        parser = _TableCellParser()
+        parser.feed(html)
+        parser.close()
+        lines.extend(" ".join(cell for cell in row if cell) for row in parser.rows)
+    return "\n".join(line for line in lines if line)
+
+
+def purge_expired_results() -> int:
+    """Delete results older than RESULT_RETENTION_DAYS, returning how many"""
+    days = getattr(settings, "OCR_CONFIG", {}).get("RESULT_RETENTION_DAYS", 30)
+    if not days:
+        return 0
+    cutoff = timezone.now() - timedelta(days=days)
+    removed, _ = OCRResult.objects.filter(created_at__lt=cutoff).delete()
+    if removed:
+        logging.info("Purged %d OCR results older than %d days", removed, days)
+    return removed
+
+
+def _purge_if_due() -> None:
+    global _last_purge
+    with _purge_lock:
+        if time.monotonic() - _last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        _last_purge = time.monotonic()
+    purge_expired_results()
+
+
+def store_results(
+    results: Iterable[Tuple[str, dict, Optional[int]]],
+    lang: str,
+    patient_id: str = "",
+    document: str = "",
+) -> None:
+    """Save (engine, result, page) entries; result is a response dict with text,
+    average_confidence and optionally tables and fields.
+
+    A database error is logged, never raised: the OCR response is still returned.
+    """
+    if not is_enabled():
+        return
+    rows = [
+        OCRResult(
+            engine=engine,
+            lang=lang,
+            patient_id=patient_id,
+            document=document,
+            page=page,
+            text=result.get("text") or "",
+            table_text=table_cell_text(result.get("tables")),
+            tables=result.get("tables"),
+            fields=result.get("fields"),
+            average_confidence=result.get("average_confidence"),
+        )
+        for engine, result, page in results
+        if "error" not in result
+    ]
+    if not rows:
+        return
+    try:
+        _purge_if_due()
+        OCRResult.objects.bulk_create(rows)
+    except DatabaseError as e:
+        logging.error("Storing %d OCR results failed: %s", len(rows), e)
+
+
+def _fts5_query(query: str) -> str:
+    """Web-search style query (terms, "phrases", OR, -exclusions) as an FTS5 query.
+
+    Every term is quoted, so FTS5 operators and punctuation in the input
+    are matched literally.
+    """
+    include, exclude = [], []
+    for phrase, word in re.findall(r'(-?"[^"]*")|(\S+)', query):
+        token = phrase or word
+        negate = token.startswith("-")
+        token = token.lstrip("-").strip('"')
+        if not token:
+            continue
+        if not negate and token.lower() == "or" and include:
+            include.append("OR")
+            continue
+        quoted = '"%s"' % token.replace('"', '""')
+        (exclude if negate else include).append(quoted)
+    if include and include[-1] == "OR":
+        include.pop()
+    if not include:
+        return ""
+    match = " ".join(include)
+    if exclude:
+        match = "(%s) NOT (%s)" % (match, " OR ".join(exclude))
+    return match
+
+
+def _match_condition(query: str) -> Optional[Q]:
+    """Database-specific full-text match on text and table cell text"""
+    table = connection.ops.quote_name(OCRResult._meta.db_table)
+    if connection.vendor == "postgresql":
+        return Q(
+            RawSQL(
+                f"{table}.search_vector @@ websearch_to_tsquery('english', %s)",
+                (query,),
+                output_field=BooleanField(),
+            )
+        )
+    if connection.vendor == "sqlite":
+        match = _fts5_query(query)
+        if not match:
+            return None
+        return Q(
+            RawSQL(
+                f"{table}.id IN (SELECT rowid FROM ocr_ocrresult_fts "
+                "WHERE ocr_ocrresult_fts MATCH %s)",
+                (match,),
+                output_field=BooleanField(),
+            )
+        )
+    condition = Q()
+    for term in query.split():
+        condition &= Q(text__icontains=term) | Q(table_text__icontains=term)
+    return condition
+
+
+def encode_cursor(result: OCRResult) -> str:
+    raw = f"{result.created_at.isoformat()}|{result.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded).decode().split("|")
+        parsed = parse_datetime(created_at)
+        if parsed is None:
+            raise ValueError(created_at)
+        return parsed, int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def search_results(
+    query: str = "",
+    engine: Optional[str] = None,
+    lang: Optional[str] = None,
+    patient_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+) -> Tuple[List[OCRResult], Optional[str]]:
+    """One page of matching results, newest first, and the cursor of the next page"""
+    results = OCRResult.objects.all()
+    if query.strip():
+        condition = _match_condition(query.strip())
+        if condition is None:
+            return [], None
+        results = results.filter(condition)
+    if engine:
+        results = results.filter(engine=engine)
+    if lang:
+        results = results.filter(lang=lang)
+    if patient_id:
+        results = results.filter(patient_id=patient_id)
+    if since:
+        results = results.filter(created_at__gte=since)
+    if until:
+        results = results.filter(created_at__lt=until)
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        # Row comparison keeps the page a single range on the (created_at, id) indexes
+        table = connection.ops.quote_name(OCRResult._meta.db_table)
+        results = results.filter(
+            RawSQL(
+                f"({table}.created_at, {table}.id) < (%s, %s)",
+                (connection.ops.adapt_datetimefield_value(created_at), pk),
+                output_field=BooleanField(),
+            )
+        )
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    page = list(results.order_by("-created_at", "-id")[: limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
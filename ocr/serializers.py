@@ -1,15 +1,160 @@
+from django.conf import settings
 from rest_framework import serializers
 
-allowed_models = {"Tesseract", "PaddleOCR", "PaddleTable"}
+from ocr.engines.factory import OCREngineFactory
+from ocr.incremental import INCREMENTAL_ENGINES
+from ocr.languages import (
+    engine_language_code,
+    get_available_languages,
+    get_default_language,
+)
+from ocr.models import OCRResult
+from ocr.search import MAX_PAGE_SIZE
+
+allowed_models = {
+    "Tesseract",
+    "PaddleOCR",
+    "PaddleTable",
+    "PaddleCombined",
+    "PaddleONNX",
+    "PaddleBatched",
+}
+
+
+class ConfigBooleanField(serializers.BooleanField):
+    """Optional boolean defaulting to an OCR_CONFIG setting"""
+
+    # BooleanField treats a field missing from form data as False; fall back
+    # to the configured default instead
+    default_empty_html = serializers.empty
+
+    def __init__(self, setting: str, fallback: bool = False, **kwargs):
+        super().__init__(
+            required=False,
+            default=lambda: getattr(settings, "OCR_CONFIG", {}).get(setting, fallback),
+            **kwargs,
+        )
 
 
 class OCRImageSerializer(serializers.Serializer):
     image = serializers.ImageField(required=True)
     model = serializers.CharField(required=False, default="Tesseract")
+    # Several engines run concurrently on the same image; takes precedence over model
+    models = serializers.ListField(
+        child=serializers.CharField(), required=False, allow_empty=False
+    )
+    merge = serializers.BooleanField(required=False, default=False)
+    lang = serializers.CharField(required=False, default=get_default_language)
+    extract_fields = ConfigBooleanField("LAB_EXTRACTION_ENABLED")
+    # Read only the tiles that changed since a cached page (single model)
+    incremental = ConfigBooleanField("INCREMENTAL_OCR_ENABLED")
+    # Stored with the result for search (see /ocr/results/)
+    patient_id = serializers.CharField(
+        required=False, default="", allow_blank=True, max_length=128
+    )
 
     def validate_model(self, value):
         if value not in allowed_models:
             raise serializers.ValidationError(
                 f"Invalid model name. Valid options are: {', '.join(sorted(allowed_models))}"
             )
+        served = OCREngineFactory.get_served_engines()
+        if value not in served:
+            raise serializers.ValidationError(
+                f"{value} is not served by this node. Served engines: {', '.join(served)}"
+            )
+        return value
+
+    def validate_models(self, value):
+        # Accept repeated fields as well as comma-separated names
+        names = []
+        for item in value:
+            for name in item.split(","):
+                name = name.strip()
+                if name and name not in names:
+                    names.append(self.validate_model(name))
+        if not names:
+            raise serializers.ValidationError("At least one model is required.")
+        return names
+
+    def validate_lang(self, value):
+        if value not in get_available_languages():
+            raise serializers.ValidationError(
+                f"Unsupported language. Valid options are: {', '.join(get_available_languages())}"
+            )
         return value
+
+    def validate(self, data):
+        lang = data["lang"]
+        for name in data.get("models") or [data["model"]]:
+            if engine_language_code(name, lang) is None:
+                raise serializers.ValidationError(
+                    {"lang": f"{name} does not support language '{lang}'."}
+                )
+        if data.get("incremental") and (
+            data.get("models") or data["model"] not in INCREMENTAL_ENGINES
+        ):
+            # Only an explicit request is an error; the configured default
+            # just does not apply
+            if "incremental" in self.initial_data:
+                raise serializers.ValidationError(
+                    {
+                        "incremental": "Incremental OCR needs a single model out of: "
+                        f"{', '.join(INCREMENTAL_ENGINES)}."
+                    }
+                )
+            data["incremental"] = False
+        return data
+
+
+class UploadStartSerializer(serializers.Serializer):
+    size = serializers.IntegerField(required=False, min_value=1)
+    filename = serializers.CharField(required=False, default="", max_length=255)
+
+
+class UploadCommitSerializer(serializers.Serializer):
+    model = serializers.CharField(required=False, default="Tesseract")
+    lang = serializers.CharField(required=False, default=get_default_language)
+    extract_fields = ConfigBooleanField("LAB_EXTRACTION_ENABLED")
+    incremental = ConfigBooleanField("INCREMENTAL_OCR_ENABLED")
+    patient_id = serializers.CharField(
+        required=False, default="", allow_blank=True, max_length=128
+    )
+
+    validate_model = OCRImageSerializer.validate_model
+    validate_lang = OCRImageSerializer.validate_lang
+    validate = OCRImageSerializer.validate
+
+
+class ResultSearchSerializer(serializers.Serializer):
+    # Web-search syntax: terms, "quoted phrases", OR, -excluded terms
+    q = serializers.CharField(
+        required=False, default="", allow_blank=True, max_length=500
+    )
+    engine = serializers.CharField(required=False)
+    lang = serializers.CharField(required=False)
+    patient_id = serializers.CharField(required=False)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    cursor = serializers.CharField(required=False)
+    limit = serializers.IntegerField(
+        required=False, default=20, min_value=1, max_value=MAX_PAGE_SIZE
+    )
+
+
+class OCRResultSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OCRResult
+        fields = [
+            "id",
+            "created_at",
+            "engine",
+            "lang",
+            "patient_id",
+            "document",
+            "page",
+            "text",
+            "average_confidence",
+            "tables",
+            "fields",
+        ]
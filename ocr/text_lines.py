@@ -0,0 +1,160 @@
+"""
+Text Line Cropping and Recognition Batching
+
+After detection, every text line is cropped straight to the recognition
+input height with one affine warp. The warp matrices for all lines are
+computed together. Lines are then sorted by aspect ratio into width buckets,
+so each padded recognition batch holds lines of similar width and little
+compute goes to padding. Results are mapped back to reading order.
+"""
+
+from typing import List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .utils import split_line_into_words
+
+# Lines at least this much taller than wide are read rotated by 90 degrees
+VERTICAL_LINE_RATIO = 1.5
+
+
+def sort_reading_order(boxes: List[np.ndarray]) -> List[np.ndarray]:
+    """Sort line boxes top to bottom, then left to right within a line"""
+    boxes = sorted(boxes, key=lambda b: (b[0][1], b[0][0]))
+    for i in range(len(boxes) - 1):
+        for j in range(i, -1, -1):
+            if abs(boxes[j + 1][0][1] - boxes[j][0][1]) < 10 and (
+                boxes[j + 1][0][0] < boxes[j][0][0]
+            ):
+                boxes[j], boxes[j + 1] = boxes[j + 1], boxes[j]
+            else:
+                break
+    return boxes
+
+
+def line_corners(boxes: np.ndarray) -> np.ndarray:
+    """Corners (top-left, top-right, bottom-left) of each line in reading direction.
+
+    boxes: (N, 4, 2) corners ordered top-left, top-right, bottom-right,
+    bottom-left. Vertical lines start at their top-right corner, which
+    rotates them counter-clockwise into a horizontal line.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32)
+    width = np.maximum(
+        np.linalg.norm(boxes[:, 0] - boxes[:, 1], axis=1),
+        np.linalg.norm(boxes[:, 2] - boxes[:, 3], axis=1),
+    )
+    height = np.maximum(
+        np.linalg.norm(boxes[:, 0] - boxes[:, 3], axis=1),
+        np.linalg.norm(boxes[:, 1] - boxes[:, 2], axis=1),
+    )
+    vertical = height >= VERTICAL_LINE_RATIO * np.maximum(width, 1)
+    horizontal_order = boxes[:, [0, 1, 3]]
+    vertical_order = boxes[:, [1, 2, 0]]
+    return np.where(vertical[:, None, None], vertical_order, horizontal_order)
+
+
+def line_aspect_ratios(boxes: np.ndarray) -> np.ndarray:
+    """Width / height of each line in reading direction"""
+    corners = line_corners(boxes)
+    width = np.linalg.norm(corners[:, 1] - corners[:, 0], axis=1)
+    height = np.linalg.norm(corners[:, 2] - corners[:, 0], axis=1)
+    return width / np.maximum(height, 1.0)
+
+
+def crop_matrices(boxes: np.ndarray, height: int, widths: Sequence[int]) -> np.ndarray:
+    """Inverse affine maps (output pixel -> page pixel) for every line at once.
+
+    Line i is warped to an image of widths[i] x height, so cropping and
+    resizing to the recognition input happen in a single warp.
+    """
+    corners = line_corners(boxes)
+    widths = np.asarray(widths, dtype=np.float32)
+    x_axis = (corners[:, 1] - corners[:, 0]) / widths[:, None]
+    y_axis = (corners[:, 2] - corners[:, 0]) / height
+    return np.stack([x_axis, y_axis, corners[:, 0]], axis=2)
+
+
+def width_buckets(
+    ratios: Sequence[float], batch_size: int, sort: bool = True
+) -> List[np.ndarray]:
+    """Line indices grouped into batches of similar aspect ratio (reading order if not sort)"""
+    if sort:
+        order = np.argsort(np.asarray(ratios), kind="stable")
+    else:
+        order = np.arange(len(ratios))
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def crop_lines(
+    img: np.ndarray,
+    boxes: np.ndarray,
+    height: int,
+    min_width: int,
+    batch_size: int,
+    sort: bool = True,
+) -> List[Tuple[np.ndarray, List[np.ndarray], List[int]]]:
+    """Crop detected lines to the recognition height, in width-bucketed batches.
+
+    Returns a list of (line indices, crops, crop widths) per batch. Every
+    crop in a batch fits the batch's padded width: the widest line's, but at
+    least min_width.
+    """
+    if len(boxes) == 0:
+        return []
+    ratios = line_aspect_ratios(boxes)
+    widths = np.maximum(np.ceil(ratios * height).astype(int), 1)
+    matrices = crop_matrices(boxes, height, widths)
+
+    batches = []
+    for indices in width_buckets(ratios, batch_size, sort):
+        batch_width = max(min_width, int(widths[indices].max()))
+        crops = []
+        crop_widths = []
+        for i in indices:
+            width = min(int(widths[i]), batch_width)
+            crops.append(
+                cv2.warpAffine(
+                    img,
+                    matrices[i],
+                    (width, height),
+                    flags=cv2.INTER_CUBIC | cv2.WARP_INVERSE_MAP,
+                    borderMode=cv2.BORDER_REPLICATE,
+                )
+            )
+            crop_widths.append(width)
+        batches.append((indices, crops, crop_widths))
+    return batches
+
+
+def padding_fraction(
+    ratios: Sequence[float],
+    height: int,
+    min_width: int,
+    batch_size: int,
+    sort: bool = True,
+) -> float:
+    """Share of recognition input that is padding, with or without width bucketing"""
+    ratios = np.asarray(ratios)
+    widths = np.maximum(np.ceil(ratios * height), 1)
+    batches = width_buckets(ratios, batch_size, sort)
+    padded = sum(
+        len(indices) * max(min_width, widths[indices].max()) for indices in batches
+    )
+    return 1.0 - float(widths.sum()) / padded if padded else 0.0
+
+
+def lines_to_words(
+    boxes: np.ndarray, lines: Sequence[Tuple[str, float]]
+) -> Tuple[str, float, list]:
+    """Page text, average word confidence and word boxes from recognized lines"""
+    words = []
+    for box, (line_text, score) in zip(boxes, lines):
+        line_box = (box[:, 0].min(), box[:, 1].min(), box[:, 0].max(), box[:, 1].max())
+        words.extend(split_line_into_words(line_text, score, line_box))
+    text = " ".join(word["text"] for word in words)
+    average_conf = (
+        round(sum(word["conf"] for word in words) / len(words), 3) if words else None
+    )
+    return text, average_conf, words
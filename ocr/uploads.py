@@ -0,0 +1,249 @@
+"""
+Chunked Upload Module
+
+Large multi-page scans are uploaded in chunks that are appended to a spool
+file on disk, so neither the web worker nor a dropped connection forces the
+whole file through memory again. Upload state lives next to the spool file,
+so any worker process can serve any chunk. On commit the spool file is
+memory-mapped and its page frames are decoded one at a time.
+"""
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from django.conf import settings
+from PIL import Image, ImageSequence
+
+# Bytes copied from the request stream per read
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class UploadNotFound(Exception):
+    """The upload does not exist, expired or was already committed"""
+
+
+class UploadOffsetMismatch(Exception):
+    """A chunk was sent for an offset other than the upload's current size"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadTooLarge(ValueError):
+    """A chunk or the whole upload exceeds the configured limits"""
+
+
+def _get_upload_config() -> dict:
+    config = getattr(settings, "OCR_CONFIG", {})
+    return {
+        "dir": config.get("UPLOAD_DIR", os.path.join(settings.BASE_DIR, "uploads")),
+        "max_size": config.get("UPLOAD_MAX_SIZE", 1024 * 1024 * 1024),
+        "max_chunk_size": config.get("UPLOAD_MAX_CHUNK_SIZE", 16 * 1024 * 1024),
+        "expiry": config.get("UPLOAD_EXPIRY_SECONDS", 24 * 3600),
+    }
+
+
+class ChunkedUpload:
+    """A spool file plus a small JSON metadata file in UPLOAD_DIR"""
+
+    def __init__(self, upload_id: str, upload_dir: Optional[str] = None):
+        self.upload_id = upload_id
+        self.upload_dir = upload_dir or _get_upload_config()["dir"]
+        self.data_path = os.path.join(self.upload_dir, f"{upload_id}.part")
+        self.meta_path = os.path.join(self.upload_dir, f"{upload_id}.json")
+        self.claimed_path = os.path.join(self.upload_dir, f"{upload_id}.commit")
+
+    @classmethod
+    def start(
+        cls,
+        size: Optional[int] = None,
+        filename: str = "",
+        upload_id: Optional[str] = None,
+    ) -> "ChunkedUpload":
+        """Create an empty upload, declaring the total size if known.
+
+        upload_id is set by the router to pin the upload to this node; an id
+        already in use raises FileExistsError.
+        """
+        config = _get_upload_config()
+        if size is not None and size > config["max_size"]:
+            raise UploadTooLarge(
+                f"Upload size {size} exceeds the limit of {config['max_size']} bytes"
+            )
+        os.makedirs(config["dir"], exist_ok=True)
+        cleanup_expired_uploads()
+
+        upload = cls(upload_id or str(uuid.uuid4()), config["dir"])
+        with open(upload.data_path, "xb"):
+            pass
+        upload._write_meta({"size": size, "filename": filename, "created": time.time()})
+        logging.info("Started upload %s (%s bytes declared)", upload.upload_id, size)
+        return upload
+
+    @classmethod
+    def get(cls, upload_id: str) -> "ChunkedUpload":
+        upload = cls(upload_id)
+        if not os.path.exists(upload.meta_path) or not os.path.exists(upload.data_path):
+            raise UploadNotFound(f"Unknown upload: {upload_id}")
+        return upload
+
+    def _write_meta(self, meta: dict) -> None:
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    @property
+    def meta(self) -> dict:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadNotFound(f"Unknown upload: {self.upload_id}")
+
+    @property
+    def offset(self) -> int:
+        """Bytes received so far; the spool file size is the source of truth"""
+        try:
+            return os.path.getsize(self.data_path)
+        except FileNotFoundError:
+            raise UploadNotFound(f"Unknown upload: {self.upload_id}")
+
+    @property
+    def complete(self) -> bool:
+        size = self.meta.get("size")
+        return size is None or self.offset == size
+
+    def status(self) -> dict:
+        meta = self.meta
+        return {
+            "upload_id": self.upload_id,
+            "offset": self.offset,
+            "size": meta.get("size"),
+            "filename": meta.get("filename", ""),
+        }
+
+    def append(self, stream, offset: int, length: int) -> int:
+        """
+        Copy a chunk of `length` bytes from a file-like stream to the spool file.
+
+        The chunk must start at the current offset, so a retried chunk is
+        rejected with the offset to resume from instead of being appended
+        twice. Returns the new offset.
+        """
+        config = _get_upload_config()
+        if length > config["max_chunk_size"]:
+            raise UploadTooLarge(
+                f"Chunk of {length} bytes exceeds the limit of "
+                f"{config['max_chunk_size']} bytes"
+            )
+
+        with open(self.data_path, "ab") as f:
+            # Concurrent appends to one upload (possibly from different
+            # workers) are serialized on the spool file
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                current = os.fstat(f.fileno()).st_size
+                if offset != current:
+                    raise UploadOffsetMismatch(current)
+                size = self.meta.get("size")
+                limit = size if size is not None else config["max_size"]
+                if current + length > limit:
+                    raise UploadTooLarge(
+                        f"Chunk ends at {current + length}, past the upload size {limit}"
+                    )
+
+                remaining = length
+                while remaining:
+                    data = stream.read(min(COPY_BUFFER_SIZE, remaining))
+                    if not data:
+                        break
+                    f.write(data)
+                    remaining -= len(data)
+                f.flush()
+                # Activity keeps the upload from expiring
+                os.utime(self.meta_path)
+                if remaining:
+                    # Connection dropped mid-chunk: drop the partial chunk so
+                    # the client resumes from a chunk boundary
+                    f.truncate(current)
+                    raise UploadOffsetMismatch(current)
+                return current + length
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def claim(self) -> None:
+        """Take the upload for committing, so it is processed only once"""
+        try:
+            os.rename(self.data_path, self.claimed_path)
+        except FileNotFoundError:
+            raise UploadNotFound(f"Unknown upload: {self.upload_id}")
+        self.data_path = self.claimed_path
+
+    def release(self) -> None:
+        """Give up a claim after a transient failure, so the commit can be retried"""
+        spool_path = os.path.join(self.upload_dir, f"{self.upload_id}.part")
+        try:
+            os.rename(self.claimed_path, spool_path)
+        except FileNotFoundError:
+            raise UploadNotFound(f"Unknown upload: {self.upload_id}")
+        self.data_path = spool_path
+
+    @contextmanager
+    def open_image(self) -> Iterator[Image.Image]:
+        """Open the spooled file through a read-only memory map.
+
+        PIL reads from the map on demand, so only the frame being decoded is
+        held in memory; the rest of the file stays in the page cache.
+        """
+        with open(self.data_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError("Upload is empty")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with Image.open(mapped) as img:
+                    yield img
+
+    def iter_pages(self) -> Iterator[Image.Image]:
+        """Decode page frames one at a time"""
+        with self.open_image() as img:
+            for frame in ImageSequence.Iterator(img):
+                frame.load()
+                yield frame
+
+    def delete(self) -> None:
+        for path in (self.data_path, self.claimed_path, self.meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def cleanup_expired_uploads() -> int:
+    """Remove uploads older than UPLOAD_EXPIRY_SECONDS, returning how many"""
+    config = _get_upload_config()
+    if not os.path.isdir(config["dir"]):
+        return 0
+
+    cutoff = time.time() - config["expiry"]
+    removed = 0
+    for name in os.listdir(config["dir"]):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(config["dir"], name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                ChunkedUpload(name[: -len(".json")], config["dir"]).delete()
+                removed += 1
+        except FileNotFoundError:
+            continue
+    if removed:
+        logging.info("Removed %d expired uploads", removed)
+    return removed
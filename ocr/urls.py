@@ -1,8 +1,28 @@
 from django.urls import path
-from ocr.views import OCRView
+from ocr.views import (
+    EngineMetricsView,
+    HealthView,
+    OCRView,
+    ResultSearchView,
+    UploadChunkView,
+    UploadCommitView,
+    UploadStartView,
+)
 
 app_name = "ocr"
 
 urlpatterns = [
     path("ocr/", OCRView.as_view(), name="ocr"),
+    path("ocr/health/", HealthView.as_view(), name="health"),
+    path("ocr/engines/", EngineMetricsView.as_view(), name="engine-metrics"),
+    path("ocr/results/", ResultSearchView.as_view(), name="result-search"),
+    path("ocr/uploads/", UploadStartView.as_view(), name="upload-start"),
+    path(
+        "ocr/uploads/<uuid:upload_id>/", UploadChunkView.as_view(), name="upload-chunk"
+    ),
+    path(
+        "ocr/uploads/<uuid:upload_id>/commit/",
+        UploadCommitView.as_view(),
+        name="upload-commit",
+    ),
 ]
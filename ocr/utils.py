@@ -5,6 +5,11 @@ import os
 from typing import Optional
 
 
+def get_rss_mb() -> float:
+    """Get the resident set size of the current process in MB"""
+    return psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
+
+
 def log_memory_usage(prefix: str = ""):
     """Log current memory usage for debugging"""
     process = psutil.Process(os.getpid())
@@ -20,6 +25,37 @@ def log_memory_usage(prefix: str = ""):
     )
 
 
+def split_line_into_words(text_segment: str, score, box=None) -> list:
+    """
+    Split a recognized text line into word dicts
+
+    Args:
+        text_segment: Recognized text of the line
+        score: Recognition confidence of the line
+        box: Optional (x0, y0, x1, y1) line box; word boxes are estimated
+            from each word's character offset within the line
+
+    Returns:
+        List of {'text', 'conf', 'box'} dicts
+    """
+    words = []
+    if not isinstance(text_segment, str) or not text_segment.strip():
+        return words
+
+    length = len(text_segment)
+    offset = 0
+    for word in text_segment.split():
+        start = text_segment.index(word, offset)
+        offset = start + len(word)
+        word_box = None
+        if box is not None:
+            x0, y0, x1, y1 = [float(v) for v in box]
+            char_width = (x1 - x0) / length
+            word_box = (x0 + start * char_width, y0, x0 + offset * char_width, y1)
+        words.append({"text": word, "conf": float(score), "box": word_box})
+    return words
+
+
 def force_garbage_collection():
     """Force garbage collection to free memory"""
     logging.info("Forcing garbage collection...")
@@ -2,18 +2,77 @@
 
 import time
 import logging
+import uuid
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
 from PIL import Image
 
-from ocr.serializers import OCRImageSerializer
-from ocr.engines.ocr_engines import perform_ocr
+from ocr.serializers import (
+    OCRImageSerializer,
+    OCRResultSerializer,
+    ResultSearchSerializer,
+    UploadCommitSerializer,
+    UploadStartSerializer,
+)
+from ocr.engines.factory import OCREngineFactory
+from ocr.languages import get_available_languages
+from ocr.engines.ocr_engines import (
+    merge_best_confidence,
+    perform_ocr,
+    perform_ocr_incremental,
+    perform_ocr_multi,
+    perform_ocr_with_words,
+)
+from ocr.dedup import PageHash, get_duplicate_index
+from ocr.execution import EngineTimeout
+from ocr.lab_extraction import extract_lab_values, extract_lab_values_batch
+from ocr.profiling import stage_timer
+from ocr.search import InvalidCursor, search_results, store_results
+from ocr.uploads import (
+    ChunkedUpload,
+    UploadNotFound,
+    UploadOffsetMismatch,
+    UploadTooLarge,
+)
+
+NOT_READY_MESSAGES = (
+    "PaddleOCR not ready",
+    "PaddleTableOCREngine not ready",
+    "PaddleCombinedOCREngine not ready",
+    "PaddleONNX not ready",
+    "PaddleBatched not ready",
+)
+
+
+def _is_initializing(error: Exception) -> bool:
+    """Whether an engine error means the engine is still loading"""
+    return isinstance(error, RuntimeError) and any(
+        message in str(error) for message in NOT_READY_MESSAGES
+    )
+
+
+def _error_result(error: Exception) -> dict:
+    """Per-engine error entry, with partial-stage info for timeouts"""
+    if isinstance(error, EngineTimeout):
+        return {"error": str(error), **error.partial_result()}
+    return {"error": str(error)}
+
+
+def _store_response(data: dict, model: str, lang: str, patient_id: str, document: str):
+    """Save a single- or multi-engine OCR response for search"""
+    if "results" in data:
+        entries = [(name, result, None) for name, result in data["results"].items()]
+    else:
+        entries = [(model, data, None)]
+    with stage_timer("store"):
+        store_results(entries, lang, patient_id=patient_id, document=document)
 
 
 class OCRView(APIView):
-    """API view for OCR processing of medical report images. Supports models: 'Tesseract', 'PaddleOCR', and 'PaddleTable' (for table extraction)."""
+    """API view for OCR processing of medical report images. Supports models: 'Tesseract', 'PaddleOCR', 'PaddleTable' (for table extraction) and 'PaddleCombined' (full-page text and tables in one pass)."""
 
     def post(self, request):
         """Process OCR request for image text extraction."""
@@ -22,15 +81,83 @@ class OCRView(APIView):
         if serializer.is_valid():
             image = serializer.validated_data["image"]
             model = serializer.validated_data.get("model", "Tesseract")
-            img = Image.open(image)
+            models = serializer.validated_data.get("models")
+            extract_fields = serializer.validated_data.get("extract_fields", False)
+            incremental = serializer.validated_data["incremental"]
+            lang = serializer.validated_data["lang"]
+            patient_id = serializer.validated_data["patient_id"]
+            document = getattr(image, "name", "") or ""
+            with stage_timer("decode"):
+                img = Image.open(image)
+                img.load()
+
+            merge = serializer.validated_data.get("merge", False)
+
+            # Re-scanned copies of a page already processed reuse its result
+            duplicate_index = get_duplicate_index()
+            if duplicate_index is not None:
+                namespace = (
+                    tuple(models) if models else model,
+                    lang,
+                    extract_fields,
+                    merge,
+                    incremental,
+                )
+                with stage_timer("dedup"):
+                    page_hash = PageHash.from_image(img)
+                    match = duplicate_index.find(page_hash, namespace)
+                if match is not None:
+                    stored, distance = match
+                    logging.info(
+                        "Near-duplicate page (distance %d), reusing stored result",
+                        distance,
+                    )
+                    _store_response(stored, model, lang, patient_id, document)
+                    return Response(
+                        {
+                            **stored,
+                            "near_duplicate": True,
+                            "duplicate_distance": distance,
+                        }
+                    )
+
+            if models:
+                response = self._post_multi(img, models, lang, extract_fields, merge)
+                if response.status_code == status.HTTP_200_OK:
+                    _store_response(response.data, model, lang, patient_id, document)
+                if (
+                    duplicate_index is not None
+                    and response.status_code == status.HTTP_200_OK
+                    and not any(
+                        "error" in result
+                        for result in response.data["results"].values()
+                    )
+                ):
+                    duplicate_index.add(page_hash, response.data, namespace)
+                return response
+
             start_time = time.time()
 
+            tiles = None
             try:
-                text, average_conf, tables = perform_ocr(img, model)
+                if incremental:
+                    text, average_conf, tables, words, tiles = perform_ocr_incremental(
+                        img, model, lang
+                    )
+                elif extract_fields:
+                    text, average_conf, tables, words = perform_ocr_with_words(
+                        img, model, lang
+                    )
+                else:
+                    text, average_conf, tables = perform_ocr(img, model, lang)
+            except EngineTimeout as e:
+                logging.error("OCR timeout: %s", str(e))
+                return Response(
+                    {"error": str(e), "status": "timeout", **e.partial_result()},
+                    status=status.HTTP_504_GATEWAY_TIMEOUT,
+                )
             except RuntimeError as e:
-                if "PaddleOCR not ready" in str(
-                    e
-                ) or "PaddleTableOCREngine not ready" in str(e):
+                if _is_initializing(e):
                     return Response(
                         {"error": str(e), "status": "initializing"},
                         status=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -55,7 +182,362 @@ class OCRView(APIView):
             response_data = {"text": text, "average_confidence": average_conf}
             if tables:
                 response_data["tables"] = tables
+            if extract_fields:
+                with stage_timer("extract"):
+                    response_data["fields"] = extract_lab_values(words)
+            if tiles is not None:
+                response_data.update(tiles)
 
+            _store_response(response_data, model, lang, patient_id, document)
+            if duplicate_index is not None:
+                duplicate_index.add(page_hash, response_data, namespace)
             return Response(response_data)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def _post_multi(self, img, models, lang, extract_fields, merge):
+        """Run several engines concurrently and return each result keyed by model name"""
+        start_time = time.time()
+        try:
+            results = perform_ocr_multi(
+                img, models, with_words=extract_fields, lang=lang
+            )
+        except (ImportError, ValueError, OSError, RuntimeError) as e:
+            logging.error("OCR error: %s", str(e))
+            return Response(
+                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        logging.info("Multi-engine OCR latency: %.3f seconds", time.time() - start_time)
+
+        succeeded = {
+            name: result
+            for name, result in results.items()
+            if not isinstance(result, Exception)
+        }
+        failed = {
+            name: result
+            for name, result in results.items()
+            if isinstance(result, Exception)
+        }
+        for name, error in failed.items():
+            logging.error("OCR error (%s): %s", name, str(error))
+
+        errors = {name: _error_result(e) for name, e in failed.items()}
+        if not succeeded:
+            if all(_is_initializing(error) for error in failed.values()):
+                return Response(
+                    {"errors": errors, "status": "initializing"},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                )
+            if any(isinstance(error, EngineTimeout) for error in failed.values()):
+                return Response(
+                    {"errors": errors, "status": "timeout"},
+                    status=status.HTTP_504_GATEWAY_TIMEOUT,
+                )
+            return Response(
+                {"errors": errors}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        fields = {}
+        if extract_fields:
+            with stage_timer("extract"):
+                pages = extract_lab_values_batch(
+                    [result[3] for result in succeeded.values()]
+                )
+            fields = dict(zip(succeeded, pages))
+
+        response_results = {}
+        for name in models:
+            if name in failed:
+                response_results[name] = errors[name]
+                continue
+            text, average_conf, tables = succeeded[name][:3]
+            response_results[name] = {
+                "text": text,
+                "average_confidence": average_conf,
+            }
+            if tables:
+                response_results[name]["tables"] = tables
+            if extract_fields:
+                response_results[name]["fields"] = fields[name]
+
+        response_data = {"results": response_results}
+        if merge:
+            response_data["merged"] = merge_best_confidence(succeeded)
+        return Response(response_data)
+
+
+def _upload_not_found(e: UploadNotFound):
+    return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+
+class UploadStartView(APIView):
+    """Start a chunked upload for large (multi-page) scans."""
+
+    def post(self, request):
+        serializer = UploadStartSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        # Set by the router so the upload's chunks and commit reach this node
+        upload_id = request.headers.get("X-OCR-Upload-Id")
+        if upload_id:
+            try:
+                upload_id = str(uuid.UUID(upload_id))
+            except ValueError:
+                return Response(
+                    {"error": "X-OCR-Upload-Id must be a UUID"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        try:
+            upload = ChunkedUpload.start(
+                size=serializer.validated_data.get("size"),
+                filename=serializer.validated_data["filename"],
+                upload_id=upload_id,
+            )
+        except UploadTooLarge as e:
+            return Response(
+                {"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        except FileExistsError:
+            return Response(
+                {"error": f"Upload {upload_id} already exists"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return Response(upload.status(), status=status.HTTP_201_CREATED)
+
+
+class UploadChunkView(APIView):
+    """Append chunks to an upload (PATCH), check its offset (GET/HEAD) or abort it (DELETE)."""
+
+    def get(self, request, upload_id):
+        try:
+            upload = ChunkedUpload.get(str(upload_id))
+            response = Response(upload.status())
+        except UploadNotFound as e:
+            return _upload_not_found(e)
+        response["Upload-Offset"] = str(upload.offset)
+        return response
+
+    def patch(self, request, upload_id):
+        """Append the raw request body at the offset given in the Upload-Offset header."""
+        try:
+            offset = int(request.META["HTTP_UPLOAD_OFFSET"])
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "Upload-Offset and Content-Length headers are required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            upload = ChunkedUpload.get(str(upload_id))
+            # The body is streamed straight to the spool file, never parsed
+            new_offset = upload.append(request.stream, offset, length)
+        except UploadNotFound as e:
+            return _upload_not_found(e)
+        except UploadOffsetMismatch as e:
+            response = Response(
+                {"error": str(e), "offset": e.offset}, status=status.HTTP_409_CONFLICT
+            )
+            response["Upload-Offset"] = str(e.offset)
+            return response
+        except UploadTooLarge as e:
+            return Response(
+                {"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        response = Response({"upload_id": upload.upload_id, "offset": new_offset})
+        response["Upload-Offset"] = str(new_offset)
+        return response
+
+    def delete(self, request, upload_id):
+        try:
+            ChunkedUpload.get(str(upload_id)).delete()
+        except UploadNotFound as e:
+            return _upload_not_found(e)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadCommitView(APIView):
+    """Run OCR over every page of a completed upload, then discard it."""
+
+    def post(self, request, upload_id):
+        serializer = UploadCommitSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        model = serializer.validated_data["model"]
+        extract_fields = serializer.validated_data["extract_fields"]
+        incremental = serializer.validated_data["incremental"]
+        lang = serializer.validated_data["lang"]
+        patient_id = serializer.validated_data["patient_id"]
+
+        try:
+            upload = ChunkedUpload.get(str(upload_id))
+            if not upload.complete:
+                return Response(
+                    {"error": "Upload is incomplete", **upload.status()},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            # Read before the upload and its metadata are deleted below
+            filename = upload.status()["filename"]
+            upload.claim()
+        except UploadNotFound as e:
+            return _upload_not_found(e)
+
+        start_time = time.time()
+        pages = []
+        words_per_page = []
+        # Transient failures keep the upload, so the client retries the commit
+        # instead of sending the whole scan again
+        retryable = False
+        try:
+            # Frames are decoded lazily from the memory-mapped spool file
+            with stage_timer("decode"):
+                frames = upload.iter_pages()
+                frame = next(frames, None)
+            while frame is not None:
+                tiles = None
+                if incremental:
+                    text, average_conf, tables, words, tiles = perform_ocr_incremental(
+                        frame, model, lang
+                    )
+                    words_per_page.append(words)
+                elif extract_fields:
+                    text, average_conf, tables, words = perform_ocr_with_words(
+                        frame, model, lang
+                    )
+                    words_per_page.append(words)
+                else:
+                    text, average_conf, tables = perform_ocr(frame, model, lang)
+                page = {"text": text, "average_confidence": average_conf}
+                if tables:
+                    page["tables"] = tables
+                if tiles is not None:
+                    page.update(tiles)
+                pages.append(page)
+                with stage_timer("decode"):
+                    frame = next(frames, None)
+        except EngineTimeout as e:
+            logging.error("OCR timeout: %s", str(e))
+            retryable = True
+            return Response(
+                {
+                    "error": str(e),
+                    "status": "timeout",
+                    "pages_completed": len(pages),
+                    **e.partial_result(),
+                },
+                status=status.HTTP_504_GATEWAY_TIMEOUT,
+            )
+        except RuntimeError as e:
+            if _is_initializing(e):
+                retryable = True
+                return Response(
+                    {"error": str(e), "status": "initializing"},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                )
+            logging.error("OCR error: %s", str(e))
+            return Response(
+                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        except (ImportError, ValueError, OSError) as e:
+            logging.error("OCR error: %s", str(e))
+            return Response(
+                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        finally:
+            if retryable:
+                upload.release()
+            else:
+                upload.delete()
+
+        logging.info(
+            "Upload %s: %d pages in %.3f seconds",
+            upload.upload_id,
+            len(pages),
+            time.time() - start_time,
+        )
+
+        if extract_fields:
+            with stage_timer("extract"):
+                for page, fields in zip(
+                    pages, extract_lab_values_batch(words_per_page)
+                ):
+                    page["fields"] = fields
+
+        with stage_timer("store"):
+            store_results(
+                [(model, page, number) for number, page in enumerate(pages, 1)],
+                lang,
+                patient_id=patient_id,
+                document=filename,
+            )
+
+        confidences = [
+            page["average_confidence"]
+            for page in pages
+            if page["average_confidence"] is not None
+        ]
+        return Response(
+            {
+                "text": "\n\n".join(page["text"] for page in pages),
+                "average_confidence": (
+                    round(sum(confidences) / len(confidences), 3)
+                    if confidences
+                    else None
+                ),
+                "pages": pages,
+            }
+        )
+
+
+class HealthView(APIView):
+    """Liveness check for the router, with the engines and languages this node serves."""
+
+    def get(self, request):
+        return Response(
+            {
+                "status": "ok",
+                "engines": OCREngineFactory.get_served_engines(),
+                "languages": get_available_languages(),
+            }
+        )
+
+
+class EngineMetricsView(APIView):
+    """Resident OCR engines, their estimated memory and load/eviction counts."""
+
+    def get(self, request):
+        return Response(OCREngineFactory.get_metrics())
+
+
+class ResultSearchView(APIView):
+    """Full-text search over stored OCR results, newest first, keyset-paginated."""
+
+    # Results hold patient report text across all patients
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        serializer = ResultSearchSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = serializer.validated_data
+        try:
+            results, next_cursor = search_results(
+                query=params["q"],
+                engine=params.get("engine"),
+                lang=params.get("lang"),
+                patient_id=params.get("patient_id"),
+                since=params.get("since"),
+                until=params.get("until"),
+                cursor=params.get("cursor"),
+                limit=params["limit"],
+            )
+        except InvalidCursor as e:
+            return Response({"cursor": [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {
+                "results": OCRResultSerializer(results, many=True).data,
+                "next_cursor": next_cursor,
+            }
+        )
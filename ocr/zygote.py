@@ -0,0 +1,92 @@
+"""
+Zygote Mode
+
+With OCR_ZYGOTE, gunicorn preloads the app (see gunicorn.conf.py): the
+master process imports the app and loads the fork-safe OCR engines once,
+and every worker is forked from it, sharing those pages copy-on-write. A
+worker that is recycled, crashes or times out is replaced by a fork of the
+master, which only loads the engines that cannot be forked.
+
+Only state that survives fork may be created in the master:
+
+- Threads do not survive. The master serves no requests, so the engine
+  thread pool and batcher workers are never started there; both are reset
+  in the child regardless (os.register_at_fork in their modules).
+- Native thread pools cannot be reset. ONNX Runtime starts its intra-op
+  pool when a session is created, and Paddle predictors their MKL-DNN and
+  OpenMP pools, so all Paddle engines load in each worker (FORK_UNSAFE_ENGINES
+  in engines/factory.py). Python and native threads still running when the
+  first worker is forked are logged.
+- Execution slots (a child process and its pipe per engine group) cannot be
+  shared between workers either. Zygote mode turns
+  PADDLEOCR_ISOLATED_EXECUTION off by default.
+- Database connections are closed before forking, so workers never share
+  a socket.
+- The collector is disabled while the app loads and the loaded objects are
+  frozen before forking, so collections in a worker do not write to (and
+  copy) the pages it shares with the master. It is enabled again in the
+  master once they are frozen.
+"""
+
+import gc
+import logging
+import threading
+
+import psutil
+from django.conf import settings
+
+from .utils import get_rss_mb
+
+
+def is_enabled() -> bool:
+    return getattr(settings, "OCR_CONFIG", {}).get("ZYGOTE", False)
+
+
+def prepare_fork() -> None:
+    """Run in the master once the app is loaded, before the first worker is forked"""
+    from django.db import connections
+
+    connections.close_all()
+
+    threads = [
+        thread.name
+        for thread in threading.enumerate()
+        if thread is not threading.main_thread()
+    ]
+    if threads:
+        logging.warning(
+            "Threads running in the zygote are not copied to workers: %s",
+            ", ".join(threads),
+        )
+    native_threads = psutil.Process().num_threads() - 1 - len(threads)
+    if native_threads > 0:
+        logging.warning(
+            "%d native threads (e.g. OpenMP or ONNX Runtime pools) are running in "
+            "the zygote; forked workers do not get them",
+            native_threads,
+        )
+
+    gc.collect()
+    gc.freeze()
+    # Frozen objects are never collected, so the master may collect again
+    gc.enable()
+    logging.info(
+        "Zygote ready: %d objects frozen, RSS %.0f MB",
+        gc.get_freeze_count(),
+        get_rss_mb(),
+    )
+
+
+def after_fork() -> None:
+    """Run in each worker right after it is forked"""
+    gc.enable()
+
+
+def shared_memory_mb() -> dict:
+    """This process's resident memory split into private and shared pages"""
+    memory = psutil.Process().memory_full_info()
+    return {
+        "rss_mb": round(memory.rss / 1024 / 1024, 1),
+        "private_mb": round(memory.uss / 1024 / 1024, 1),
+        "shared_mb": round((memory.rss - memory.uss) / 1024 / 1024, 1),
+    }
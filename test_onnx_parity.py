@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Parity check of the PaddleONNX export against PaddleOCR.
+Run this script after exporting models: both engines read a synthetic lab
+sheet, and their text and word boxes must agree. Skipped when PaddleOCR or
+the ONNX models are not available; exits 1 on a mismatch.
+"""
+
+import difflib
+import os
+import sys
+
+# Add the project directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Sets up Django
+from benchmark_ocr import ONNX_PARITY_MIN_SIMILARITY, create_lab_sheet
+
+# Minimum overlap (intersection over union) of a word's boxes in both engines
+MIN_BOX_IOU = 0.5
+# Fraction of matched words whose boxes must overlap that much
+MIN_MATCHED_BOXES = 0.9
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x0, y0, x1, y1) boxes"""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def load_engines():
+    """Both engines, or None with the reason when either is unavailable"""
+    try:
+        from ocr.engines.paddle_ocr_engine import PaddleOCREngine
+        from ocr.engines.paddle_onnx_engine import PaddleONNXEngine
+    except ImportError as e:
+        return None, str(e)
+
+    engines = {"PaddleOCR": PaddleOCREngine(), "PaddleONNX": PaddleONNXEngine()}
+    for name, engine in engines.items():
+        engine.initialize()
+        ready, message = engine.is_ready()
+        if not ready:
+            return None, f"{name} not ready ({message})"
+    return engines, None
+
+
+def test_onnx_parity():
+    """Compare PaddleONNX with PaddleOCR on a synthetic lab sheet"""
+    print("=== PaddleONNX Parity Test ===")
+    engines, reason = load_engines()
+    if engines is None:
+        print(f"Skipped: {reason}")
+        return
+
+    page = create_lab_sheet(rows=16, height=900)
+    (paddle_text, _, _, paddle_words), (onnx_text, _, _, onnx_words) = (
+        engines["PaddleOCR"].extract_text_with_words(page),
+        engines["PaddleONNX"].extract_text_with_words(page),
+    )
+
+    similarity = difflib.SequenceMatcher(None, paddle_text, onnx_text).ratio()
+    print(f"Text similarity: {similarity:.3f}")
+    assert similarity >= ONNX_PARITY_MIN_SIMILARITY, (
+        f"Text similarity {similarity:.3f} below {ONNX_PARITY_MIN_SIMILARITY}\n"
+        f"  paddle: {paddle_text!r}\n  onnx:   {onnx_text!r}"
+    )
+
+    # Boxes of the words both engines read the same
+    matcher = difflib.SequenceMatcher(
+        None,
+        [word["text"] for word in paddle_words],
+        [word["text"] for word in onnx_words],
+        autojunk=False,
+    )
+    pairs = [
+        (paddle_words[block.a + i]["box"], onnx_words[block.b + i]["box"])
+        for block in matcher.get_matching_blocks()
+        for i in range(block.size)
+    ]
+    pairs = [(a, b) for a, b in pairs if a is not None and b is not None]
+    assert pairs, "No word boxes to compare"
+    overlapping = sum(box_iou(a, b) >= MIN_BOX_IOU for a, b in pairs)
+    print(f"Word boxes overlapping: {overlapping} of {len(pairs)}")
+    assert overlapping >= MIN_MATCHED_BOXES * len(pairs), (
+        f"Only {overlapping} of {len(pairs)} word boxes overlap "
+        f"with IoU >= {MIN_BOX_IOU}"
+    )
+
+    print(f"\n=== Test completed ===")
+
+
+if __name__ == "__main__":
+    try:
+        test_onnx_parity()
+    except AssertionError as e:
+        print(f"MISMATCH: {e}")
+        sys.exit(1)